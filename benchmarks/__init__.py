@@ -0,0 +1 @@
+"""Benchmarks for the Nobles and Peasants app."""
@@ -0,0 +1,117 @@
+"""Compare drink purchases with conditional coin updates and serialized transactions.
+
+Threads buy drinks in one party at once, on the nobles' tabs. "serialized"
+runs each purchase in one transaction that takes the write lock before it
+reads anything, the way every view used to. "conditional" is how
+actions.buy_drink runs now: the reads take no lock, and the write lock is
+only held for the conditional updates that spend the coin.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_coin --threads 8 --drinks 200
+"""
+import argparse
+import threading
+import time
+
+from flask import session
+
+from benchmarks.common import benchmark_app, create_party
+from nobles_and_peasants import actions
+from nobles_and_peasants.db import get_db, transaction
+
+
+def buy_drinks(app, party_id, player_names, num_drinks, serialized, barrier):
+    """Buy drinks for some players, once every thread is ready."""
+    barrier.wait()
+    for i in range(num_drinks):
+        with app.test_request_context():
+            session["party_id"] = party_id
+            player_name = player_names[i % len(player_names)]
+            if serialized:
+                with transaction():
+                    actions.buy_drink(player_name, "beer", 1)
+            else:
+                actions.buy_drink(player_name, "beer", 1)
+
+
+def time_drinks(app, party_id, peasants, num_threads, num_drinks, serialized):
+    """Time every thread buying drinks at once, and return the drinks per second."""
+    barrier = threading.Barrier(num_threads + 1)
+    threads = [
+        threading.Thread(
+            target=buy_drinks,
+            args=(
+                app,
+                party_id,
+                peasants[t::num_threads],
+                num_drinks,
+                serialized,
+                barrier,
+            ),
+        )
+        for t in range(num_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return num_threads * num_drinks / (time.perf_counter() - start)
+
+
+def run(num_threads, num_players, num_drinks, party_state, synchronous):
+    """Benchmark concurrent drink purchases in each mode."""
+    print(
+        f"{num_threads} threads buying {num_drinks} drinks each,"
+        f" party state {'on' if party_state else 'off'}, synchronous={synchronous}"
+    )
+    for mode in ("serialized", "conditional"):
+        with benchmark_app(
+            PASSWORD_HASH_WORKERS=0,
+            METRICS_ENABLED=False,
+            PARTY_STATE_ENABLED=party_state,
+            DB_SYNCHRONOUS=synchronous,
+        ) as app:
+            with app.app_context():
+                party_id = create_party("bench_party", num_players)
+                db = get_db()
+                # enough coin that no noble runs out during the benchmark
+                db.execute(
+                    "update players set coin = 1000000000 where player_status = 'noble'"
+                )
+                db.commit()
+                peasants = [
+                    row["player_name"]
+                    for row in db.execute(
+                        "select player_name from players where player_status = 'peasant'"
+                    )
+                ]
+
+            drinks_per_second = time_drinks(
+                app,
+                party_id,
+                peasants,
+                num_threads,
+                num_drinks,
+                serialized=mode == "serialized",
+            )
+            print(f"{mode:<12} {drinks_per_second:>9.0f} drinks/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--drinks", type=int, default=200)
+    parser.add_argument("--party-state", action="store_true")
+    parser.add_argument("--synchronous", default="normal")
+    args = parser.parse_args()
+    run(
+        num_threads=args.threads,
+        num_players=args.players,
+        num_drinks=args.drinks,
+        party_state=args.party_state,
+        synchronous=args.synchronous,
+    )
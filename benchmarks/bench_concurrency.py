@@ -0,0 +1,203 @@
+"""Compare how many open connections the WSGI and ASGI modes can hold.
+
+Opens a number of live viewers, like TV screens showing the leaderboard,
+and then times page views while the viewers stay connected. The WSGI mode
+is a server with a fixed pool of threads, as under gunicorn with --threads.
+The ASGI mode needs uvicorn:
+
+    pip install uvicorn
+
+Run from the repository root:
+
+    python -m benchmarks.bench_concurrency --viewers 200 --threads 16
+"""
+import argparse
+import http.client
+import selectors
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from benchmarks.common import benchmark_app, create_party, session_cookie
+from nobles_and_peasants.asgi import AsgiApp
+
+HOST = "127.0.0.1"
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Handle a request without logging it."""
+
+    def log_request(self, *args, **kwargs):
+        """Skip the access log."""
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server that handles each connection on a fixed pool of threads."""
+
+    def __init__(self, host, port, app, threads):
+        """Start listening, with room for many waiting connections."""
+        self.request_queue_size = 1024
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        """Handle a connection once a thread is free."""
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        """Handle a connection and close it."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve_wsgi(app, threads):
+    """Serve the app in the background with a fixed pool of threads.
+
+    Returns:
+        Tuple[int, Callable[[], None]]: The port, and a function that stops
+            the server
+    """
+    server = PooledWSGIServer(HOST, 0, app, threads=threads)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        # open streams end at their next heartbeat, once they see the
+        # viewer is gone
+        server.executor.shutdown(cancel_futures=True)
+        server.server_close()
+
+    return server.server_port, stop
+
+
+def serve_asgi(app, threads):
+    """Serve the app in the background with uvicorn.
+
+    Returns:
+        Tuple[int, Callable[[], None]]: The port, and a function that stops
+            the server
+    """
+    import uvicorn
+
+    app.config["ASGI_THREADS"] = threads
+    sock = socket.socket()
+    sock.bind((HOST, 0))
+    config = uvicorn.Config(
+        AsgiApp(app), log_level="warning", timeout_graceful_shutdown=2
+    )
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]})
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return sock.getsockname()[1], stop
+
+
+def open_viewers(port, cookie, num_viewers, timeout):
+    """Open live streams and count the viewers that get their first event.
+
+    Returns:
+        Tuple[List[socket.socket], int]: The open sockets, and the number of
+            viewers that got a snapshot within timeout seconds
+    """
+    request = f"GET /live HTTP/1.1\r\nHost: {HOST}\r\nCookie: {cookie}\r\n\r\n"
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for _ in range(num_viewers):
+        sock = socket.create_connection((HOST, port))
+        sock.sendall(request.encode())
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, data=bytearray())
+        sockets.append(sock)
+
+    num_connected = 0
+    deadline = time.monotonic() + timeout
+    while num_connected < num_viewers and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=deadline - time.monotonic()):
+            key.data.extend(key.fileobj.recv(65536))
+            if b"event: snapshot" in key.data:
+                num_connected += 1
+                selector.unregister(key.fileobj)
+    selector.close()
+    return sockets, num_connected
+
+
+def time_page_views(port, cookie, num_requests, timeout):
+    """Time page views of the leaderboard.
+
+    Returns:
+        Tuple[List[float], int]: The seconds taken by each page view that
+            answered, and the number of page views that timed out
+    """
+    times = []
+    failures = 0
+    for _ in range(num_requests):
+        conn = http.client.HTTPConnection(HOST, port, timeout=timeout)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", "/leaderboard", headers={"Cookie": cookie})
+            conn.getresponse().read()
+            times.append(time.perf_counter() - start)
+        except OSError:
+            failures += 1
+        finally:
+            conn.close()
+    return times, failures
+
+
+def run(num_viewers, num_threads, num_requests, num_players):
+    """Benchmark page views with live viewers connected in each mode."""
+    modes = {"wsgi": serve_wsgi, "asgi": serve_asgi}
+    print(f"{num_viewers} viewers, {num_threads} threads")
+    for mode, serve in modes.items():
+        with benchmark_app(LIVE_HEARTBEAT_SECONDS=1) as app:
+            with app.app_context():
+                party_id = create_party("bench_party", num_players)
+            cookie = session_cookie(app, party_id, "bench_party")
+            try:
+                port, stop = serve(app, threads=num_threads)
+            except ImportError as e:
+                print(f"{mode:<6} skipped: {e}")
+                continue
+
+            sockets, num_connected = open_viewers(port, cookie, num_viewers, timeout=5)
+            times, failures = time_page_views(port, cookie, num_requests, timeout=2)
+            for sock in sockets:
+                sock.close()
+            stop()
+
+            p50 = statistics.median(times) * 1000 if times else float("nan")
+            print(
+                f"{mode:<6} {num_connected:>6}/{num_viewers} viewers connected"
+                f" {p50:>9.1f} ms median page view"
+                f" {failures:>4}/{num_requests} page views timed out"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--players", type=int, default=50)
+    args = parser.parse_args()
+    run(
+        num_viewers=args.viewers,
+        num_threads=args.threads,
+        num_requests=args.requests,
+        num_players=args.players,
+    )
@@ -0,0 +1,58 @@
+"""Compare requests per second with and without the tuned connection layer.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_connections --requests 2000
+"""
+import argparse
+import itertools
+
+from benchmarks.common import benchmark_app, create_party, log_in, time_calls
+
+MODES = {
+    # the behavior before connections were reused: a new connection per
+    # request with sqlite's default rollback journal and full syncs
+    "per-request connection": {
+        "DB_REUSE_CONNECTIONS": False,
+        "DB_JOURNAL_MODE": "delete",
+        "DB_SYNCHRONOUS": "full",
+        "DB_MMAP_SIZE": None,
+        "DB_CACHE_SIZE": None,
+    },
+    "reused connection + wal": {},
+}
+
+
+def run(num_requests, num_players):
+    """Benchmark a mix of page views and drink purchases in each mode."""
+    for mode, config in MODES.items():
+        with benchmark_app(**config) as app:
+            with app.app_context():
+                party_id = create_party("bench_party", num_players)
+            client = app.test_client()
+            log_in(client, party_id, "bench_party")
+
+            players = itertools.cycle(range(num_players))
+
+            def request():
+                i = next(players)
+                if i % 2 == 0:
+                    client.get("/main")
+                else:
+                    data = {
+                        "player_name": f"player_{i}",
+                        "drink_name": "water",
+                        "quantity": 1,
+                    }
+                    client.post("/buy_drink", data=data)
+
+            rps = time_calls(request, num_requests)
+            print(f"{mode:<26} {rps:>10.1f} requests/second")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=50)
+    args = parser.parse_args()
+    run(num_requests=args.requests, num_players=args.players)
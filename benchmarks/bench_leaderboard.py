@@ -0,0 +1,58 @@
+"""Measure how long it takes to read the leaderboard as parties grow.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_leaderboard --sizes 10 1000 100000
+"""
+import argparse
+
+from flask import session
+
+from benchmarks.common import benchmark_app, create_party, time_calls
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.players import get_all_nobles, get_almighty_ruler
+
+MODES = {
+    # sqlite sorts the whole party on every read, as it did before the
+    # leaderboard indexes existed
+    "sorted on read": {"drop_indexes": True, "config": {}},
+    "leaderboard index": {"drop_indexes": False, "config": {}},
+    "in-memory ranking": {
+        "drop_indexes": False,
+        "config": {"PARTY_STATE_ENABLED": True},
+    },
+}
+
+
+def run(sizes, num_calls):
+    """Benchmark reading the top of the leaderboard for each party size."""
+    for num_players in sizes:
+        for mode, options in MODES.items():
+            with benchmark_app(**options["config"]) as app:
+                with app.app_context():
+                    party_id = create_party("bench_party", num_players)
+                    if options["drop_indexes"]:
+                        get_db().execute("drop index players_leaderboard")
+                        get_db().execute("drop index players_ruler")
+
+                def show_leaderboard():
+                    with app.test_request_context():
+                        session["party_id"] = party_id
+                        get_all_nobles(limit=app.config["LEADERBOARD_SIZE"])
+                        get_almighty_ruler()
+
+                # the first read loads the party into memory
+                show_leaderboard()
+                calls_per_second = time_calls(show_leaderboard, num_calls)
+                print(
+                    f"{num_players:>7} players  {mode:<18} "
+                    f"{1000 / calls_per_second:>8.3f} ms/read"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+    run(sizes=args.sizes, num_calls=args.calls)
@@ -0,0 +1,88 @@
+"""Measure how long it takes to create a party with its default content.
+
+Password hashing is left out, since it costs the same either way. Run from
+the repository root:
+
+    python -m benchmarks.bench_party_creation --parties 500
+"""
+import argparse
+import itertools
+import re
+
+from benchmarks.common import PASSWORD_HASH, benchmark_app, time_calls
+from nobles_and_peasants import default_values
+from nobles_and_peasants.db import get_db, transaction
+from nobles_and_peasants.parties import init_party
+from nobles_and_peasants.query import execute
+
+
+def _sql_literal(value):
+    """Quote a value for the templated script."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def _templated_script():
+    """Build the default_values.sql script that parties were created from before."""
+    tables = [
+        ("drinks (party_id, drink_name, drink_cost)", default_values.DRINKS),
+        ("starting_coin (party_id, player_status, coin)", default_values.STARTING_COIN),
+        ("quest_rewards (party_id, difficulty, reward)", default_values.QUEST_REWARDS),
+        ("quests (party_id, quest, difficulty)", default_values.QUESTS),
+        ("challenges (party_id, challenge)", [(c,) for c in default_values.CHALLENGES]),
+    ]
+    statements = []
+    for table, rows in tables:
+        values = ",\n".join(
+            "(~PARTY_ID~, " + ", ".join(_sql_literal(v) for v in row) + ")"
+            for row in rows
+        )
+        statements.append(f"insert into {table} values\n{values};")
+    return "\n\n".join(statements)
+
+
+def create_party_from_script(party_name, script):
+    """Create a party the way it was done before: two commits and a script."""
+    db = get_db()
+    query = "insert into parties (party_name, password) values (?, ?)"
+    execute(query=query, args=[party_name, PASSWORD_HASH], commit=True)
+    query = "select id from parties where party_name = ?"
+    party_id = db.execute(query, [party_name]).fetchone()[0]
+    db.executescript(re.sub("~PARTY_ID~", str(party_id), script))
+    db.commit()
+
+
+def create_party(party_name):
+    """Create a party in one transaction, as insert_new_party does."""
+    with transaction():
+        query = "insert into parties (party_name, password) values (?, ?)"
+        party_id = execute(query=query, args=[party_name, PASSWORD_HASH], commit=False)
+        init_party(party_id=party_id, commit=False)
+
+
+def run(num_parties, synchronous):
+    """Benchmark creating parties with each approach."""
+    script = _templated_script()
+    modes = {
+        "templated sql script": lambda name: create_party_from_script(name, script),
+        "executemany in one transaction": create_party,
+    }
+    for mode, create in modes.items():
+        with benchmark_app(DB_SYNCHRONOUS=synchronous) as app:
+            with app.app_context():
+                names = (f"party_{i}" for i in itertools.count())
+                parties_per_second = time_calls(
+                    lambda: create(next(names)), num_parties
+                )
+            print(f"{mode:<32} {1000 / parties_per_second:>8.3f} ms/party")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=500)
+    parser.add_argument(
+        "--synchronous", default="normal", help="sqlite synchronous pragma"
+    )
+    args = parser.parse_args()
+    run(num_parties=args.parties, synchronous=args.synchronous)
@@ -0,0 +1,72 @@
+"""Measure the party name and id checks that run on every signup.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_party_lookup --parties 1000000
+"""
+import argparse
+import itertools
+
+from benchmarks.common import PASSWORD_HASH, benchmark_app, time_calls
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.parties import does_party_id_exist, does_party_name_exist
+from nobles_and_peasants.query import fetch_all
+
+
+def scan_for_party_name(party_name):
+    """Check for a party name by loading every party, as was done before."""
+    parties = fetch_all(query="select party_name from parties", args=[])
+    return party_name in [row["party_name"] for row in parties]
+
+
+def scan_for_party_id(party_id):
+    """Check for a party id by loading every party, as was done before."""
+    parties = fetch_all(query="select id from parties", args=[])
+    return int(party_id) in [row["id"] for row in parties]
+
+
+def run(num_parties, num_calls, num_scan_calls):
+    """Benchmark each existence check against a database with many parties."""
+    with benchmark_app() as app:
+        with app.app_context():
+            db = get_db()
+            db.executemany(
+                "insert into parties (party_name, password) values (?, ?)",
+                ((f"party_{i}", PASSWORD_HASH) for i in range(num_parties)),
+            )
+            db.commit()
+
+            names = itertools.cycle(["party_0", "not_a_party"])
+            ids = itertools.cycle([1, num_parties + 1])
+            checks = {
+                "name: load every party": (
+                    lambda: scan_for_party_name(next(names)),
+                    num_scan_calls,
+                ),
+                "name: unique index": (
+                    lambda: does_party_name_exist(next(names)),
+                    num_calls,
+                ),
+                "id: load every party": (
+                    lambda: scan_for_party_id(next(ids)),
+                    num_scan_calls,
+                ),
+                "id: primary key": (lambda: does_party_id_exist(next(ids)), num_calls),
+            }
+            print(f"{num_parties} parties")
+            for check, (func, calls) in checks.items():
+                calls_per_second = time_calls(func, calls)
+                print(f"{check:<24} {1000 / calls_per_second:>10.4f} ms/check")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=1000000)
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--scan-calls", type=int, default=4)
+    args = parser.parse_args()
+    run(
+        num_parties=args.parties,
+        num_calls=args.calls,
+        num_scan_calls=args.scan_calls,
+    )
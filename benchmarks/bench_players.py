@@ -0,0 +1,202 @@
+"""Time the functions in players.py against small, large and huge parties.
+
+Each function is called directly in a request context, without routing,
+templates or sessions, against parties of each size in a database that
+also holds many other parties. Writes are made in pairs that undo each
+other, or are undone after each call without being timed, so every call
+sees the same party.
+
+The median time of each function is compared with a stored baseline, and
+any that got slower by more than --threshold are flagged. The exit status
+is 1 if there is a regression, so the benchmark can run in CI. Timings
+depend on the machine, so save a new baseline when you change machines:
+
+    python -m benchmarks.bench_players --save-baseline
+
+Run from the repository root:
+
+    python -m benchmarks.bench_players --sizes 10 1000 100000
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+from flask import session
+
+from benchmarks.common import benchmark_app, create_party
+from nobles_and_peasants.players import (
+    change_noble_to_peasant,
+    change_peasant_to_noble,
+    find_richest_peasant,
+    get_all_players,
+    get_single_player,
+    increment_coin,
+    set_allegiance,
+    update_after_pledge_allegiance,
+    upgrade_peasant_and_downgrade_noble,
+)
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "bench_players.json")
+
+
+def time_function(func, max_calls, max_seconds, undo=None):
+    """Call a function until max_calls or max_seconds is reached.
+
+    Args:
+        func (Callable): The function to time
+        max_calls (int): The most calls to make
+        max_seconds (float): Stop calling after this long
+        undo (Callable): Undo the writes of a call before the next one. It
+            isn't timed.
+
+    Returns:
+        float: The median milliseconds per call
+    """
+    times = []
+    deadline = time.perf_counter() + max_seconds
+    # at least a few calls, so the median means something
+    while len(times) < 3 or (len(times) < max_calls and time.perf_counter() < deadline):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if undo is not None:
+            undo()
+    return statistics.median(times) * 1000
+
+
+def party_functions(num_players):
+    """Build a call of each function against a party made by create_party.
+
+    The first fifth of the players are nobles and the rest are peasants,
+    so player_0 and player_1 are nobles and the last two players are
+    peasants. Must be called in a request context for the party.
+
+    Returns:
+        Dict[str, Callable | Tuple[Callable, Callable]]: Each function, or
+            each function and the undo of its writes, by name
+    """
+    peasant = f"player_{num_players - 1}"
+    # promoted and put back on every call, so its coin doesn't grow
+    promoted = f"player_{num_players - 2}"
+    promoted_coin = get_single_player(player_name=promoted, col="coin")
+    promoted_noble = get_single_player(player_name=promoted, col="noble_name")
+    nobles = itertools.cycle(["player_0", "player_1"])
+    # each upgrade swaps the two players back
+    swaps = itertools.cycle([(peasant, "player_1"), ("player_1", peasant)])
+    names = itertools.cycle([f"player_{i}" for i in range(0, num_players, 7)])
+
+    def upgrade():
+        peasant_name, noble_name = next(swaps)
+        upgrade_peasant_and_downgrade_noble(
+            peasant_name=peasant_name, noble_name=noble_name
+        )
+
+    def demote():
+        coin = get_single_player(player_name=promoted, col="coin")
+        change_noble_to_peasant(player_name=promoted)
+        set_allegiance(player_name=promoted, noble_name=promoted_noble)
+        increment_coin(player_name=promoted, coin=promoted_coin - coin)
+
+    return {
+        "get_all_players": get_all_players,
+        "get_single_player": lambda: get_single_player(player_name=next(names)),
+        "find_richest_peasant": find_richest_peasant,
+        "update_after_pledge_allegiance": lambda: update_after_pledge_allegiance(
+            player_name=peasant, noble_name=next(nobles)
+        ),
+        "change_peasant_to_noble": (
+            lambda: change_peasant_to_noble(player_name=promoted),
+            demote,
+        ),
+        "upgrade_peasant_and_downgrade_noble": upgrade,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print each result next to its baseline, and list the regressions."""
+    regressions = []
+    for key, ms in results.items():
+        line = f"{key:<48} {ms:>10.4f} ms"
+        old = baseline.get(key)
+        if old is not None:
+            change = (ms - old) / old
+            line += f" {old:>10.4f} ms {change:>+8.0%}"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions.append(key)
+        print(line)
+    return regressions
+
+
+def run(sizes, num_other_parties, other_party_size, max_calls, max_seconds):
+    """Time every function against a party of each size.
+
+    Returns:
+        Dict[str, float]: The median milliseconds per call, by function and
+            party size
+    """
+    results = {}
+    with benchmark_app() as app:
+        with app.app_context():
+            for i in range(num_other_parties):
+                create_party(f"other_party_{i}", other_party_size)
+            party_ids = {size: create_party(f"party_{size}", size) for size in sizes}
+
+        for size, party_id in party_ids.items():
+            with app.test_request_context():
+                session["party_id"] = party_id
+                for name, func in party_functions(size).items():
+                    func, undo = func if isinstance(func, tuple) else (func, None)
+                    ms = time_function(func, max_calls, max_seconds, undo=undo)
+                    results[f"{name}[{size}]"] = ms
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--other-parties", type=int, default=1000)
+    parser.add_argument("--other-party-size", type=int, default=30)
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="Flag functions that are slower than the baseline by this fraction.",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results as the new baseline.",
+    )
+    args = parser.parse_args()
+
+    results = run(
+        sizes=args.sizes,
+        num_other_parties=args.other_parties,
+        other_party_size=args.other_party_size,
+        max_calls=args.calls,
+        max_seconds=args.seconds,
+    )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"{'function[players]':<48} {'now':>13} {'baseline':>13} {'change':>8}")
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f"Saved the baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} functions are more than {args.threshold:.0%} slower")
+        sys.exit(1)
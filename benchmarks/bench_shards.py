@@ -0,0 +1,97 @@
+"""Compare write throughput with every party in one file or in files of their own.
+
+Each thread plays a different party and signs in new players as fast as it
+can. In one file, every write waits for the single write lock. With
+DB_SHARDS_FOLDER set, each party is split into a file of its own first, so
+parties only wait for their own writes. Commits wait for the disk by
+default (--synchronous FULL), since that is when holding the write lock is
+costly; in one process the Python work of a request is otherwise the limit.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_shards --parties 8 --writes 200
+"""
+import argparse
+import os
+import threading
+import time
+
+from benchmarks.common import benchmark_app, create_party, log_in
+from nobles_and_peasants.db import split_party
+
+
+def play_party(app, party_id, party_name, num_writes, barrier):
+    """Sign in new players to a party, once every thread is ready."""
+    client = app.test_client()
+    log_in(client, party_id, party_name)
+    barrier.wait()
+    for i in range(num_writes):
+        response = client.post(
+            "/sign_in", data={"player_name": f"new_{i}", "player_status": "noble"}
+        )
+        assert response.status_code == 302, response.status_code
+
+
+def time_writes(app, parties, num_writes):
+    """Time every party writing at once, and return the writes per second."""
+    barrier = threading.Barrier(len(parties) + 1)
+    threads = [
+        threading.Thread(
+            target=play_party, args=(app, party_id, party_name, num_writes, barrier)
+        )
+        for party_id, party_name in parties
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return len(parties) * num_writes / (time.perf_counter() - start)
+
+
+def run(num_parties, num_players, num_writes, synchronous):
+    """Benchmark concurrent writes to separate parties in each layout."""
+    print(
+        f"{num_parties} parties writing at once, {num_writes} writes each,"
+        f" synchronous={synchronous}"
+    )
+    for layout in ("one file", "sharded"):
+        with benchmark_app(
+            PASSWORD_HASH_WORKERS=0,
+            METRICS_ENABLED=False,
+            DB_SYNCHRONOUS=synchronous,
+        ) as app:
+            with app.app_context():
+                parties = [
+                    (create_party(f"party_{i}", num_players), f"party_{i}")
+                    for i in range(num_parties)
+                ]
+            if layout == "sharded":
+                folder = os.path.dirname(app.config["DATABASE"])
+                app.config["DB_SHARDS_FOLDER"] = os.path.join(folder, "shards")
+                with app.app_context():
+                    for party_id, _ in parties:
+                        split_party(party_id=party_id, prune=True)
+
+            writes_per_second = time_writes(app, parties, num_writes)
+            print(f"{layout:<9} {writes_per_second:>9.0f} writes/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=8)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument(
+        "--synchronous",
+        default="FULL",
+        help="The DB_SYNCHRONOUS pragma. FULL waits for the disk on every commit.",
+    )
+    args = parser.parse_args()
+    run(
+        num_parties=args.parties,
+        num_players=args.players,
+        num_writes=args.writes,
+        synchronous=args.synchronous,
+    )
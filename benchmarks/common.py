@@ -0,0 +1,97 @@
+"""Helpers shared by the benchmarks."""
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+
+from nobles_and_peasants import create_app
+from nobles_and_peasants.db import close_pooled_connections, get_db, init_db
+from nobles_and_peasants.parties import init_party
+
+# benchmarks never log in with a password, so a cheap hash is good enough
+PASSWORD_HASH = generate_password_hash("benchmark", method="pbkdf2:sha256:1")
+
+
+@contextmanager
+def benchmark_app(**config):
+    """Create an app backed by a fresh database in a temporary folder."""
+    tmp_dir = tempfile.mkdtemp(prefix="nobles_and_peasants_bench_")
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join(tmp_dir, "bench.sqlite"),
+            **config,
+        }
+    )
+    with app.app_context():
+        init_db()
+    try:
+        yield app
+    finally:
+        with app.app_context():
+            close_pooled_connections()
+        shutil.rmtree(tmp_dir)
+
+
+def create_party(party_name, num_players):
+    """Add a party with default settings and players to the database.
+
+    Roughly one in five players is a noble, and every peasant is allied to a
+    noble. Must be called inside an app context.
+
+    Returns:
+        int: The id of the new party
+    """
+    db = get_db()
+    cur = db.execute(
+        "insert into parties (party_name, password) values (?, ?)",
+        [party_name, PASSWORD_HASH],
+    )
+    party_id = cur.lastrowid
+    init_party(party_id=party_id)
+
+    num_nobles = max(2, num_players // 5)
+    rows = []
+    for i in range(num_players):
+        player_name = f"player_{i}"
+        if i < num_nobles:
+            soldiers = 1 + len(range(num_nobles + i, num_players, num_nobles))
+            rows.append((party_id, player_name, "noble", 50, player_name, 0, soldiers))
+        else:
+            noble_name = f"player_{i % num_nobles}"
+            rows.append((party_id, player_name, "peasant", i % 7, noble_name, 0, 0))
+    db.executemany(
+        """
+        insert into players (party_id, player_name, player_status, coin, noble_name, drinks, soldiers)
+        values (?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    db.commit()
+    return party_id
+
+
+def log_in(client, party_id, party_name):
+    """Put a party in the session of a test client without hashing a password."""
+    with client.session_transaction() as session:
+        session["party_id"] = party_id
+        session["party_name"] = party_name
+
+
+def session_cookie(app, party_id, party_name):
+    """Build a session cookie that logs in to a party, for clients over http."""
+    serializer = app.session_interface.get_signing_serializer(app)
+    value = serializer.dumps({"party_id": party_id, "party_name": party_name})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def time_calls(func, num_calls):
+    """Call a function repeatedly and return the number of calls per second."""
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        func()
+    elapsed = time.perf_counter() - start
+    return num_calls / elapsed
@@ -0,0 +1,390 @@
+"""Simulate party nights and report the latency of each route.
+
+Signs up a number of parties, signs in their players, and then has the
+players take a mix of actions through the real routes, the way their phones
+would: each form post is followed by the redirect to the main page. By
+default the app runs in-process with a test client, against a fresh
+database. Pass --url to load a running server instead.
+
+Run from the repository root:
+
+    python -m benchmarks.loadgen --parties 10 --players 30 --actions 5000
+    python -m benchmarks.loadgen --url http://127.0.0.1:5000 --threads 8
+    python -m benchmarks.loadgen --set PARTY_STATE_ENABLED=true --output after.json --baseline before.json
+
+The report has the throughput and p50/p95/p99 latency of each route. With
+--output it is saved as JSON, and --baseline prints the change from a
+saved report.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.common import benchmark_app
+
+# how often each action is taken, relative to the others
+DEFAULT_MIX = {
+    "sign_in": 2,
+    "pledge": 10,
+    "buy_drink": 35,
+    "quest": 15,
+    "kill": 8,
+    "leaderboard": 15,
+    "kingdom": 10,
+    "main": 5,
+}
+
+# roughly one in five players is a noble, as the game suggests
+NOBLE_SHARE = 0.2
+
+
+class TestClient:
+    """Send requests to an app in this process."""
+
+    def __init__(self, app):
+        """Initialize a client with its own session."""
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        """Send a request and return the status and redirect location."""
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get("Location")
+
+
+class HTTPClient:
+    """Send requests to a running server, keeping the session cookie."""
+
+    def __init__(self, url):
+        """Initialize a client with its own session."""
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        """Send a request and return the status and redirect location."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie is not None:
+            headers["Cookie"] = self.cookie
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            set_cookie = response.getheader("Set-Cookie")
+            if set_cookie is not None:
+                self.cookie = set_cookie.split(";", 1)[0]
+            return response.status, response.getheader("Location")
+        finally:
+            conn.close()
+
+
+class Stats:
+    """The latency of every request, by route."""
+
+    def __init__(self):
+        """Initialize empty stats."""
+        self.seconds = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        """Record a request."""
+        with self.lock:
+            self.seconds[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(sorted_values, pct):
+    """Get a percentile of sorted values, by the nearest rank."""
+    index = max(0, round(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class Party:
+    """A party of simulated players and the client that their phones share.
+
+    Args:
+        client (TestClient or HTTPClient): The client, logged in to the party
+        stats (Stats): Where the latency of each request is recorded
+        rng (random.Random): Decides what the players do
+    """
+
+    def __init__(self, client, stats, rng):
+        """Initialize a party with no players."""
+        self.client = client
+        self.stats = stats
+        self.rng = rng
+        self.nobles = []
+        self.peasants = []
+
+    def send(self, method, path, data=None):
+        """Send a request, following a redirect like a browser would."""
+        route = f"{method} {path}"
+        start = time.perf_counter()
+        try:
+            status, location = self.client.request(method, path, data)
+            ok = status < 400
+        except OSError:
+            status, location, ok = None, None, False
+        self.stats.record(route, time.perf_counter() - start, ok)
+        if status in (301, 302, 303) and location:
+            self.send("GET", urlsplit(location).path)
+
+    def sign_up(self, party_name):
+        """Create the party and log in to it."""
+        data = {"party_name": party_name, "password": "loadgen"}
+        self.send("POST", "/auth/signup", data)
+        self.send("POST", "/auth/login", data)
+
+    def _random_player(self):
+        """Pick any player."""
+        return self.rng.choice(self.nobles + self.peasants)
+
+    def sign_in(self):
+        """Sign in a new player."""
+        player_name = f"player_{len(self.nobles) + len(self.peasants)}"
+        # the first two players are nobles, so every party has a ruler
+        if len(self.nobles) < 2 or self.rng.random() < NOBLE_SHARE:
+            status, players = "noble", self.nobles
+        else:
+            status, players = "peasant", self.peasants
+        self.send(
+            "POST", "/sign_in", {"player_name": player_name, "player_status": status}
+        )
+        players.append(player_name)
+
+    def pledge(self):
+        """Have a peasant join a noble's army."""
+        if not self.peasants:
+            return self.sign_in()
+        data = {
+            "player_name": self.rng.choice(self.peasants),
+            "noble_name": self.rng.choice(self.nobles),
+        }
+        self.send("POST", "/pledge", data)
+
+    def buy_drink(self):
+        """Have a player buy a round."""
+        data = {
+            "player_name": self._random_player(),
+            "drink_name": self.rng.choice(["beer", "water"]),
+            "quantity": self.rng.choice([1, 1, 1, 2]),
+        }
+        self.send("POST", "/buy_drink", data)
+
+    def quest(self):
+        """Have a player draw a quest and report how it went."""
+        data = {
+            "player_name": self._random_player(),
+            "difficulty": self.rng.choice(["easy", "medium", "hard"]),
+        }
+        self.send("POST", "/get_quest", data)
+        data["result"] = self.rng.choice(["Yes", "No"])
+        self.send("POST", "/add_money", data)
+
+    def kill(self):
+        """Have a player try to assassinate another player."""
+        player_name = self._random_player()
+        target_name = self._random_player()
+        if player_name == target_name:
+            return
+        data = {"player_name": player_name, "target_name": target_name}
+        self.send("POST", "/kill", data)
+        data["winner_name"] = self.rng.choice([player_name, target_name])
+        self.send("POST", "/assassinate", data)
+
+    def leaderboard(self):
+        """Look at the leaderboard."""
+        self.send("GET", "/leaderboard")
+
+    def kingdom(self):
+        """Look at the kingdom."""
+        self.send("GET", "/kingdom")
+
+    def main(self):
+        """Look at the main page."""
+        self.send("GET", "/main")
+
+
+def parse_mix(text):
+    """Parse an action mix like 'buy_drink=50,leaderboard=50'."""
+    mix = {}
+    for item in text.split(","):
+        action, weight = item.split("=")
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"{action} is not an action")
+        mix[action] = float(weight)
+    return mix
+
+
+def parse_setting(text):
+    """Parse an app setting like 'PARTY_STATE_ENABLED=true'."""
+    key, value = text.split("=", 1)
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def summarize(stats, wall_seconds):
+    """Compute the throughput and latency percentiles of each route."""
+    routes = {}
+    everything = []
+    for route, seconds in sorted(stats.seconds.items()):
+        everything.extend(seconds)
+        routes[route] = _summarize_times(sorted(seconds), wall_seconds)
+        routes[route]["errors"] = stats.errors[route]
+    total = _summarize_times(sorted(everything), wall_seconds)
+    total["errors"] = sum(stats.errors.values())
+    return routes, total
+
+
+def _summarize_times(seconds, wall_seconds):
+    """Summarize the sorted latencies of some requests."""
+    return {
+        "requests": len(seconds),
+        "throughput": len(seconds) / wall_seconds,
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p95_ms": percentile(seconds, 95) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+    }
+
+
+def print_report(report, baseline=None):
+    """Print the report as a table, with the change from a baseline if given."""
+    header = f"{'route':<24} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    print(header)
+    rows = [*report["routes"].items(), ("total", report["total"])]
+    for route, r in rows:
+        line = (
+            f"{route:<24} {r['requests']:>9} {r['throughput']:>9.1f}"
+            f" {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}"
+            f" {r['errors']:>7}"
+        )
+        if baseline is not None:
+            old = (
+                baseline["total"] if route == "total" else baseline["routes"].get(route)
+            )
+            if old is not None:
+                change = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+                line += f"   p95 {change:+.0f}% vs baseline"
+        print(line)
+
+
+def run(args):
+    """Sign up the parties, take the actions and build the report."""
+    mix = args.mix or DEFAULT_MIX
+    actions, weights = zip(*mix.items())
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+
+    if args.url is None:
+        config = {
+            # logins are part of the setup, not the load
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+            "PASSWORD_HASH_WORKERS": 0,
+            **dict(args.set),
+        }
+        context = benchmark_app(**config)
+    else:
+        context = nullcontext()
+
+    with context as app:
+        parties = []
+        for i in range(args.parties):
+            client = HTTPClient(args.url) if app is None else TestClient(app)
+            party = Party(client, Stats(), random.Random(args.seed + i))
+            party.sign_up(f"loadgen_{run_id}_{i}")
+            for _ in range(args.players):
+                party.sign_in()
+            party.stats = stats
+            parties.append(party)
+
+        # each thread drives its own parties, since a client isn't thread safe
+        def drive(my_parties, num_actions, seed):
+            rng = random.Random(seed)
+            for _ in range(num_actions):
+                party = rng.choice(my_parties)
+                getattr(party, rng.choices(actions, weights)[0])()
+
+        threads = []
+        num_threads = min(args.threads, len(parties))
+        for t in range(num_threads):
+            num_actions = args.actions // num_threads
+            thread = threading.Thread(
+                target=drive,
+                args=[parties[t::num_threads], num_actions, args.seed + t],
+            )
+            threads.append(thread)
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+    routes, total = summarize(stats, wall_seconds)
+    return {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "in-process",
+        "settings": dict(args.set),
+        "parties": args.parties,
+        "players": args.players,
+        "actions": args.actions,
+        "threads": num_threads,
+        "mix": mix,
+        "wall_seconds": wall_seconds,
+        "routes": routes,
+        "total": total,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=5)
+    parser.add_argument("--players", type=int, default=30)
+    parser.add_argument("--actions", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help="Weights of each action, like 'buy_drink=50,leaderboard=50'. "
+        f"Actions: {', '.join(DEFAULT_MIX)}.",
+    )
+    parser.add_argument("--url", help="Load a running server instead.")
+    parser.add_argument(
+        "--set",
+        type=parse_setting,
+        action="append",
+        default=[],
+        help="Change an app setting of the in-process app, like PARTY_STATE_ENABLED=true.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Save the report as JSON.")
+    parser.add_argument("--baseline", help="Compare with a report saved with --output.")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -10,6 +10,55 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY="dev",
         DATABASE=os.path.join(app.instance_path, "nobles_and_peasants.sqlite"),
+        # "sqlite" keeps the database on disk, "memory" in memory. See db.py.
+        DB_BACKEND="sqlite",
+        # keep one open connection per worker thread instead of one per request
+        DB_REUSE_CONNECTIONS=True,
+        # sqlite pragmas applied to every new connection. None keeps the default.
+        DB_JOURNAL_MODE="wal",
+        DB_SYNCHRONOUS="normal",
+        DB_MMAP_SIZE=64 * 1024 * 1024,
+        DB_CACHE_SIZE=-8000,
+        DB_BUSY_TIMEOUT=5000,
+        # give each party a database file of its own in this folder. See db.py.
+        DB_SHARDS_FOLDER=None,
+        DB_SHARD_CONNECTIONS=64,
+        # parties kept in memory are dropped after sitting idle this long. See db.py.
+        DB_MEMORY_IDLE_SECONDS=24 * 60 * 60,
+        # number of parties whose quest and challenge decks are kept in memory
+        DECK_CACHE_SIZE=1000,
+        # keep the players of active parties in memory. See party_state.py.
+        PARTY_STATE_ENABLED=False,
+        PARTY_STATE_CACHE_SIZE=100,
+        PARTY_STATE_IDLE_SECONDS=60 * 60,
+        # number of nobles shown on the leaderboard. None shows every noble.
+        LEADERBOARD_SIZE=100,
+        # party settings are cached in memory. See settings.py.
+        SETTINGS_CACHE_SIZE=1000,
+        SETTINGS_CACHE_TTL=30,
+        # passwords are hashed in a process pool. See passwords.py.
+        PASSWORD_HASH_METHOD="scrypt:32768:8:1",
+        PASSWORD_HASH_WORKERS=None,
+        PASSWORD_HASH_QUEUE_SIZE=32,
+        # live kingdom and leaderboard pages. See live.py.
+        LIVE_QUEUE_SIZE=100,
+        LIVE_HEARTBEAT_SECONDS=15,
+        # threads that run the views when served with asgi.py
+        ASGI_THREADS=32,
+        # chunks of a response queued for the client before its thread waits
+        ASGI_QUEUED_CHUNKS=16,
+        # save the players of a party after this many game events. See events.py.
+        EVENT_SNAPSHOT_INTERVAL=1000,
+        # time each request and its sql statements, and serve /metrics. See metrics.py.
+        METRICS_ENABLED=True,
+        # log statements slower than this many seconds, and statements that run
+        # this many times in one request. None turns either off. See slow_queries.py.
+        SLOW_QUERY_SECONDS=0.1,
+        SLOW_QUERY_REPEATS=3,
+        # fingerprinted static files built by `flask build-assets`. See assets.py.
+        ASSETS_FOLDER=os.path.join(app.static_folder, "dist"),
+        ASSET_MAX_AGE=365 * 24 * 60 * 60,
+        ASSET_IMAGE_WIDTHS=(480, 960),
     )
 
     if test_config is None:
@@ -47,6 +96,22 @@ def create_app(test_config=None):
 
     db.init_app(app)
 
+    from . import metrics
+
+    metrics.init_app(app)
+
+    from . import assets
+
+    assets.init_app(app)
+
+    from . import events
+
+    events.init_app(app)
+
+    from . import live
+
+    live.init_app(app)
+
     from . import auth
 
     app.register_blueprint(auth.bp)
@@ -54,6 +119,10 @@ def create_app(test_config=None):
     from . import game
 
     app.register_blueprint(game.bp)
+
+    from . import api
+
+    app.register_blueprint(api.bp)
     # app.add_url_rule('/', endpoint='game')
 
     return app
@@ -0,0 +1,391 @@
+"""The actions that players take during a game.
+
+Each action checks that it is allowed, changes the players, and returns a
+message for the players or the card that they drew. An action that isn't
+allowed raises ActionError before it changes anything. The form views in
+game.py and the JSON API in api.py both call these functions, so the rules
+of the game live in one place. Actions that change players are logged in
+the game event log.
+"""
+from contextlib import contextmanager
+
+from nobles_and_peasants.challenges import get_random_challenge
+from nobles_and_peasants.constants import NOBLE, PEASANT
+from nobles_and_peasants.db import transaction
+from nobles_and_peasants.drinks import get_cost_for_a_drink
+from nobles_and_peasants.events import record_action
+from nobles_and_peasants.outlaws import insert_new_outlaw, is_peasant_banned
+from nobles_and_peasants.players import (
+    COIN_UPDATE_ATTEMPTS,
+    CoinConflictError,
+    find_richest_peasant,
+    get_all_players,
+    get_single_player,
+    increment_coin,
+    increment_drinks,
+    increment_soldiers,
+    insert_new_player,
+    move_coin_between_players,
+    randomly_choose_player_status,
+    set_allegiance,
+    spend_noble_coin,
+    update_after_pledge_allegiance,
+    upgrade_peasant_and_downgrade_noble,
+)
+from nobles_and_peasants.quest_rewards import get_reward_for_difficulty
+from nobles_and_peasants.quests import get_random_quest
+from nobles_and_peasants.starting_coin import get_starting_coin_for_status
+
+
+class ActionError(Exception):
+    """Raised when a player tries an action that isn't allowed."""
+
+
+@contextmanager
+def _coin_conflicts_fail_the_action():
+    """Fail the action when a coin update kept losing to other requests.
+
+    The transaction that the action runs in is rolled back, so the writes
+    that it made before the conflict are undone.
+    """
+    try:
+        yield
+    except CoinConflictError as e:
+        raise ActionError(
+            "Unsuccessful! Someone else's coin kept changing. Please try again."
+        ) from e
+
+
+def _check_text(value, field):
+    """Check that an argument is text, since the JSON API can send any value."""
+    if not isinstance(value, str):
+        raise ActionError(f"Unsuccessful! The {field} must be text.")
+    return value
+
+
+def _clean_name(name, field="player name"):
+    """Normalize a player name the way that it was entered at sign in."""
+    return _check_text(name, field).strip().lower()
+
+
+@record_action
+def sign_in(player_name, player_status):
+    """Add a player to the party.
+
+    Args:
+        player_name (str): The name of the new player
+        player_status (str): noble, peasant or "randomly decide"
+    """
+    player_name = _clean_name(player_name)
+    players = get_all_players()
+
+    existing_players = [row["player_name"] for row in players]
+    if player_name in existing_players:
+        raise ActionError(
+            f"Unsuccessful! Please choose a different name. Someone already selected {player_name}."
+        )
+
+    if player_status not in (NOBLE, PEASANT, "randomly decide"):
+        raise ActionError(f"Unsuccessful! {player_status} is not a status.")
+
+    if player_status == "randomly decide":
+        status = randomly_choose_player_status(players=players)
+    else:
+        status = player_status
+
+    insert_new_player(player_name=player_name, player_status=status)
+
+
+@record_action
+def pledge(player_name, noble_name):
+    """Make a peasant a soldier in a noble's army.
+
+    Args:
+        player_name (str): The name of the peasant
+        noble_name (str): The name of the noble
+    """
+    player_name = _clean_name(player_name)
+    noble_name = _clean_name(noble_name, "noble name")
+
+    player = get_single_player(player_name=player_name)
+    noble = get_single_player(player_name=noble_name)
+
+    if player is None:
+        raise ActionError(
+            f"Unsuccessful! Please enter a valid name for yourself. You entered: {player_name}. Have you signed in?"
+        )
+
+    if noble is None:
+        raise ActionError(
+            f"Unsuccessful! Please enter a valid name for the noble. You entered: {noble_name}."
+        )
+
+    if noble["player_status"] != NOBLE:
+        raise ActionError(f"Unsuccessful! {noble_name} is not a noble.")
+
+    if player["player_status"] == NOBLE:
+        raise ActionError(
+            f"Unsuccessful! {player_name} is a noble. You must be allied to yourself."
+        )
+
+    if is_peasant_banned(noble_id=noble["id"], peasant_id=player["id"]):
+        raise ActionError(
+            f"Unsuccessful! {noble_name} has banned you from their kingdom!"
+        )
+
+    update_after_pledge_allegiance(player_name=player_name, noble_name=noble_name)
+
+
+@record_action(own_transaction=True)
+def buy_drink(player_name, drink_name, quantity):
+    """Have a player's noble pay for their drinks.
+
+    Args:
+        player_name (str): The name of the player drinking
+        drink_name (str): The name of the drink
+        quantity (int): The number of drinks
+
+    Returns:
+        str: A message if the noble ran out of money, else None
+    """
+    player_name = _clean_name(player_name)
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        raise ActionError(f"Unsuccessful! {quantity} is not a number of drinks.")
+    if quantity < 1:
+        raise ActionError("Unsuccessful! You must buy at least one drink.")
+
+    noble_name = get_single_player(player_name=player_name, col="noble_name")
+    if noble_name is None:
+        raise ActionError(
+            "Unsuccessful! You need to ally yourself to a noble before you can buy a drink."
+        )
+
+    price = get_cost_for_a_drink(drink_name=_check_text(drink_name, "drink name"))
+    if price is None:
+        raise ActionError(f"Unsuccessful! {drink_name} is not on the menu.")
+    cost = price * quantity
+
+    # everything above was read without the write lock. The coin is only
+    # spent if the noble is still the player's noble, and the coin it
+    # returns decides if the noble ran out, so the reads can't be stale.
+    with transaction():
+        for _ in range(COIN_UPDATE_ATTEMPTS):
+            coin_left = spend_noble_coin(
+                player_name=player_name, noble_name=noble_name, coin=cost
+            )
+            if coin_left is not None:
+                break
+            # another request changed the player's noble, so read it again
+            noble_name = get_single_player(player_name=player_name, col="noble_name")
+            if noble_name is None:
+                raise ActionError(
+                    "Unsuccessful! You need to ally yourself to a noble before you can buy a drink."
+                )
+        else:
+            raise ActionError(
+                "Unsuccessful! Your noble kept changing. Please try again."
+            )
+        increment_drinks(player_name=player_name, num=quantity)
+
+        # the noble doesn't have any more money
+        if coin_left <= 0:
+            new_noble_name = find_richest_peasant()
+            with _coin_conflicts_fail_the_action():
+                upgrade_peasant_and_downgrade_noble(
+                    peasant_name=new_noble_name, noble_name=noble_name
+                )
+            return f"{noble_name} ran out of money! {new_noble_name} is now a noble!"
+    return None
+
+
+@record_action
+def ban(noble_name, peasant_name):
+    """Ban a peasant from a noble's army.
+
+    Args:
+        noble_name (str): The name of the noble
+        peasant_name (str): The name of the peasant to ban
+    """
+    noble_name = _clean_name(noble_name, "noble name")
+    peasant_name = _clean_name(peasant_name, "peasant name")
+
+    noble = get_single_player(player_name=noble_name)
+    peasant = get_single_player(player_name=peasant_name)
+
+    if noble is None:
+        raise ActionError(
+            f"Unsuccessful! {noble_name} is not recognized. Did you enter your name correctly?"
+        )
+
+    if peasant is None:
+        raise ActionError(
+            f"Unsuccessful! {peasant_name} is not recognized. Did you enter their name correctly?"
+        )
+
+    if noble["player_status"] != NOBLE:
+        raise ActionError(
+            f"Unsuccessful! {noble_name} is not a noble. You cannot ban people from kingdom you do not have."
+        )
+
+    # remove the peasant's allegiance to the noble that is banning them
+    if peasant["noble_name"] == noble_name:
+        set_allegiance(player_name=peasant_name, noble_name=None)
+        increment_soldiers(player_name=noble_name, num=-1)
+
+    # add the peasant to a banned table
+    insert_new_outlaw(noble_id=noble["id"], peasant_id=peasant["id"])
+    return f"{noble_name} has banned {peasant_name}!"
+
+
+def get_quest(player_name, difficulty):
+    """Draw a quest for a player.
+
+    Args:
+        player_name (str): The name of the player
+        difficulty (str): The difficulty of the quest
+
+    Returns:
+        str: The quest
+    """
+    player_name = _clean_name(player_name)
+    difficulty = _check_text(difficulty, "difficulty").strip().lower()
+
+    player = get_single_player(player_name=player_name)
+    if player is None:
+        raise ActionError(
+            f"Unsuccessful! {player_name} is not in the party. Did you enter your name correctly?"
+        )
+
+    return get_random_quest(difficulty=difficulty)
+
+
+@record_action
+def complete_quest(player_name, difficulty, result):
+    """Reward a player that finished a quest.
+
+    Args:
+        player_name (str): The name of the player
+        difficulty (str): The difficulty of the quest
+        result (str): "Yes" if the player completed the quest
+
+    Returns:
+        str: A message if the player earned a reward, else None
+    """
+    player_name = _clean_name(player_name)
+    _check_text(difficulty, "difficulty")
+    if result != "Yes":
+        return None
+
+    if get_single_player(player_name=player_name) is None:
+        raise ActionError(f"Unsuccessful! {player_name} is not in the party.")
+
+    reward = get_reward_for_difficulty(difficulty=difficulty)
+    if reward is None:
+        raise ActionError(f"Unsuccessful! {difficulty} is not a difficulty.")
+    increment_coin(player_name=player_name, coin=reward)
+    return (
+        f"{player_name} has earned {reward} coin for completing a {difficulty} quest!"
+    )
+
+
+def kill(player_name, target_name):
+    """Draw the challenge that decides an assassination attempt.
+
+    Args:
+        player_name (str): The name of the player attacking
+        target_name (str): The name of the player attacked
+
+    Returns:
+        str: The challenge
+    """
+    player_name = _clean_name(player_name)
+    target_name = _clean_name(target_name, "target name")
+
+    player = get_single_player(player_name=player_name)
+    target = get_single_player(player_name=target_name)
+
+    if player is None:
+        raise ActionError(f"Unsuccessful! {player_name} is not in the party.")
+
+    if target is None:
+        raise ActionError(f"Unsuccessful! {target_name} is not in the party.")
+
+    if player_name == target_name:
+        raise ActionError("Unsuccessful! You cannot try to assassinate yourself!")
+
+    if player["player_status"] == PEASANT and target["player_status"] == NOBLE:
+        coin_needed = get_starting_coin_for_status(player_status=NOBLE)
+        if player["coin"] < coin_needed:
+            raise ActionError(
+                f"Unsuccessful! You need {coin_needed} coin to assassinate a noble."
+            )
+
+    return get_random_challenge()
+
+
+@record_action
+@_coin_conflicts_fail_the_action()
+def assassinate(player_name, target_name, winner_name):
+    """Settle an assassination attempt.
+
+    Args:
+        player_name (str): The name of the player that attacked
+        target_name (str): The name of the player that was attacked
+        winner_name (str): The name of the player that won the challenge
+
+    Returns:
+        str: A message describing what happened
+    """
+    player_name = _clean_name(player_name)
+    target_name = _clean_name(target_name, "target name")
+    winner_name = _clean_name(winner_name, "winner name")
+
+    if winner_name not in (player_name, target_name):
+        raise ActionError(
+            f"Unsuccessful! The winner must be {player_name} or {target_name}."
+        )
+
+    if player_name == winner_name:
+        loser_name = target_name
+    else:
+        loser_name = player_name
+
+    winner_status = get_single_player(player_name=winner_name, col="player_status")
+    loser_status = get_single_player(player_name=loser_name, col="player_status")
+
+    if winner_status is None or loser_status is None:
+        raise ActionError(
+            f"Unsuccessful! {player_name} and {target_name} must both be in the party."
+        )
+
+    if winner_status == PEASANT and loser_status == NOBLE:
+        upgrade_peasant_and_downgrade_noble(
+            peasant_name=winner_name, noble_name=loser_name
+        )
+        return f"{winner_name} assassinated {loser_name}! {winner_name} is now a noble!"
+    elif winner_status == NOBLE and loser_status == NOBLE:
+        new_noble_name = find_richest_peasant()
+        upgrade_peasant_and_downgrade_noble(
+            peasant_name=new_noble_name, noble_name=loser_name
+        )
+        return (
+            f"{winner_name} assassinated {loser_name}! {new_noble_name} is now a noble!"
+        )
+    else:
+        move_coin_between_players(from_name=loser_name, to_name=winner_name)
+        return f"{winner_name} has taken all of the coin of {loser_name}"
+
+
+# the actions that can be taken through the JSON API, by name
+ACTIONS = {
+    "sign_in": sign_in,
+    "pledge": pledge,
+    "buy_drink": buy_drink,
+    "ban": ban,
+    "get_quest": get_quest,
+    "complete_quest": complete_quest,
+    "kill": kill,
+    "assassinate": assassinate,
+}
@@ -0,0 +1,145 @@
+"""A JSON API for the actions that players take during a game.
+
+Each action in actions.ACTIONS can be taken with a POST to /api/v1/<action>,
+with the action's arguments as a JSON object. The response has the action's
+result and the players that it changed, so clients don't need to reload the
+main page:
+
+    POST /api/v1/buy_drink
+    {"player_name": "bob", "drink_name": "beer", "quantity": 2}
+
+    {"result": null, "players": [
+        {"player_name": "alice", "changes": {"coin": [50, 40]}},
+        {"player_name": "bob", "changes": {"drinks": [0, 2]}}
+    ]}
+
+A POST to /api/v1/batch takes a list of actions, each with its name under
+"action", and applies them all in one transaction. If any action isn't
+allowed, none of them are applied.
+"""
+import inspect
+
+from flask import Blueprint, g, jsonify, request
+
+from nobles_and_peasants.actions import ACTIONS, ActionError
+from nobles_and_peasants.db import transaction
+from nobles_and_peasants.players import get_player_changes, track_player_changes
+
+PLAYER_COLUMNS = ("player_status", "coin", "noble_name", "drinks", "soldiers")
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+class BatchError(Exception):
+    """Raised to roll back a batch when one of its actions isn't allowed.
+
+    Args:
+        index (int): The position of the action in the batch
+        message (str): Why the action isn't allowed
+    """
+
+    def __init__(self, index, message):
+        """Initialize the error."""
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+@bp.before_request
+def require_login():
+    """Answer with an error instead of redirecting to the login page."""
+    if g.user is None:
+        return jsonify(error="You must log in to a party."), 401
+
+
+def _columns(player):
+    """Get the columns of a player that an action can change."""
+    if player is None:
+        return (None,) * len(PLAYER_COLUMNS)
+    return tuple(player[col] for col in PLAYER_COLUMNS)
+
+
+def _diff_players(player_changes):
+    """List the players that changed, with the old and new value of each column."""
+    deltas = []
+    for player_name in sorted(player_changes):
+        old, new = map(_columns, player_changes[player_name])
+        changes = {
+            col: [old_value, new_value]
+            for col, old_value, new_value in zip(PLAYER_COLUMNS, old, new)
+            if old_value != new_value
+        }
+        if changes:
+            deltas.append({"player_name": player_name, "changes": changes})
+    return deltas
+
+
+def _take_action(index, params):
+    """Take one action of a batch, given its name and arguments."""
+    if not isinstance(params, dict):
+        raise BatchError(index, "Unsuccessful! Each action must be a JSON object.")
+    params = dict(params)
+    name = params.pop("action", None)
+    if name not in ACTIONS:
+        raise BatchError(index, f"Unsuccessful! {name} is not an action.")
+
+    action = ACTIONS[name]
+    try:
+        inspect.signature(action).bind(**params)
+    except TypeError as e:
+        raise BatchError(index, f"Unsuccessful! Bad arguments for {name}: {e}.")
+    try:
+        return action(**params)
+    except ActionError as e:
+        raise BatchError(index, str(e))
+
+
+def _take_actions(batch):
+    """Take a list of actions in one transaction.
+
+    Returns:
+        Tuple[list, list]: The result of each action and the players that
+            they changed
+    """
+    track_player_changes()
+    with transaction():
+        results = [_take_action(i, params) for i, params in enumerate(batch)]
+        players = _diff_players(get_player_changes())
+    return results, players
+
+
+def _error(e):
+    """Answer with the action that wasn't allowed."""
+    return jsonify(error=e.message, index=e.index), 400
+
+
+@bp.route("/batch", methods=["POST"])
+def batch():
+    """Take a list of actions, all or none of them."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("actions"), list):
+        return jsonify(error='The body must be {"actions": [...]}.'), 400
+
+    try:
+        results, players = _take_actions(body["actions"])
+    except BatchError as e:
+        return _error(e)
+    return jsonify(results=results, players=players)
+
+
+@bp.route("/<action>", methods=["POST"])
+def take_action(action):
+    """Take a single action."""
+    params = request.get_json(silent=True)
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        return jsonify(error="The body must be a JSON object."), 400
+
+    try:
+        results, players = _take_actions([{**params, "action": action}])
+    except BatchError as e:
+        if action not in ACTIONS:
+            return jsonify(error=e.message), 404
+        return _error(e)
+    return jsonify(result=results[0], players=players)
@@ -0,0 +1,301 @@
+"""Serve the app with an ASGI server, for parties with many open connections.
+
+Run it with any ASGI server, for example uvicorn:
+
+    pip install uvicorn
+    uvicorn --factory nobles_and_peasants.asgi:create_asgi_app
+
+Under a WSGI server, every open connection holds a worker thread until the
+response is sent. The live stream holds one for as long as the page is open.
+Here, the server reads each request and writes each response on its event
+loop, so a slow phone holds a thread only for as long as the response has
+more chunks waiting than ASGI_QUEUED_CHUNKS. The live stream is served on
+the event loop as well, so each viewer costs a queue instead of a thread.
+
+The views in game.py and auth.py stay sync. Each one runs on a pool of
+ASGI_THREADS threads, together with its database reads and writes through
+query.py, and holds a thread only while it runs.
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+from werkzeug.exceptions import HTTPException
+
+from nobles_and_peasants import create_app, live
+
+
+class AsyncSubscription(live.Subscription):
+    """The events waiting to be sent to one viewer on the event loop.
+
+    Events are published from the threads that run the views, so they are
+    handed to the loop instead of put on the queue directly.
+    """
+
+    def __init__(self, maxsize, loop):
+        """Initialize a subscription with room for maxsize events."""
+        self.events = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+        self.loop = loop
+
+    def put(self, event):
+        """Queue an event from any thread."""
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        """Queue an event, or mark the viewer as lagged if it is too far behind."""
+        try:
+            self.events.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout):
+        """Wait for the next event, or return None after timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def clear(self):
+        """Throw away every queued event."""
+        self.lagged = False
+        while True:
+            try:
+                self.events.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+
+def build_environ(scope, body):
+    """Build the WSGI environ of an ASGI http request.
+
+    Args:
+        scope (dict): The ASGI scope of the request
+        body (bytes): The body of the request
+    """
+    script_name = scope.get("root_path", "").encode().decode("latin1")
+    path_info = scope["path"].encode().decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name) :]
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class AsgiApp:
+    """An ASGI app that serves the Flask app.
+
+    Args:
+        flask_app (flask.Flask): The app to serve
+    """
+
+    def __init__(self, flask_app):
+        """Initialize the app and its pool of threads."""
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=flask_app.config["ASGI_THREADS"],
+            thread_name_prefix="nobles_and_peasants",
+        )
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI connection."""
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = await self._read_body(receive)
+            environ = build_environ(scope, body)
+            if self._endpoint(environ) == "game.live":
+                await self._live(environ, receive, send)
+            else:
+                await self._wsgi(environ, send)
+
+    async def offload(self, func, *args, environ=None):
+        """Call a sync function on the pool, inside an app or request context.
+
+        Args:
+            func (Callable): The function to call. It can use query.py.
+            *args: The arguments for the function
+            environ (dict): Push a context for this request. None only
+                pushes an app context.
+        """
+
+        def run():
+            if environ is None:
+                context = self.flask_app.app_context()
+            else:
+                context = self.flask_app.request_context(environ)
+            with context:
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, run)
+
+    async def _lifespan(self, receive, send):
+        """Start up and shut down with the server."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        """Read the whole body of a request."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    def _endpoint(self, environ):
+        """Find the endpoint that a request is routed to, if any."""
+        adapter = self.flask_app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, _ = adapter.match()
+        except HTTPException:
+            return None
+        return endpoint
+
+    async def _wsgi(self, environ, send):
+        """Run a sync view on the pool and send its response from the loop.
+
+        The body is sent chunk by chunk as the pool produces it, so a
+        streamed download is never held in memory whole. It is iterated on
+        the thread that ran the view, since a streamed body can read from
+        that thread's database connection. The thread only waits for a slow
+        client once ASGI_QUEUED_CHUNKS chunks are queued.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=self.flask_app.config["ASGI_QUEUED_CHUNKS"])
+        stopped = threading.Event()
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start["status"] = int(status.split(" ", 1)[0])
+            start["headers"] = [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in headers
+            ]
+
+        def put(chunk):
+            asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+        def run():
+            response = self.flask_app(environ, start_response)
+            try:
+                for chunk in response:
+                    if stopped.is_set():
+                        return
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+                if not stopped.is_set():
+                    put(None)
+
+        produced = loop.run_in_executor(self.executor, run)
+        try:
+            chunk = await chunks.get()
+            if chunk is None:
+                # the view failed before it started the response
+                await produced
+            await send({"type": "http.response.start", **start})
+            while chunk is not None:
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+                chunk = await chunks.get()
+            await produced
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if not produced.done():
+                # the client is gone, so let the thread finish without it
+                stopped.set()
+                while not chunks.empty():
+                    chunks.get_nowait()
+
+    def _open_live(self, subscription):
+        """Add a viewer to the party in the session, or None if not logged in."""
+        self.flask_app.preprocess_request()
+        if g.user is None:
+            return None
+        return live.open_stream(subscription)
+
+    async def _live(self, environ, receive, send):
+        """Stream changes to the players of a party from the event loop."""
+        config = self.flask_app.config
+        subscription = AsyncSubscription(
+            maxsize=config["LIVE_QUEUE_SIZE"], loop=asyncio.get_running_loop()
+        )
+        opened = await self.offload(self._open_live, subscription, environ=environ)
+        if opened is None:
+            # let the view redirect to the login page
+            await self._wsgi(environ, send)
+            return
+
+        channel, event = opened
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no"),
+                    ],
+                }
+            )
+            while not disconnected.done():
+                await send(
+                    {"type": "http.response.body", "body": event, "more_body": True}
+                )
+                event = await subscription.get(timeout=config["LIVE_HEARTBEAT_SECONDS"])
+                if subscription.lagged:
+                    subscription.clear()
+                    event = await self.offload(live.snapshot, channel)
+                if event is None:
+                    await self.offload(live.catch_up, channel)
+                    event = live.HEARTBEAT
+        finally:
+            disconnected.cancel()
+            live.get_broker(self.flask_app).unsubscribe(channel, subscription)
+
+
+def create_asgi_app(test_config=None):
+    """Create the Flask app and wrap it for an ASGI server."""
+    return AsgiApp(create_app(test_config))
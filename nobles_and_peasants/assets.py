@@ -0,0 +1,322 @@
+"""Build fingerprinted copies of the static files, and serve them for a year.
+
+`flask build-assets` copies every file in static/ to ASSETS_FOLDER, with a
+hash of its content in its name, like style.3f2a9c01b7de.css. References to
+other static files in css url()s are rewritten to the fingerprinted names.
+Text files also get gzip variants, and brotli variants when the brotli
+package is installed. When Pillow is installed, jpg and png images also get
+a WebP copy and smaller copies ASSET_IMAGE_WIDTHS pixels wide. The build
+writes a manifest.json that maps each static file to its copies.
+
+Since a fingerprinted file never changes, /assets/<file> serves it with a
+far-future immutable cache header, precompressed when the browser accepts
+it. Builds only add files, so a page cached before a deploy still finds
+the files that it links to. Templates link to static files with
+asset_url('style.css'), which falls back to the plain static url for
+files that weren't built, so the app works without a build.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".json", ".txt"}
+RESIZABLE = {".jpg", ".jpeg", ".png"}
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class Assets:
+    """The manifest of an app's built static files.
+
+    The version is a hash of the manifest, so it changes with every build
+    that changes a file. Pages that link to the files include it in their
+    ETags.
+
+    Args:
+        folder (str): The folder with the built files
+        manifest (dict): The built copies of each static file, by its path
+            in static/
+    """
+
+    def __init__(self, folder, manifest):
+        """Initialize the assets, and index the compressed variants of each file."""
+        self.folder = folder
+        self.manifest = manifest
+        self.version = hashlib.sha256(
+            json.dumps(manifest, sort_keys=True).encode()
+        ).hexdigest()[:12]
+        self.encodings = {
+            entry["file"]: entry.get("encodings", []) for entry in manifest.values()
+        }
+
+
+def _fingerprinted_name(path, content, suffix=""):
+    """Add a hash of a file's content to its name, like style.3f2a9c01b7de.css."""
+    stem, ext = posixpath.splitext(path)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{stem}{suffix}.{digest}{ext}"
+
+
+def _write(output_folder, path, content):
+    """Write a built file, replacing it at once so it is never served half written."""
+    full_path = os.path.join(output_folder, *path.split("/"))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    temp_path = f"{full_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, full_path)
+
+
+def _rewrite_css_urls(path, content, manifest):
+    """Point the url()s of a stylesheet to the fingerprinted copies of the files."""
+    folder = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if ":" in url or url.startswith(("/", "#")):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(folder, url))
+        if target not in manifest:
+            return match.group(0)
+        new_url = posixpath.relpath(manifest[target]["file"], folder or ".")
+        return f"url({quote}{new_url}{quote})"
+
+    return _CSS_URL.sub(replace, content.decode()).encode()
+
+
+def _compress(output_folder, name, content):
+    """Write the compressed variants of a file that are smaller than it.
+
+    Returns:
+        List[str]: The encodings that were written, best first
+    """
+    variants = []
+    if brotli is not None:
+        variants.append(("br", ".br", brotli.compress(content, quality=11)))
+    # mtime=0 keeps builds of the same file identical
+    variants.append(("gzip", ".gz", gzip.compress(content, 9, mtime=0)))
+
+    encodings = []
+    for encoding, ext, compressed in variants:
+        if len(compressed) < len(content):
+            _write(output_folder, name + ext, compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def _encode_image(image, ext):
+    """Save an image as jpg, png or webp, and get its bytes."""
+    buffer = BytesIO()
+    if ext == ".webp":
+        image.save(buffer, format="WEBP", quality=80, method=6)
+    elif ext == ".png":
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+def _build_images(output_folder, path, content, widths):
+    """Write a WebP copy of an image, and smaller copies in both formats.
+
+    Returns:
+        dict: The manifest keys for the copies
+    """
+    stem, ext = posixpath.splitext(path)
+    image = Image.open(BytesIO(content))
+    image.load()
+
+    webp = _encode_image(image, ".webp")
+    entry = {"webp": _fingerprinted_name(stem + ".webp", webp), "widths": {}}
+    _write(output_folder, entry["webp"], webp)
+
+    for width in sorted(widths):
+        if width >= image.width:
+            continue
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        copies = {}
+        for key, copy_path in (("file", path), ("webp", stem + ".webp")):
+            copy_ext = posixpath.splitext(copy_path)[1].lower()
+            data = _encode_image(resized, copy_ext)
+            copies[key] = _fingerprinted_name(copy_path, data, suffix=f".{width}w")
+            _write(output_folder, copies[key], data)
+        entry["widths"][str(width)] = copies
+    return entry
+
+
+def build_assets(static_folder, output_folder, image_widths=()):
+    """Build fingerprinted, compressed and resized copies of the static files.
+
+    Files from earlier builds are kept, so pages and stylesheets that were
+    cached before a deploy can still load the files that they link to. Only
+    manifest.json is replaced. The output folder is left out of the build if
+    it is inside the static folder.
+
+    Args:
+        static_folder (str): The folder with the static files
+        output_folder (str): The folder to write the copies and manifest.json to
+        image_widths (List[int]): The widths of the smaller copies of each
+            image, if Pillow is installed
+
+    Returns:
+        dict: The manifest
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    paths = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [
+            d
+            for d in dirs
+            if os.path.abspath(os.path.join(root, d)) != os.path.abspath(output_folder)
+        ]
+        for file in files:
+            full_path = os.path.join(root, file)
+            paths.append(os.path.relpath(full_path, static_folder).replace(os.sep, "/"))
+    # stylesheets go last, so the files that they link to are already built
+    paths.sort(key=lambda path: (path.endswith(".css"), path))
+
+    manifest = {}
+    for path in paths:
+        with open(os.path.join(static_folder, *path.split("/")), "rb") as f:
+            content = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext == ".css":
+            content = _rewrite_css_urls(path, content, manifest)
+
+        name = _fingerprinted_name(path, content)
+        _write(output_folder, name, content)
+        entry = {"file": name}
+        if ext in COMPRESSIBLE:
+            entry["encodings"] = _compress(output_folder, name, content)
+        if ext in RESIZABLE and Image is not None:
+            entry.update(_build_images(output_folder, path, content, image_widths))
+        manifest[path] = entry
+
+    _write(
+        output_folder,
+        "manifest.json",
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    return manifest
+
+
+def load_assets(app):
+    """Load the manifest of the app's built static files, if they were built."""
+    folder = app.config["ASSETS_FOLDER"]
+    try:
+        with open(os.path.join(folder, "manifest.json")) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    app.extensions["nobles_and_peasants.assets"] = Assets(folder, manifest)
+
+
+def _url(name):
+    """Get the url of a built file."""
+    return url_for("send_asset", filename=name)
+
+
+def asset_url(filename, webp=False):
+    """Get the url of a static file, fingerprinted if it was built.
+
+    Args:
+        filename (str): The path of the file in static/
+        webp (bool): Link to the WebP copy of an image, if there is one
+    """
+    entry = current_app.extensions["nobles_and_peasants.assets"].manifest.get(filename)
+    if entry is None:
+        return url_for("static", filename=filename)
+    if webp and "webp" in entry:
+        return _url(entry["webp"])
+    return _url(entry["file"])
+
+
+def asset_srcset(filename, webp=False):
+    """Get a srcset of the smaller copies of an image, for an img or source tag.
+
+    Args:
+        filename (str): The path of the image in static/
+        webp (bool): List the WebP copies instead of the original format
+    """
+    entry = current_app.extensions["nobles_and_peasants.assets"].manifest.get(filename)
+    if entry is None:
+        return ""
+    key = "webp" if webp else "file"
+    return ", ".join(
+        f"{_url(copies[key])} {width}w" for width, copies in entry["widths"].items()
+    )
+
+
+def send_asset(filename):
+    """Serve a built file, precompressed if the browser accepts it."""
+    assets = current_app.extensions["nobles_and_peasants.assets"]
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    for accepted in assets.encodings.get(filename, []):
+        if request.accept_encodings[accepted]:
+            encoding = accepted
+            break
+
+    ext = {"br": ".br", "gzip": ".gz", None: ""}[encoding]
+    response = send_from_directory(
+        assets.folder,
+        filename + ext,
+        mimetype=mimetype,
+        max_age=current_app.config["ASSET_MAX_AGE"],
+    )
+    if encoding is not None:
+        response.content_encoding = encoding
+    if assets.encodings.get(filename):
+        response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    """Build fingerprinted, compressed and resized copies of the static files."""
+    manifest = build_assets(
+        static_folder=current_app.static_folder,
+        output_folder=current_app.config["ASSETS_FOLDER"],
+        image_widths=current_app.config["ASSET_IMAGE_WIDTHS"],
+    )
+    load_assets(current_app)
+    click.echo(
+        f"Built {len(manifest)} static files in {current_app.config['ASSETS_FOLDER']}."
+    )
+    if brotli is None:
+        click.echo("Skipped brotli variants: pip install brotli to build them.")
+    if Image is None:
+        click.echo("Skipped image variants: pip install Pillow to build them.")
+
+
+def init_app(app):
+    """Load the built static files and add the route and helpers that serve them."""
+    load_assets(app)
+    app.add_url_rule("/assets/<path:filename>", view_func=send_asset)
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_srcset)
+    app.cli.add_command(build_assets_command)
@@ -10,13 +10,15 @@ from flask import (
     session,
     url_for,
 )
-from werkzeug.security import check_password_hash
-
+from nobles_and_peasants.db import is_dropped_party
 from nobles_and_peasants.parties import (
     does_party_name_exist,
     insert_new_party,
     get_party,
 )
+from nobles_and_peasants.passwords import HashingBusy, check_password
+
+BUSY_MESSAGE = "Unsuccessful! Too many people are logging in at once. Please try again in a few seconds."
 
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -39,12 +41,28 @@ def signup():
             flash(msg)
             return redirect(url_for("show_login"))
 
+        msg = f"Unsuccessful! Please choose a different party name. Someone already selected {party_name}."
+
+        # skip hashing the password when the name is obviously taken
         if does_party_name_exist(party_name=party_name):
-            msg = f"Unsuccessful! Please choose a different party name. Someone already selected {party_name}."
             flash(msg)
             return redirect(url_for("show_login"))
 
-        insert_new_party(party_name=party_name, password=password)
+        try:
+            party_id = insert_new_party(
+                party_name=party_name,
+                password=password,
+                in_memory="quick" in request.form,
+            )
+        except HashingBusy:
+            flash(BUSY_MESSAGE)
+            return redirect(url_for("show_login"))
+
+        # the name can still be taken while the password is hashed
+        if party_id is None:
+            flash(msg)
+            return redirect(url_for("show_login"))
+
         flash("Success! You can now log in to your party!")
         return redirect(url_for("show_login"))
     return redirect(url_for("show_login"))
@@ -64,7 +82,13 @@ def login():
             flash(msg)
             return redirect(url_for("show_login"))
 
-        if not check_password_hash(pwhash=party["password"], password=password):
+        try:
+            is_correct = check_password(pwhash=party["password"], password=password)
+        except HashingBusy:
+            flash(BUSY_MESSAGE)
+            return redirect(url_for("show_login"))
+
+        if not is_correct:
             msg = f"Unsuccessful! That is not the correct password for {party_name}."
             flash(msg)
             return redirect(url_for("show_login"))
@@ -83,6 +107,11 @@ def load_logged_in_user():
     party_id = session.get("party_id")
     party_name = session.get("party_name")
 
+    if party_id is not None and is_dropped_party(party_id):
+        # the party sat idle in memory and is gone
+        session.clear()
+        party_id = None
+
     if party_id is None:
         g.user = None
     else:
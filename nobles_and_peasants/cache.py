@@ -0,0 +1,72 @@
+"""In-process caches that live for as long as the app."""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LRUCache:
+    """A thread safe mapping that evicts the least recently used key.
+
+    Args:
+        maxsize (int): The number of keys to keep before evicting
+        ttl (float): Seconds until a key expires. None means keys never expire.
+        sliding (bool): Restart the ttl whenever a key is read, so only keys
+            that sit idle expire
+    """
+
+    def __init__(self, maxsize, ttl=None, sliding=False):
+        """Initialize an empty cache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value for a key, or default if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            now = time.monotonic()
+            if expires_at is not None and expires_at < now:
+                del self._data[key]
+                return default
+            if self.sliding and self.ttl is not None:
+                self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store the value for a key, evicting the oldest key if the cache is full."""
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        """Remove a key from the cache if it is there."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every key from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        """Count the keys in the cache, including ones that have expired."""
+        return len(self._data)
+
+
+def get_cache(name, maxsize, ttl=None, sliding=False):
+    """Get the app's cache with the given name, creating it the first time."""
+    caches = current_app.extensions.setdefault("nobles_and_peasants.caches", {})
+    if name not in caches:
+        caches.setdefault(name, LRUCache(maxsize=maxsize, ttl=ttl, sliding=sliding))
+    return caches[name]
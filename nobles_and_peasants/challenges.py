@@ -1,24 +1,57 @@
 """Functions related to the challenges table."""
 from flask import session
 
-from nobles_and_peasants.query import execute, fetch_all, fetch_one
+from nobles_and_peasants.decks import deal, discard_decks
+from nobles_and_peasants.parties import mark_party_changed
+from nobles_and_peasants.query import (
+    execute,
+    execute_many,
+    fetch_all,
+    fetch_one,
+    iterate,
+)
 
 
 def get_random_challenge():
-    """Get a random challenge."""
+    """Get a random challenge.
+
+    Challenges are dealt from a shuffled deck, so every challenge is handed
+    out once before any challenge is repeated.
+    """
+    party_id = session.get("party_id")
+
+    def load_challenge_ids():
+        query = "select id from challenges where party_id = ?"
+        challenges = fetch_all(query=query, args=[party_id])
+        return [row["id"] for row in challenges]
+
+    def load_challenge(challenge_id):
+        query = "select challenge from challenges where id = ?"
+        return fetch_one(query=query, args=[challenge_id])
+
+    return deal(
+        table="challenges",
+        party_id=party_id,
+        deck_name="all",
+        load_card_ids=load_challenge_ids,
+        load_card=load_challenge,
+    )
+
+
+def get_all_challenges():
+    """Get all challenges in a given party."""
     party_id = session.get("party_id")
     query = """
-        select challenge
+        select id, challenge
         from challenges
         where party_id = ?
-        order by random()
-        limit 1
+        order by id
     """
-    return fetch_one(query=query, args=[party_id])
+    return fetch_all(query=query, args=[party_id])
 
 
-def get_all_challenges():
-    """Get all challenges in a given party."""
+def iterate_challenges():
+    """Get all challenges in a given party, one at a time."""
     party_id = session.get("party_id")
     query = """
         select id, challenge
@@ -26,7 +59,7 @@ def get_all_challenges():
         where party_id = ?
         order by id
     """
-    return fetch_all(query=query, args=[party_id])
+    return iterate(query=query, args=[party_id])
 
 
 def is_challenge_in_party(challenge_id):
@@ -41,7 +74,32 @@ def add_challenge_to_party(challenge, commit=True):
     query = """
         insert into challenges (party_id, challenge) values (?, ?)
     """
-    execute(query=query, args=[party_id, challenge], commit=commit)
+    execute(query=query, args=[party_id, challenge], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="challenges", party_id=party_id)
+
+
+def add_challenges_to_party(challenges, commit=True):
+    """Add many challenges at once, skipping any that the party already has.
+
+    Args:
+        challenges (List[str]): The challenges to add
+        commit (bool): Whether to commit the inserts
+
+    Returns:
+        int: The number of challenges that were added
+    """
+    party_id = session.get("party_id")
+    existing = {c["challenge"] for c in get_all_challenges()}
+    new_challenges = [c for c in dict.fromkeys(challenges) if c not in existing]
+    query = """
+        insert into challenges (party_id, challenge) values (?, ?)
+    """
+    args_list = [(party_id, challenge) for challenge in new_challenges]
+    execute_many(query=query, args_list=args_list, commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="challenges", party_id=party_id)
+    return len(new_challenges)
 
 
 def delete_challenge_from_table(challenge_id, commit=True):
@@ -49,4 +107,7 @@ def delete_challenge_from_table(challenge_id, commit=True):
     query = """
         delete from challenges where id = ?
     """
-    execute(query=query, args=[challenge_id], commit=commit)
+    party_id = session.get("party_id")
+    execute(query=query, args=[challenge_id], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="challenges", party_id=party_id)
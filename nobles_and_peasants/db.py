@@ -1,8 +1,56 @@
-"""Database module."""
+"""Database module.
+
+By default every party lives in the DATABASE file. When DB_SHARDS_FOLDER is
+set, each party gets a database file of its own in that folder, so writes
+in one party never wait for the write lock of another. The DATABASE file is
+then a directory that holds the parties table, and get_db connects to the
+shard of the party in the session. use_database runs a block against the
+directory, or against the shard of another party.
+
+DB_BACKEND picks where the database files are kept. "sqlite" keeps them on
+disk. "memory" keeps them in memory, for quick parties that are gone when
+the server stops, and for tests. The paths in DATABASE and DB_SHARDS_FOLDER
+are then only names. With sharding, a single party can also be kept in
+memory next to parties on disk: create_shard(party_id, in_memory=True)
+makes a quick party, and the directory lists it in quick_parties.
+
+Each in-memory database is shared by every thread of the app, but not with
+other processes. Serve the app from a single process, such as the ASGI app
+or a threaded WSGI server, when parties are kept in memory: each process of
+a multi-process server would see parties of its own. Parties in memory
+that nobody plays for DB_MEMORY_IDLE_SECONDS are dropped, together with
+their row in the directory, and so are quick parties whose shard was lost
+when the server restarted.
+"""
+import glob
+import os
+import re
 import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, session
+from flask.cli import with_appcontext
+
+# seconds between checks for parties in memory that sit idle
+_EXPIRY_CHECK_SECONDS = 60
+
+# the parts of g that belong to the unit of work of one database
+_UNIT_OF_WORK_KEYS = (
+    "db",
+    "db_party_id",
+    "in_transaction",
+    "before_commit_callbacks",
+    "commit_callbacks",
+    "rollback_callbacks",
+    "changed_parties",
+    "party_state_writes",
+)
 
 
 def connect_db():
@@ -12,39 +60,653 @@ def connect_db():
     return rv
 
 
+class MemoryDatabases:
+    """The in-memory databases of an app, and when each of its parties was last used.
+
+    An in-memory database is dropped when its last connection closes, so one
+    connection to each database is kept open until it is dropped.
+    """
+
+    def __init__(self):
+        """Initialize an empty set of databases, with names no other app uses."""
+        self.prefix = f"/nobles_and_peasants-{uuid.uuid4().hex}"
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.last_used = {}
+        self.dropped_parties = set()
+        self.next_expiry = 0
+
+    def uri(self, database):
+        """Get the uri of the in-memory database with a path as its name."""
+        return f"file:{self.prefix}/{quote(database)}?vfs=memdb"
+
+    def create(self, database):
+        """Create an empty in-memory database, unless it exists."""
+        with self.lock:
+            if database not in self.connections:
+                self.connections[database] = sqlite3.connect(
+                    self.uri(database), uri=True, check_same_thread=False
+                )
+
+    def drop(self, database):
+        """Drop an in-memory database, once the open connections to it close."""
+        with self.lock:
+            conn = self.connections.pop(database, None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """Drop every in-memory database."""
+        for database in list(self.connections):
+            self.drop(database)
+
+    def touch(self, party_id):
+        """Note that a party in memory is in use."""
+        self.last_used[party_id] = time.monotonic()
+
+    def is_idle(self, party_id, seconds):
+        """Check if a party hasn't been used for seconds, counting from when it was first seen."""
+        now = time.monotonic()
+        return now - self.last_used.setdefault(party_id, now) > seconds
+
+    def is_expiry_due(self):
+        """Check if it is time to look for idle parties, at most once a minute."""
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_expiry:
+                return False
+            self.next_expiry = now + _EXPIRY_CHECK_SECONDS
+            return True
+
+
+def _memory_databases(database=None):
+    """Get the in-memory databases of the app if a database is kept in memory, or None.
+
+    Every database is in memory when DB_BACKEND is "memory". Otherwise only
+    the shards of quick parties are.
+    """
+    memory = current_app.extensions["nobles_and_peasants.memory"]
+    if current_app.config["DB_BACKEND"] == "memory" or database in memory.connections:
+        return memory
+    return None
+
+
+def database_uri(database):
+    """Get the name that sqlite connects to for a database path.
+
+    Connections to it must be opened with uri=True when it is kept in memory,
+    and can also ATTACH it.
+    """
+    memory = _memory_databases(database)
+    return database if memory is None else memory.uri(database)
+
+
+def database_exists(database):
+    """Check if a database path has been created."""
+    memory = _memory_databases(database)
+    if memory is None:
+        return os.path.exists(database)
+    return database in memory.connections
+
+
+def drop_database(database):
+    """Delete a database, and its write-ahead log when it is on disk.
+
+    The worker thread's pooled connection to it is closed. Other threads must
+    not use the database again.
+    """
+    pool = _get_pool()
+    if database in pool:
+        pool.pop(database).close()
+    memory = _memory_databases(database)
+    if memory is not None:
+        memory.drop(database)
+        return
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+
+
+def open_connection(database, config):
+    """Open a new connection to a database file and apply the configured pragmas.
+
+    Must be called inside an app context. With DB_BACKEND "memory", the
+    database is created in memory if it doesn't exist yet.
+
+    Args:
+        database (str): The path to the sqlite database file
+        config (flask.Config): The app config with the DB_* settings
+    """
+    memory = _memory_databases(database)
+    if memory is not None:
+        memory.create(database)
+    conn = sqlite3.connect(
+        memory.uri(database) if memory is not None else database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        uri=memory is not None,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"pragma busy_timeout = {int(config['DB_BUSY_TIMEOUT'])}")
+    if config["DB_JOURNAL_MODE"] is not None:
+        conn.execute(f"pragma journal_mode = {config['DB_JOURNAL_MODE']}")
+    if config["DB_SYNCHRONOUS"] is not None:
+        conn.execute(f"pragma synchronous = {config['DB_SYNCHRONOUS']}")
+    if config["DB_MMAP_SIZE"] is not None:
+        conn.execute(f"pragma mmap_size = {int(config['DB_MMAP_SIZE'])}")
+    if config["DB_CACHE_SIZE"] is not None:
+        conn.execute(f"pragma cache_size = {int(config['DB_CACHE_SIZE'])}")
+    return conn
+
+
+def _get_pool():
+    """Get the connections that the current worker thread keeps open, by path.
+
+    The least recently used connections come first.
+    """
+    local = current_app.extensions["nobles_and_peasants.db"]
+    if not hasattr(local, "connections"):
+        local.connections = OrderedDict()
+    return local.connections
+
+
+def shard_path(party_id):
+    """Get the path of the database file of a party, when parties are sharded."""
+    folder = current_app.config["DB_SHARDS_FOLDER"]
+    return os.path.join(folder, f"party_{int(party_id)}.sqlite")
+
+
+def _get_database():
+    """Get the path of the database file that the current unit of work uses."""
+    database = current_app.config["DATABASE"]
+    if current_app.config["DB_SHARDS_FOLDER"] is None:
+        return database
+
+    if "db_party_id" in g:
+        party_id = g.db_party_id
+    elif has_request_context():
+        party_id = session.get("party_id")
+    else:
+        party_id = None
+    if party_id is None:
+        return database
+
+    path = shard_path(party_id)
+    # connecting would create an empty file instead of failing
+    if not database_exists(path):
+        raise RuntimeError(
+            f"Party {party_id} has no database file. Run `flask split-db` after "
+            "turning on DB_SHARDS_FOLDER."
+        )
+    return path
+
+
+def _connect_pooled(database):
+    """Get the worker thread's open connection to a database file.
+
+    At most DB_SHARD_CONNECTIONS connections to party shards are kept open.
+    The directory connection, and connections with uncommitted writes, are
+    never closed to make room.
+    """
+    pool = _get_pool()
+    if database in pool:
+        pool.move_to_end(database)
+        return pool[database]
+
+    conn = open_connection(database, current_app.config)
+    pool[database] = conn
+    directory = current_app.config["DATABASE"]
+    shards = [path for path in pool if path != directory]
+    for path in shards[
+        : max(0, len(shards) - current_app.config["DB_SHARD_CONNECTIONS"])
+    ]:
+        if not pool[path].in_transaction:
+            pool.pop(path).close()
+    return conn
+
+
 def get_db():
-    """Get database connection."""
+    """Get database connection.
+
+    When DB_REUSE_CONNECTIONS is set, each worker thread keeps its connection
+    open between requests, so a request doesn't pay for opening the file and
+    reading the schema again.
+    """
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        database = _get_database()
+        if current_app.config["DB_REUSE_CONNECTIONS"]:
+            g.db = _connect_pooled(database)
+        else:
+            g.db = open_connection(database, current_app.config)
 
     return g.db
 
 
+@contextmanager
+def use_database(party_id=None):
+    """Run a block against the directory database, or against a party's shard.
+
+    The block is a unit of work of its own, with its own connection and
+    transaction. Writes that it doesn't commit are rolled back when it ends.
+    Without DB_SHARDS_FOLDER every party is in one file, so the block joins
+    the current unit of work.
+
+    Args:
+        party_id (int): The party whose shard to use. None uses the directory.
+    """
+    if current_app.config["DB_SHARDS_FOLDER"] is None:
+        yield
+        return
+
+    outer = {key: g.pop(key) for key in _UNIT_OF_WORK_KEYS if key in g}
+    g.db_party_id = party_id
+    try:
+        yield
+    finally:
+        close_db()
+        for key in _UNIT_OF_WORK_KEYS:
+            g.pop(key, None)
+        for key, value in outer.items():
+            setattr(g, key, value)
+
+
+def create_shard(party_id, in_memory=False):
+    """Create the database file of a party with an empty schema, when parties are sharded.
+
+    An existing file for the party is emptied.
+
+    Args:
+        party_id (int): The id of the party
+        in_memory (bool): Keep the party's database in memory, even when
+            DB_BACKEND keeps the others on disk
+    """
+    if current_app.config["DB_SHARDS_FOLDER"] is None:
+        return
+    path = shard_path(party_id)
+    memory = current_app.extensions["nobles_and_peasants.memory"]
+    if in_memory:
+        memory.create(path)
+    elif _memory_databases(path) is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    open_connection(path, current_app.config).close()
+    with use_database(party_id):
+        init_db()
+
+
+def get_shard_party_ids():
+    """Get the id of every party that has a database file, when parties are sharded."""
+    folder = current_app.config["DB_SHARDS_FOLDER"]
+    if folder is None:
+        return []
+    paths = list(current_app.extensions["nobles_and_peasants.memory"].connections)
+    if current_app.config["DB_BACKEND"] != "memory":
+        paths += glob.glob(os.path.join(glob.escape(folder), "party_*.sqlite"))
+    pattern = re.compile(re.escape(os.path.join(folder, "party_")) + r"(\d+)\.sqlite$")
+    return sorted(int(match.group(1)) for match in map(pattern.match, paths) if match)
+
+
 def close_db(e=None):
-    """Close database connection."""
+    """Close database connection, or hand it back to the worker's pool."""
     db = g.pop("db", None)
-    if db is not None:
+    if db is None:
+        return
+    # writes that were never committed are thrown away
+    if db.in_transaction:
+        db.rollback()
+        _run_rollback_callbacks()
+    if not current_app.config["DB_REUSE_CONNECTIONS"]:
         db.close()
 
 
+def close_pooled_connections():
+    """Close every connection that the current worker thread keeps open."""
+    g.pop("db", None)
+    pool = _get_pool()
+    while pool:
+        _, conn = pool.popitem()
+        conn.close()
+
+
+@contextmanager
+def transaction():
+    """Run every read and write of a unit of work in one transaction.
+
+    The transaction starts with BEGIN IMMEDIATE, so it takes the write lock
+    up front instead of failing halfway through when another request writes.
+    Writes made inside the transaction are committed once at the end, and
+    rolled back together if anything raises. Nested uses join the outer
+    transaction. It can also decorate a view function:
+
+        @bp.route("/buy_drink", methods=["POST"])
+        @login_required
+        @transaction()
+        def buy_drink():
+            ...
+    """
+    db = get_db()
+    if in_transaction():
+        yield db
+        return
+
+    if db.in_transaction:
+        commit()
+    db.execute("begin immediate")
+    g.in_transaction = True
+    try:
+        yield db
+    except BaseException:
+        g.in_transaction = False
+        db.rollback()
+        _run_rollback_callbacks()
+        raise
+    g.in_transaction = False
+    commit()
+
+
+def in_transaction():
+    """Check if the current unit of work is running inside transaction()."""
+    return g.get("in_transaction", False)
+
+
+def commit():
+    """Commit the writes of the current request to the database.
+
+    Functions registered with call_before_commit are called first, and can
+    still write as part of the same commit. Functions registered with
+    call_after_commit are called once the writes are saved.
+    """
+    for callback in g.pop("before_commit_callbacks", []):
+        callback()
+    get_db().commit()
+    g.pop("rollback_callbacks", None)
+    for callback in g.pop("commit_callbacks", []):
+        callback()
+
+
+def call_before_commit(callback):
+    """Call a function just before the writes of the current request are committed.
+
+    Use this to batch writes that go along with the request's other writes.
+    """
+    g.setdefault("before_commit_callbacks", []).append(callback)
+
+
+def call_after_commit(callback):
+    """Call a function once the writes of the current request are committed."""
+    g.setdefault("commit_callbacks", []).append(callback)
+
+
+def call_after_rollback(callback):
+    """Call a function if the writes of the current request are rolled back.
+
+    Use this to throw away in-memory state that was updated together with
+    the database.
+    """
+    g.setdefault("rollback_callbacks", []).append(callback)
+
+
+def _run_rollback_callbacks():
+    """Call every function that was registered with call_after_rollback."""
+    g.pop("before_commit_callbacks", None)
+    g.pop("commit_callbacks", None)
+    for callback in g.pop("rollback_callbacks", []):
+        callback()
+
+
 def init_db():
     """Initialize database."""
     db = get_db()
+    # tables added by migrations are not in schema.sql, so drop them here
+    tables = db.execute(
+        "select name from sqlite_master where type = 'table' and name not like 'sqlite_%'"
+    ).fetchall()
+    for table in tables:
+        db.execute(f'drop table if exists "{table["name"]}"')
     with current_app.open_resource("schema.sql") as f:
         db.executescript(f.read().decode("utf8"))
+    db.execute("pragma user_version = 0")
+    migrate_db()
+
+
+def get_migrations():
+    """Get the (version, filename) of each migration, in the order to apply them.
+
+    Migrations live in the migrations folder and are named like
+    ``0001_description.sql``. The number is the schema version that the
+    database is at after the migration is applied.
+    """
+    migrations_dir = os.path.join(current_app.root_path, "migrations")
+    migrations = []
+    for filename in os.listdir(migrations_dir):
+        match = re.match(r"^(\d+)_\w+\.sql$", filename)
+        if match is not None:
+            migrations.append((int(match.group(1)), filename))
+    return sorted(migrations)
+
+
+def get_schema_version():
+    """Get the version of the schema that the database is at."""
+    return get_db().execute("pragma user_version").fetchone()[0]
+
+
+def migrate_db():
+    """Apply every migration that the database has not seen yet.
+
+    Each migration runs in its own transaction together with the update to
+    the schema version, so a failed migration leaves the database untouched.
+
+    Returns:
+        List[str]: The filenames of the migrations that were applied
+    """
+    db = get_db()
+    current_version = get_schema_version()
+    applied = []
+    for version, filename in get_migrations():
+        if version <= current_version:
+            continue
+        with current_app.open_resource(os.path.join("migrations", filename)) as f:
+            migration = f.read().decode("utf8")
+        try:
+            db.executescript(
+                f"begin;\n{migration}\npragma user_version = {version};\ncommit;"
+            )
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        applied.append(filename)
+    return applied
+
+
+def get_party_tables():
+    """Get the tables that hold rows for each party, from their party_id column."""
+    db = get_db()
+    tables = db.execute(
+        "select name from sqlite_master where type = 'table' and name not like 'sqlite_%'"
+    ).fetchall()
+    return [
+        table["name"]
+        for table in tables
+        if table["name"] != "parties"
+        and any(
+            col["name"] == "party_id"
+            for col in db.execute(f'pragma table_info("{table["name"]}")')
+        )
+    ]
+
+
+def split_party(party_id, prune=False):
+    """Copy the rows of a party from the directory database into a new shard.
+
+    Args:
+        party_id (int): The id of the party
+        prune (bool): Delete the party's rows from the directory once they
+            are copied
+    """
+    with use_database():
+        tables = get_party_tables()
+
+    create_shard(party_id)
+    with use_database(party_id):
+        db = get_db()
+        db.execute(
+            "attach database ? as directory",
+            [database_uri(current_app.config["DATABASE"])],
+        )
+        try:
+            with transaction():
+                for table in tables:
+                    cols = ", ".join(
+                        f'"{col["name"]}"'
+                        for col in db.execute(f'pragma main.table_info("{table}")')
+                    )
+                    db.execute(
+                        f'insert into main."{table}" ({cols}) '
+                        f'select {cols} from directory."{table}" where party_id = ?',
+                        [party_id],
+                    )
+        finally:
+            db.execute("detach database directory")
+
+    if prune:
+        with use_database(), transaction():
+            for table in tables:
+                get_db().execute(
+                    f'delete from "{table}" where party_id = ?', [party_id]
+                )
+
+
+def drop_party(party_id):
+    """Delete a party, with its shard and every row that it has in the directory.
+
+    Viewers that are still logged in to it are logged out.
+    """
+    if current_app.config["DB_SHARDS_FOLDER"] is not None:
+        drop_database(shard_path(party_id))
+    with use_database(), transaction():
+        db = get_db()
+        for table in get_party_tables():
+            db.execute(f'delete from "{table}" where party_id = ?', [party_id])
+        db.execute("delete from parties where id = ?", [party_id])
+    memory = current_app.extensions["nobles_and_peasants.memory"]
+    memory.last_used.pop(party_id, None)
+    memory.dropped_parties.add(party_id)
+
+
+def is_dropped_party(party_id):
+    """Check if a party was dropped from memory since the server started."""
+    return (
+        party_id in current_app.extensions["nobles_and_peasants.memory"].dropped_parties
+    )
+
+
+def expire_idle_parties():
+    """Drop the parties in memory that nobody has played for DB_MEMORY_IDLE_SECONDS.
+
+    With DB_BACKEND "memory" every party is in memory. Otherwise only the
+    quick parties are, and the ones whose shard was lost when the server
+    restarted are dropped from the directory too.
+
+    Returns:
+        List[int]: The ids of the parties that were dropped
+    """
+    everything = current_app.config["DB_BACKEND"] == "memory"
+    if not everything and current_app.config["DB_SHARDS_FOLDER"] is None:
+        return []
+    if everything:
+        query = "select id from parties"
+    else:
+        query = "select party_id from quick_parties"
+    with use_database():
+        party_ids = [row[0] for row in get_db().execute(query)]
+
+    memory = current_app.extensions["nobles_and_peasants.memory"]
+    seconds = current_app.config["DB_MEMORY_IDLE_SECONDS"]
+    dropped = [
+        party_id
+        for party_id in party_ids
+        if memory.is_idle(party_id, seconds)
+        or not (everything or database_exists(shard_path(party_id)))
+    ]
+    for party_id in dropped:
+        drop_party(party_id)
+    return dropped
+
+
+def _use_memory_party():
+    """Note that the party in the session is in use, and drop idle parties now and then."""
+    memory = current_app.extensions["nobles_and_peasants.memory"]
+    party_id = session.get("party_id")
+    if party_id is not None:
+        if current_app.config["DB_SHARDS_FOLDER"] is None:
+            database = current_app.config["DATABASE"]
+        else:
+            database = shard_path(party_id)
+        if _memory_databases(database) is not None:
+            memory.touch(party_id)
+    if memory.is_expiry_due():
+        expire_idle_parties()
 
 
 @click.command("init-db")
+@with_appcontext
 def init_db_command():
     """Clear the existing data and create new tables."""
-    init_db()
+    with use_database():
+        init_db()
+    for party_id in get_shard_party_ids():
+        drop_database(shard_path(party_id))
     click.echo("Initialized the database.")
 
 
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Apply new migrations to the existing database without losing data."""
+    with use_database():
+        applied = migrate_db()
+        version = get_schema_version()
+    for filename in applied:
+        click.echo(f"Applied {filename}.")
+    click.echo(f"The database is at schema version {version}.")
+
+    for party_id in get_shard_party_ids():
+        with use_database(party_id):
+            applied = migrate_db()
+        if applied:
+            click.echo(f"Applied {len(applied)} migrations to party {party_id}.")
+
+
+@click.command("split-db")
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Delete each party's rows from the directory database once they are copied.",
+)
+@with_appcontext
+def split_db_command(prune):
+    """Copy each party into a database file of its own, in DB_SHARDS_FOLDER."""
+    if current_app.config["DB_SHARDS_FOLDER"] is None:
+        raise click.UsageError("Set DB_SHARDS_FOLDER to split the database.")
+
+    with use_database():
+        party_ids = [
+            row["id"] for row in get_db().execute("select id from parties order by id")
+        ]
+    existing = set(get_shard_party_ids())
+    for party_id in party_ids:
+        if party_id in existing:
+            # the shard may have newer writes than the directory
+            click.echo(f"Skipped party {party_id}: it already has a database file.")
+            continue
+        split_party(party_id=party_id, prune=prune)
+    click.echo(f"Split {len(set(party_ids) - existing)} parties.")
+
+
 def init_app(app):
     """Initialize the app."""
+    app.extensions["nobles_and_peasants.db"] = threading.local()
+    app.extensions["nobles_and_peasants.memory"] = MemoryDatabases()
+    app.before_request(_use_memory_party)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(split_db_command)
@@ -0,0 +1,86 @@
+"""Deal quests and challenges from a shuffled deck for each party.
+
+Picking with ``order by random()`` sorts every matching row on each request
+and can hand out the same card twice in a row. Instead, each worker keeps a
+shuffled deck of card ids for each party and deals from the top of it. When
+a deck runs out, it is rebuilt from the database, which also picks up cards
+that other workers added in the meantime.
+"""
+import random
+import threading
+
+from flask import current_app
+
+from nobles_and_peasants.cache import get_cache
+
+
+class Deck:
+    """A shuffled pile of card ids that is dealt from the top."""
+
+    def __init__(self, card_ids, last_dealt=None):
+        """Shuffle the card ids, keeping last_dealt away from the top of the deck."""
+        self.card_ids = list(card_ids)
+        random.shuffle(self.card_ids)
+        if len(self.card_ids) > 1 and self.card_ids[-1] == last_dealt:
+            self.card_ids[0], self.card_ids[-1] = self.card_ids[-1], self.card_ids[0]
+        self.last_dealt = last_dealt
+        self._lock = threading.Lock()
+
+    def deal(self):
+        """Take the card id from the top of the deck, or None if the deck is empty."""
+        with self._lock:
+            if not self.card_ids:
+                return None
+            self.last_dealt = self.card_ids.pop()
+            return self.last_dealt
+
+
+def _get_decks(table, party_id):
+    """Get the decks for a party's cards in a table, keyed by the deck name."""
+    cache = get_cache("decks", maxsize=current_app.config["DECK_CACHE_SIZE"])
+    decks = cache.get((table, party_id))
+    if decks is None:
+        decks = {}
+        cache.set((table, party_id), decks)
+    return decks
+
+
+def deal(table, party_id, deck_name, load_card_ids, load_card):
+    """Deal the next card from one of a party's decks.
+
+    Args:
+        table (str): The table that the cards are stored in
+        party_id (int): The party that the deck belongs to
+        deck_name (str): Which of the party's decks to deal from, e.g. a difficulty
+        load_card_ids (Callable[[], List[int]]): Get the ids of every card in the deck
+        load_card (Callable[[int], Any]): Get a card by its id. Returns None if
+            the card no longer exists.
+
+    Returns:
+        The card, or None if the deck has no cards at all
+    """
+    decks = _get_decks(table=table, party_id=party_id)
+    deck = decks.get(deck_name)
+    for _ in range(2):
+        card_id = None if deck is None else deck.deal()
+        if card_id is None:
+            last_dealt = None if deck is None else deck.last_dealt
+            deck = Deck(card_ids=load_card_ids(), last_dealt=last_dealt)
+            decks[deck_name] = deck
+            card_id = deck.deal()
+            if card_id is None:
+                return None
+
+        card = load_card(card_id)
+        if card is not None:
+            return card
+
+        # another worker deleted the card, so the deck is out of date
+        deck = None
+    return None
+
+
+def discard_decks(table, party_id):
+    """Throw away a party's decks for a table after its cards change."""
+    cache = get_cache("decks", maxsize=current_app.config["DECK_CACHE_SIZE"])
+    cache.discard((table, party_id))
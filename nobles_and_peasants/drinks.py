@@ -1,36 +1,25 @@
 """Functions related to the drinks table."""
 from flask import session
 
-from nobles_and_peasants.query import execute, fetch_all, fetch_one
+from nobles_and_peasants.parties import mark_party_changed
+from nobles_and_peasants.query import execute, fetch_all
+from nobles_and_peasants.settings import discard_party_settings, get_party_settings
 
 
 def get_drink_name_and_cost():
     """Get all drink names and costs."""
-    party_id = session.get("party_id")
-    query = """
-        select drink_name, drink_cost
-        from drinks
-        where party_id = ?
-        order by drink_cost
-    """
-    return fetch_all(query=query, args=[party_id])
+    return get_party_settings().drinks
 
 
 def get_cost_for_a_drink(drink_name):
     """Get the cost for a single drink."""
-    party_id = session.get("party_id")
-    query = """
-        select drink_cost
-        from drinks
-        where party_id = ?
-            and drink_name = ?
-    """
-    return fetch_one(query=query, args=[party_id, drink_name])
+    return get_party_settings().drink_costs.get(drink_name)
 
 
 def add_or_update_drink_name_and_cost(drink_name, drink_cost, commit=True):
     """Add a drink to a party, or update the cost if it already exists."""
     party_id = session.get("party_id")
+    discard_party_settings()
     query = """
         select drink_name
         from drinks
@@ -47,8 +36,9 @@ def add_or_update_drink_name_and_cost(drink_name, drink_cost, commit=True):
             where party_id = ?
                 and drink_name = ?
         """
-        execute(query=query, args=[drink_cost, party_id, drink_name], commit=commit)
+        execute(query=query, args=[drink_cost, party_id, drink_name], commit=False)
     else:
         # insert new drink
         query = "insert into drinks (party_id, drink_name, drink_cost) values (?, ?, ?)"
-        execute(query=query, args=[party_id, drink_name, drink_cost], commit=commit)
+        execute(query=query, args=[party_id, drink_name, drink_cost], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
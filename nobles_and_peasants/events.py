@@ -0,0 +1,348 @@
+"""Log every change to the players of a party, and replay a party from the log.
+
+The game_events table is append-only. Each event is one action from
+actions.py, such as buying a drink, with the action's arguments and every
+change that it made to the players table. Changes made outside an action
+are logged as events without one. Replaying a party's events rebuilds its
+players table.
+
+Events are queued in memory during a request, and inserted together just
+before the request's writes are committed. Logging adds one statement per
+commit, and rolled back writes are never logged.
+
+The players table is written alongside the log, in the same transaction,
+rather than derived from it: reads need the current players, and replaying
+events on every request would cost far more than the write.
+
+Every EVENT_SNAPSHOT_INTERVAL events, the party's players are saved in
+party_snapshots. A replay starts from the latest snapshot before the point
+in time that it replays to, so it never applies more than that many events.
+"""
+import functools
+import inspect
+import json
+
+import click
+from flask import current_app, g, session
+from flask.cli import with_appcontext
+
+from nobles_and_peasants import party_state
+from nobles_and_peasants.cache import get_cache
+from nobles_and_peasants.db import (
+    call_after_rollback,
+    call_before_commit,
+    in_transaction,
+    transaction,
+    use_database,
+)
+from nobles_and_peasants.parties import bump_party_generation
+from nobles_and_peasants.query import execute, execute_many, fetch_all, fetch_one
+
+
+def record_action(action=None, own_transaction=False):
+    """Log the changes that an action makes as one event.
+
+    The event records the action's name and arguments, and is inserted in
+    the same commit as the action's writes. An action that is taken outside
+    transaction() runs in one, so its writes and its event are committed
+    together. Actions that raise before they commit are not logged.
+
+    Use it as @record_action, or as @record_action(own_transaction=True)
+    for an action that makes every one of its writes inside a transaction()
+    of its own, so that its reads don't wait for the write lock.
+    """
+    if action is None:
+        return functools.partial(record_action, own_transaction=own_transaction)
+    signature = inspect.signature(action)
+
+    @functools.wraps(action)
+    def wrapped_action(*args, **kwargs):
+        if "action_event" in g:
+            # an action taken by another action is part of the same event
+            return action(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        event = {"args": dict(bound.arguments), "changes": []}
+        _queue_event(
+            party_id=session.get("party_id"), action=action.__name__, data=event
+        )
+        g.action_event = event
+        try:
+            if own_transaction or in_transaction():
+                return action(*args, **kwargs)
+            with transaction():
+                return action(*args, **kwargs)
+        except BaseException:
+            # the event is still queued if the action hadn't committed
+            if "pending_events" in g:
+                g.pending_events = [
+                    item for item in g.pending_events if item[2] is not event
+                ]
+            raise
+        finally:
+            g.pop("action_event")
+
+    return wrapped_action
+
+
+def _queue_event(party_id, action, data):
+    """Queue an event to be inserted when the request's writes are committed."""
+    if "pending_events" not in g:
+        g.pending_events = []
+        call_before_commit(_insert_pending_events)
+        call_after_rollback(lambda: g.pop("pending_events", None))
+    g.pending_events.append((party_id, action, data))
+
+
+def record_change(party_id, change):
+    """Log a change that was made to the players of a party.
+
+    Args:
+        party_id (int): The id of the party
+        change (dict): The change, in the form that party_state.apply_change takes
+    """
+    if "action_event" in g:
+        g.action_event["changes"].append(change)
+        return
+
+    # changes made outside an action are grouped until the next action
+    pending = g.get("pending_events")
+    if pending and pending[-1][0] == party_id and pending[-1][1] is None:
+        pending[-1][2]["changes"].append(change)
+    else:
+        _queue_event(party_id=party_id, action=None, data={"changes": [change]})
+
+
+def _insert_pending_events():
+    """Insert every queued event in one statement, and take snapshots that are due."""
+    pending = g.pop("pending_events", [])
+    if not pending:
+        return
+
+    query = """
+        insert into game_events (party_id, action, data)
+        values (?, ?, ?)
+    """
+    args_list = [
+        (party_id, action, json.dumps(data)) for party_id, action, data in pending
+    ]
+    execute_many(query=query, args_list=args_list, commit=False)
+
+    num_events = {}
+    for party_id, _, _ in pending:
+        num_events[party_id] = num_events.get(party_id, 0) + 1
+    for party_id, num in num_events.items():
+        _take_snapshot_if_due(party_id=party_id, num_events=num)
+
+
+def _count_events_since_snapshot(party_id):
+    """Count the events of a party since its last snapshot, and get the last one."""
+    query = """
+        select max(event_id)
+        from party_snapshots
+        where party_id = ?
+    """
+    last_snapshot = fetch_one(query=query, args=[party_id]) or 0
+    query = """
+        select count(*), max(id)
+        from game_events
+        where party_id = ?
+            and id > ?
+    """
+    num_events, last_event = fetch_all(query=query, args=[party_id, last_snapshot])[0]
+    return num_events, last_event
+
+
+def _take_snapshot_if_due(party_id, num_events):
+    """Save the players of a party once enough events were logged since the last save.
+
+    Each worker counts the events that it logs for a party in memory, so
+    most commits read nothing. The log is only counted when a worker first
+    sees a party, and when its count reaches EVENT_SNAPSHOT_INTERVAL, since
+    other workers log events and take snapshots too. With several workers,
+    a party can log up to one interval per worker between snapshots.
+
+    Args:
+        party_id (int): The id of the party
+        num_events (int): The number of events that were just inserted
+    """
+    interval = current_app.config["EVENT_SNAPSHOT_INTERVAL"]
+    counts = get_cache(
+        "event_counts", maxsize=current_app.config["PARTY_STATE_CACHE_SIZE"]
+    )
+    count = counts.get(party_id)
+    if count is not None and count + num_events < interval:
+        counts.set(party_id, count + num_events)
+        return
+
+    count, last_event = _count_events_since_snapshot(party_id=party_id)
+    if count >= interval:
+        save_snapshot(party_id=party_id, event_id=last_event)
+        count = 0
+    counts.set(party_id, count)
+
+
+def save_snapshot(party_id, event_id, players=None):
+    """Save the players of a party as of an event.
+
+    Args:
+        party_id (int): The id of the party
+        event_id (int): The id of the last event that the players reflect
+        players (List[dict]): The players to save. None saves the players
+            table as it is now.
+    """
+    if players is None:
+        query = """
+            select id, player_name, player_status, coin, noble_name, drinks, soldiers
+            from players
+            where party_id = ?
+        """
+        players = [dict(row) for row in fetch_all(query=query, args=[party_id])]
+    query = """
+        insert into party_snapshots (party_id, event_id, players)
+        values (?, ?, ?)
+    """
+    execute(query=query, args=[party_id, event_id, json.dumps(players)], commit=False)
+
+
+def find_event_at(party_id, timestamp):
+    """Get the id of the last event of a party at a point in time.
+
+    Args:
+        party_id (int): The id of the party
+        timestamp (str): A UTC time, like 2024-01-31 21:30:00
+
+    Returns:
+        int: The event id, or 0 if the party had no events yet
+    """
+    query = """
+        select max(id)
+        from game_events
+        where party_id = ?
+            and created <= ?
+    """
+    return fetch_one(query=query, args=[party_id, timestamp]) or 0
+
+
+def replay_party(party_id, until=None):
+    """Rebuild the players of a party from the latest snapshot and the events after it.
+
+    Args:
+        party_id (int): The id of the party
+        until (int): The id of the last event to apply. None applies every event.
+
+    Returns:
+        Tuple[PartyState, int]: The players, and the id of the last event applied
+    """
+    if until is None:
+        until = fetch_one(
+            query="select max(id) from game_events where party_id = ?", args=[party_id]
+        )
+        until = until or 0
+
+    query = """
+        select event_id, players
+        from party_snapshots
+        where party_id = ?
+            and event_id <= ?
+        order by event_id desc, id desc
+        limit 1
+    """
+    snapshot = fetch_all(query=query, args=[party_id, until])
+    if snapshot:
+        start, players = snapshot[0]["event_id"], json.loads(snapshot[0]["players"])
+    else:
+        start, players = 0, []
+    state = party_state.PartyState(
+        party_id=party_id,
+        generation=None,
+        players=[party_state.Player(**p) for p in players],
+    )
+
+    query = """
+        select data
+        from game_events
+        where party_id = ?
+            and id > ?
+            and id <= ?
+        order by id
+    """
+    for row in fetch_all(query=query, args=[party_id, start, until]):
+        for change in json.loads(row["data"])["changes"]:
+            party_state.apply_change(state, change)
+    return state, until
+
+
+def restore_party(party_id, until=None):
+    """Overwrite the players table of a party with a replay of its log.
+
+    The restore is logged as an event, followed by a snapshot, so later
+    replays start from the restored players.
+
+    Args:
+        party_id (int): The id of the party
+        until (int): The id of the last event to apply. None applies every event.
+
+    Returns:
+        PartyState: The restored players
+    """
+    with transaction():
+        state, until = replay_party(party_id=party_id, until=until)
+        players = [{col: p[col] for col in p.keys()} for p in state.players.values()]
+        execute(
+            query="delete from players where party_id = ?",
+            args=[party_id],
+            commit=False,
+        )
+        execute_many(
+            query="""
+                insert into players (id, party_id, player_name, player_status, coin, noble_name, drinks, soldiers)
+                values (:id, :party_id, :player_name, :player_status, :coin, :noble_name, :drinks, :soldiers)
+            """,
+            args_list=[{**p, "party_id": party_id} for p in players],
+            commit=False,
+        )
+        event_id = execute(
+            query="""
+                insert into game_events (party_id, action, data)
+                values (?, 'restore', ?)
+            """,
+            args=[party_id, json.dumps({"args": {"until": until}, "changes": []})],
+            commit=False,
+        )
+        save_snapshot(party_id=party_id, event_id=event_id, players=players)
+        # workers that keep the party in memory load it again
+        bump_party_generation(party_id=party_id, commit=False)
+    return state
+
+
+@click.command("replay-party")
+@click.argument("party_id", type=int)
+@click.option("--until", type=int, help="The id of the last event to apply.")
+@click.option("--at", help="Replay to a UTC time, like '2024-01-31 21:30:00'.")
+@click.option(
+    "--write", is_flag=True, help="Overwrite the players table with the replay."
+)
+@with_appcontext
+def replay_party_command(party_id, until, at, write):
+    """Rebuild the players of a party from its game event log."""
+    with use_database(party_id):
+        if at is not None:
+            until = find_event_at(party_id=party_id, timestamp=at)
+        if write:
+            state = restore_party(party_id=party_id, until=until)
+            click.echo(f"Restored {len(state.players)} players of party {party_id}.")
+            return
+        state, until = replay_party(party_id=party_id, until=until)
+
+    click.echo(f"Party {party_id} as of event {until}:")
+    for p in sorted(state.players.values(), key=lambda p: p.player_name):
+        click.echo(
+            f"{p.player_name}\t{p.player_status}\t{p.noble_name}"
+            f"\tcoin={p.coin}\tdrinks={p.drinks}\tsoldiers={p.soldiers}"
+        )
+
+
+def init_app(app):
+    """Register the replay command with the app."""
+    app.cli.add_command(replay_party_command)
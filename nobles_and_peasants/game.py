@@ -1,55 +1,64 @@
 """Module for the game."""
-from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+import functools
+
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    flash,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
 
+from nobles_and_peasants import actions
+from nobles_and_peasants.actions import ActionError
 from nobles_and_peasants.auth import login_required
 from nobles_and_peasants.challenges import (
     add_challenge_to_party,
+    add_challenges_to_party,
     delete_challenge_from_table,
     get_all_challenges,
-    get_random_challenge,
     is_challenge_in_party,
+    iterate_challenges,
 )
-from nobles_and_peasants.constants import NOBLE, PEASANT
+from nobles_and_peasants.constants import NOBLE
+from nobles_and_peasants.db import transaction
 from nobles_and_peasants.drinks import (
     add_or_update_drink_name_and_cost,
-    get_cost_for_a_drink,
     get_drink_name_and_cost,
 )
-from nobles_and_peasants.outlaws import (
-    is_peasant_banned,
-    insert_new_outlaw,
+from nobles_and_peasants.library import (
+    FORMATS,
+    content_disposition,
+    format_library,
+    parse_library,
 )
+from nobles_and_peasants.live import stream_party
+from nobles_and_peasants.parties import get_party_generation
 from nobles_and_peasants.players import (
-    find_richest_peasant,
     get_all_nobles,
     get_all_players,
     get_almighty_ruler,
-    get_single_player,
-    increment_coin,
-    increment_drinks,
-    increment_soldiers,
-    insert_new_player,
-    move_coin_between_players,
-    randomly_choose_player_status,
-    update_after_pledge_allegiance,
-    upgrade_peasant_and_downgrade_noble,
-    set_allegiance,
 )
 from nobles_and_peasants.starting_coin import (
     get_status_and_starting_coin,
-    get_starting_coin_for_status,
     update_noble_starting_coin,
 )
 from nobles_and_peasants.quests import (
     add_quest_to_party,
+    add_quests_to_party,
     delete_quest_from_table,
     get_all_quests,
-    get_random_quest,
     is_quest_in_party,
+    iterate_quests,
 )
 from nobles_and_peasants.quest_rewards import (
     get_quest_difficulty_and_reward,
-    get_reward_for_difficulty,
     set_quest_rewards,
 )
 
@@ -90,6 +99,7 @@ def show_rules():
 
 @bp.route("/add_drink", methods=["POST"])
 @login_required
+@transaction()
 def add_drink():
     """Process request to add a drink to the party."""
     drink_name = request.form["drink_name"].strip().lower()
@@ -101,6 +111,7 @@ def add_drink():
 
 @bp.route("/set_coin", methods=["POST"])
 @login_required
+@transaction()
 def set_coin():
     """Respond to request to set starting coin for each role."""
     noble_coin = int(request.form["noble_coin"])
@@ -110,6 +121,7 @@ def set_coin():
 
 @bp.route("/set_wages", methods=["POST"])
 @login_required
+@transaction()
 def set_wages():
     """Respond to a request to set rewards for quests."""
     easy_reward = int(request.form["easy"])
@@ -138,6 +150,7 @@ def set_wages():
 
 @bp.route("/add_quest", methods=["POST"])
 @login_required
+@transaction()
 def add_quest():
     """Respond to request to add a quest to the party."""
     quest = request.form["quest"]
@@ -149,6 +162,7 @@ def add_quest():
 
 @bp.route("/delete_quest", methods=["POST"])
 @login_required
+@transaction()
 def delete_quest():
     """Respond to request to delete a quest from the party."""
     quest_id = int(request.form["quest_id"])
@@ -164,6 +178,7 @@ def delete_quest():
 
 @bp.route("/add_challenge", methods=["POST"])
 @login_required
+@transaction()
 def add_challenge():
     """Respond to request to add a challenge to the party."""
     challenge = request.form["challenge"]
@@ -174,6 +189,7 @@ def add_challenge():
 
 @bp.route("/delete_challenge", methods=["POST"])
 @login_required
+@transaction()
 def delete_challenge():
     """Respond to request to delete a challenge from the party."""
     challenge_id = int(request.form["challenge_id"])
@@ -187,6 +203,92 @@ def delete_challenge():
     return redirect(url_for("game.set_up"))
 
 
+@bp.route("/import_quests", methods=["POST"])
+@login_required
+@transaction()
+def import_quests():
+    """Respond to request to add a CSV or JSON file of quests to the party."""
+    library = request.files.get("library")
+    if library is None or library.filename == "":
+        flash("Unsuccessful! Please choose a file of quests to upload.")
+        return redirect(url_for("game.set_up"))
+
+    try:
+        rows = parse_library(file=library, columns=["quest", "difficulty"])
+    except ValueError as e:
+        flash(f"Unsuccessful! {e}")
+        return redirect(url_for("game.set_up"))
+
+    quests = [(quest, difficulty.lower()) for quest, difficulty in rows]
+    difficulties = {row["difficulty"] for row in get_quest_difficulty_and_reward()}
+    unknown = sorted({d for _, d in quests if d not in difficulties})
+    if unknown:
+        msg = f"Unsuccessful! Quest difficulty must be one of {', '.join(sorted(difficulties))}. You used: {', '.join(unknown)}."
+        flash(msg)
+        return redirect(url_for("game.set_up"))
+
+    num_added = add_quests_to_party(quests=quests)
+    flash(f"Success! Added {num_added} new quests from {library.filename}.")
+    return redirect(url_for("game.set_up"))
+
+
+@bp.route("/import_challenges", methods=["POST"])
+@login_required
+@transaction()
+def import_challenges():
+    """Respond to request to add a CSV or JSON file of challenges to the party."""
+    library = request.files.get("library")
+    if library is None or library.filename == "":
+        flash("Unsuccessful! Please choose a file of challenges to upload.")
+        return redirect(url_for("game.set_up"))
+
+    try:
+        rows = parse_library(file=library, columns=["challenge"])
+    except ValueError as e:
+        flash(f"Unsuccessful! {e}")
+        return redirect(url_for("game.set_up"))
+
+    challenges = [challenge for (challenge,) in rows]
+    num_added = add_challenges_to_party(challenges=challenges)
+    flash(f"Success! Added {num_added} new challenges from {library.filename}.")
+    return redirect(url_for("game.set_up"))
+
+
+def _export_library(rows, columns, name):
+    """Stream a party's quests or challenges as a file download."""
+    file_format = request.args.get("format", "csv")
+    if file_format not in FORMATS:
+        msg = f"Unsuccessful! Export format must be one of {', '.join(FORMATS)}."
+        flash(msg)
+        return redirect(url_for("game.set_up"))
+
+    mimetype = "application/json" if file_format == "json" else "text/csv"
+    filename = f"{session.get('party_name')}_{name}.{file_format}"
+    return Response(
+        stream_with_context(format_library(rows, columns, file_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
+
+
+@bp.route("/export_quests")
+@login_required
+def export_quests():
+    """Respond to request to download every quest in the party."""
+    return _export_library(
+        rows=iterate_quests(), columns=["quest", "difficulty"], name="quests"
+    )
+
+
+@bp.route("/export_challenges")
+@login_required
+def export_challenges():
+    """Respond to request to download every challenge in the party."""
+    return _export_library(
+        rows=iterate_challenges(), columns=["challenge"], name="challenges"
+    )
+
+
 # ############################################################
 # ################### Show main page #########################
 # ############################################################
@@ -221,27 +323,14 @@ def show_main():
 
 @bp.route("/sign_in", methods=["POST"])
 @login_required
+@transaction()
 def sign_in():
     """Process a player's request to sign in to the game."""
-    player_name = request.form["player_name"].strip().lower()
-    player_status = request.form["player_status"]
-
-    players = get_all_players()
-
-    existing_players = [row["player_name"] for row in players]
-    if player_name in existing_players:
-        msg = f"Unsuccessful! Please choose a different name. Someone already selected {player_name}."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if player_status == "randomly decide":
-        status = randomly_choose_player_status(players=players)
-    else:
-        status = player_status
-
-    insert_new_player(player_name=player_name, player_status=status)
-
-    return redirect(url_for("game.show_main"))
+    return _take_action(
+        actions.sign_in,
+        player_name=request.form["player_name"],
+        player_status=request.form["player_status"],
+    )
 
 
 ############################################################
@@ -251,41 +340,14 @@ def sign_in():
 
 @bp.route("/pledge", methods=["POST"])
 @login_required
+@transaction()
 def pledge_allegiance():
     """Process the request to pledge allegiance to a noble."""
-    player_name = request.form["player_name"].strip().lower()
-    noble_name = request.form["noble_name"].strip().lower()
-
-    player = get_single_player(player_name=player_name)
-    noble = get_single_player(player_name=noble_name)
-
-    if player is None:
-        msg = f"Unsuccessful! Please enter a valid name for yourself. You entered: {player_name}. Have you signed in?"
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if noble is None:
-        msg = f"Unsuccessful! Please enter a valid name for the noble. You entered: {noble_name}."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if noble["player_status"] != NOBLE:
-        msg = f"Unsuccessful! {noble_name} is not a noble."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if player["player_status"] == NOBLE:
-        msg = f"Unsuccessful! {player_name} is a noble. You must be allied to yourself."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if is_peasant_banned(noble_id=noble["id"], peasant_id=player["id"]):
-        msg = f"Unsuccessful! {noble_name} has banned you from their kingdom!"
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    update_after_pledge_allegiance(player_name=player_name, noble_name=noble_name)
-    return redirect(url_for("game.show_main"))
+    return _take_action(
+        actions.pledge,
+        player_name=request.form["player_name"],
+        noble_name=request.form["noble_name"],
+    )
 
 
 ############################################################
@@ -296,35 +358,16 @@ def pledge_allegiance():
 @bp.route("/buy_drink", methods=["POST"])
 @login_required
 def buy_drink():
-    """Process the request to buy a drink."""
-    player_name = request.form["player_name"].strip().lower()
-    drink_name = request.form["drink_name"]
-    quantity = int(request.form["quantity"])
-
-    noble_name = get_single_player(player_name=player_name, col="noble_name")
-    if noble_name is None:
-        msg = "Unsuccessful! You need to ally yourself to a noble before you can buy a drink."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    price = get_cost_for_a_drink(drink_name=drink_name)
-    cost = price * quantity
-
-    noble = get_single_player(player_name=noble_name)
-
-    increment_coin(player_name=noble_name, coin=-cost)
-    increment_drinks(player_name=player_name, num=quantity)
-
-    # the noble doesn't have any more money
-    if noble["coin"] <= cost:
-        new_noble_name = find_richest_peasant()
-        upgrade_peasant_and_downgrade_noble(
-            peasant_name=new_noble_name, noble_name=noble_name
-        )
-        msg = f"{noble_name} ran out of money! {new_noble_name} is now a noble!"
-        flash(msg)
-
-    return redirect(url_for("game.show_main"))
+    """Process the request to buy a drink.
+
+    The action takes the write lock only for its writes. See actions.buy_drink.
+    """
+    return _take_action(
+        actions.buy_drink,
+        player_name=request.form["player_name"],
+        drink_name=request.form["drink_name"],
+        quantity=request.form["quantity"],
+    )
 
 
 ############################################################
@@ -334,40 +377,14 @@ def buy_drink():
 
 @bp.route("/ban", methods=["POST"])
 @login_required
+@transaction()
 def ban_peasant():
     """Respond to a request to ban a peasant from a noble's army."""
-    noble_name = request.form["noble_name"].strip().lower()
-    peasant_name = request.form["peasant_name"].strip().lower()
-
-    noble = get_single_player(player_name=noble_name)
-    peasant = get_single_player(player_name=peasant_name)
-
-    if noble is None:
-        msg = f"Unsuccessful! {noble_name} is not recognized. Did you enter your name correctly?"
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if peasant is None:
-        msg = f"Unsuccessful! {peasant_name} is not recognized. Did you enter their name correctly?"
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if noble["player_status"] != NOBLE:
-        msg = f"Unsuccessful! {noble_name} is not a noble. You cannot ban people from kingdom you do not have."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    # remove the peasant's allegiance to the noble that is banning them
-    if peasant["noble_name"] == noble_name:
-        set_allegiance(player_name=peasant_name, noble_name=None)
-        increment_soldiers(player_name=noble_name, num=-1)
-
-    # add the peasant to a banned table
-    insert_new_outlaw(noble_id=noble["id"], peasant_id=peasant["id"])
-    msg = f"{noble_name} has banned {peasant_name}!"
-    flash(msg)
-
-    return redirect(url_for("game.show_main"))
+    return _take_action(
+        actions.ban,
+        noble_name=request.form["noble_name"],
+        peasant_name=request.form["peasant_name"],
+    )
 
 
 ############################################################
@@ -382,13 +399,12 @@ def get_quest():
     player_name = request.form["player_name"].strip().lower()
     difficulty = request.form["difficulty"].strip().lower()
 
-    player = get_single_player(player_name=player_name)
-    if player is None:
-        msg = f"Unsuccessful! {player_name} is not in the party. Did you enter your name correctly?"
-        flash(msg)
+    try:
+        quest = actions.get_quest(player_name=player_name, difficulty=difficulty)
+    except ActionError as e:
+        flash(str(e))
         return redirect(url_for("game.show_main"))
 
-    quest = get_random_quest(difficulty=difficulty)
     return render_template(
         "quest.html",
         player_name=player_name,
@@ -400,19 +416,15 @@ def get_quest():
 
 @bp.route("/add_money", methods=["POST"])
 @login_required
+@transaction()
 def add_money():
     """Respond to a request after a player completes a quest."""
-    player_name = request.form["player_name"].strip().lower()
-    difficulty = request.form["difficulty"]
-    result = request.form["result"]
-
-    if result == "Yes":
-        reward = get_reward_for_difficulty(difficulty=difficulty)
-        increment_coin(player_name=player_name, coin=reward)
-        msg = f"{player_name} has earned {reward} coin for completing a {difficulty} quest!"
-        flash(msg)
-
-    return redirect(url_for("game.show_main"))
+    return _take_action(
+        actions.complete_quest,
+        player_name=request.form["player_name"],
+        difficulty=request.form["difficulty"],
+        result=request.form["result"],
+    )
 
 
 ############################################################
@@ -427,33 +439,12 @@ def kill():
     player_name = request.form["player_name"].strip().lower()
     target_name = request.form["target_name"].strip().lower()
 
-    player = get_single_player(player_name=player_name)
-    target = get_single_player(player_name=target_name)
-
-    if player is None:
-        msg = f"Unsuccessful! {player_name} is not in the party."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if target is None:
-        msg = f"Unsuccessful! {target_name} is not in the party."
-        flash(msg)
-        return redirect(url_for("game.show_main"))
-
-    if player_name == target_name:
-        msg = "Unsuccessful! You cannot try to assassinate yourself!"
-        flash(msg)
+    try:
+        challenge = actions.kill(player_name=player_name, target_name=target_name)
+    except ActionError as e:
+        flash(str(e))
         return redirect(url_for("game.show_main"))
 
-    if player["player_status"] == PEASANT and target["player_status"] == NOBLE:
-        coin_needed = get_starting_coin_for_status(player_status=NOBLE)
-        if player["coin"] < coin_needed:
-            msg = f"Unsuccessful! You need {coin_needed} coin to assassinate a noble."
-            flash(msg)
-            return redirect(url_for("game.show_main"))
-
-    challenge = get_random_challenge()
-
     return render_template(
         "kill.html",
         challenge=challenge,
@@ -465,38 +456,25 @@ def kill():
 
 @bp.route("/assassinate", methods=["POST"])
 @login_required
+@transaction()
 def assassinate():
     """Respond to request on if a player was assassinated."""
-    player_name = request.form["player_name"]
-    target_name = request.form["target_name"]
-    winner_name = request.form["winner_name"]
-
-    if player_name == winner_name:
-        loser_name = target_name
-    else:
-        loser_name = player_name
-
-    winner_status = get_single_player(player_name=winner_name, col="player_status")
-    loser_status = get_single_player(player_name=loser_name, col="player_status")
-
-    if winner_status == PEASANT and loser_status == NOBLE:
-        upgrade_peasant_and_downgrade_noble(
-            peasant_name=winner_name, noble_name=loser_name
-        )
-        msg = f"{winner_name} assassinated {loser_name}! {winner_name} is now a noble!"
-    elif winner_status == NOBLE and loser_status == NOBLE:
-        new_noble_name = find_richest_peasant()
-        upgrade_peasant_and_downgrade_noble(
-            peasant_name=new_noble_name, noble_name=loser_name
-        )
-        msg = (
-            f"{winner_name} assassinated {loser_name}! {new_noble_name} is now a noble!"
-        )
-    else:
-        move_coin_between_players(from_name=loser_name, to_name=winner_name)
-        msg = f"{winner_name} has taken all of the coin of {loser_name}"
-
-    flash(msg)
+    return _take_action(
+        actions.assassinate,
+        player_name=request.form["player_name"],
+        target_name=request.form["target_name"],
+        winner_name=request.form["winner_name"],
+    )
+
+
+def _take_action(action, **kwargs):
+    """Take an action, show its message and go back to the main page."""
+    try:
+        msg = action(**kwargs)
+    except ActionError as e:
+        msg = str(e)
+    if msg is not None:
+        flash(msg)
     return redirect(url_for("game.show_main"))
 
 
@@ -505,8 +483,41 @@ def assassinate():
 # ############################################################
 
 
+def cached_until_party_changes(view):
+    """Answer 304 Not Modified when the viewer already has the party's current page.
+
+    The page's ETag is the party's generation, which every write to the party
+    bumps, so a 304 costs a single primary key lookup: no players are read and
+    no template is rendered. Browsers check the ETag on every view, since the
+    page may change at any time. The ETag also has the version of the built
+    static files, so a deploy that changes them isn't answered with a page
+    that links to the old ones.
+    """
+
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        party_id = session.get("party_id")
+        # read before the view runs, so a write during the view only makes
+        # the ETag older than the page, never newer
+        generation = get_party_generation(party_id=party_id)
+        assets = current_app.extensions["nobles_and_peasants.assets"]
+        etag = f"{view.__name__}-{party_id}-{generation}-{assets.version}"
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(**kwargs))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+    return wrapped_view
+
+
 @bp.route("/kingdom")
 @login_required
+@cached_until_party_changes
 def show_kingdom():
     """Show the page that lists all players."""
     players = get_all_players()
@@ -517,9 +528,10 @@ def show_kingdom():
 
 @bp.route("/leaderboard")
 @login_required
+@cached_until_party_changes
 def show_leaderboard():
     """Show the page for the leaderboard."""
-    leaderboard = get_all_nobles()
+    leaderboard = get_all_nobles(limit=current_app.config["LEADERBOARD_SIZE"])
     almighty_ruler = get_almighty_ruler()
     return render_template(
         "show_leaderboard.html",
@@ -527,3 +539,14 @@ def show_leaderboard():
         almighty_ruler=almighty_ruler,
         party_name=session.get("party_name"),
     )
+
+
+@bp.route("/live")
+@login_required
+def live():
+    """Stream changes to the players of the party to the kingdom and leaderboard."""
+    return Response(
+        stream_with_context(stream_party()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
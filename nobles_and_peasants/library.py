@@ -0,0 +1,109 @@
+"""Read and write a party's library of quests and challenges as CSV or JSON.
+
+A quest file has a quest and a difficulty for each quest, and a challenge
+file has a challenge for each challenge. For example::
+
+    quest,difficulty
+    Dance with an inanimate object for a minute.,medium
+
+    [{"challenge": "DUEL: Challenge your target to a game of flip cup."}]
+"""
+import csv
+import io
+import json
+from urllib.parse import quote
+
+FORMATS = ("csv", "json")
+
+
+def parse_library(file, columns):
+    """Read rows from an uploaded CSV or JSON file.
+
+    Args:
+        file (werkzeug.datastructures.FileStorage): The uploaded file
+        columns (List[str]): The columns that every row must have
+
+    Returns:
+        List[tuple]: The values of the columns for each row, with whitespace
+            trimmed and duplicate rows removed
+
+    Raises:
+        ValueError: If the file can't be read, or a row is missing a column
+    """
+    try:
+        text = file.read().decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"{file.filename} is not a UTF-8 text file.") from e
+    if file.filename.lower().endswith(".json"):
+        try:
+            records = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{file.filename} is not valid JSON: {e}") from e
+        if not isinstance(records, list) or not all(
+            isinstance(r, dict) for r in records
+        ):
+            raise ValueError(f"{file.filename} must be a JSON list of objects.")
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    rows = []
+    for i, record in enumerate(records, start=1):
+        values = tuple(_text(record.get(col)).strip() for col in columns)
+        if "" in values:
+            missing = columns[values.index("")]
+            raise ValueError(f"Row {i} of {file.filename} is missing a {missing}.")
+        rows.append(values)
+    return list(dict.fromkeys(rows))
+
+
+def _text(value):
+    """Get the text of a value from a file, where only a missing value is empty."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    # numbers and booleans from JSON keep their JSON spelling, like false
+    return json.dumps(value)
+
+
+def content_disposition(filename):
+    """Get the Content-Disposition header that downloads a file with the given name.
+
+    The name is quoted. A name that isn't plain ASCII is also given as
+    filename*, for the browsers that understand it.
+    """
+    ascii_name = filename.encode("ascii", "replace").decode("ascii")
+    escaped = ascii_name.replace("\\", "\\\\").replace('"', '\\"')
+    header = f'attachment; filename="{escaped}"'
+    if ascii_name != filename:
+        header += f"; filename*=UTF-8''{quote(filename, safe='')}"
+    return header
+
+
+def format_library(rows, columns, file_format):
+    """Write rows as CSV or JSON, one row at a time.
+
+    Args:
+        rows (Iterable[sqlite3.Row]): The rows to write
+        columns (List[str]): The columns to write for each row
+        file_format (str): Either csv or json
+
+    Yields:
+        str: The next piece of the file
+    """
+    if file_format == "json":
+        yield "["
+        for i, row in enumerate(rows):
+            separator = "" if i == 0 else ","
+            yield separator + json.dumps({col: row[col] for col in columns})
+        yield "]\n"
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row[col] for col in columns])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
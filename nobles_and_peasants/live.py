@@ -0,0 +1,339 @@
+"""Push changes to the players of a party to open kingdom and leaderboard pages.
+
+The pages subscribe to the party's stream of server-sent events at /live.
+Every write in players.py is recorded here through party_state.py, and once
+the write commits, the changed players are read from the database in one
+query and the event is fanned out to every viewer of the party on this
+worker. Each viewer keeps every player of the party and draws the kingdom
+and the leaderboard from them, so viewers never query the database.
+
+A viewer first gets a snapshot of every player, and then only the players
+that changed. The snapshot is kept in memory for as long as a party has
+viewers, so new viewers don't query the database either.
+
+Writes made by other workers are caught up once every LIVE_HEARTBEAT_SECONDS,
+when one viewer of the party checks the party's generation and sends a new
+snapshot if it moved. Viewers that fall more than LIVE_QUEUE_SIZE events
+behind skip the events that they missed and get a new snapshot.
+"""
+import json
+import queue
+import threading
+import time
+
+from flask import current_app, g, session
+
+from nobles_and_peasants.db import (
+    call_after_commit,
+    call_after_rollback,
+    use_database,
+)
+from nobles_and_peasants.parties import get_party_generation
+from nobles_and_peasants.query import fetch_all
+
+PLAYER_COLUMNS = (
+    "id",
+    "player_name",
+    "player_status",
+    "coin",
+    "noble_name",
+    "drinks",
+    "soldiers",
+)
+
+# a comment line keeps proxies from closing an idle stream
+HEARTBEAT = b": heartbeat\n\n"
+
+
+def format_event(event, data):
+    """Encode an event in the text/event-stream format.
+
+    Args:
+        event (str): The name of the event
+        data (dict): The data of the event, sent as json
+
+    Returns:
+        bytes: The event, ready to be written to every viewer
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class Subscription:
+    """The events waiting to be sent to one viewer."""
+
+    def __init__(self, maxsize):
+        """Initialize a subscription with room for maxsize events."""
+        self.events = queue.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def put(self, event):
+        """Queue an event, or mark the viewer as lagged if it is too far behind."""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.lagged = True
+
+    def get(self, timeout):
+        """Wait for the next event, or return None after timeout seconds."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """Throw away every queued event."""
+        self.lagged = False
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                return
+
+
+class Channel:
+    """The viewers of one party and the latest state of its players.
+
+    Args:
+        party_id (int): The id of the party
+        generation (int): The generation of the party that the players reflect
+        players (List[dict]): Every player in the party
+    """
+
+    def __init__(self, party_id, generation, players):
+        """Initialize a channel with no viewers."""
+        self.party_id = party_id
+        self.generation = generation
+        self.players = {p["player_name"]: p for p in players}
+        self.subscribers = set()
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """Encode every player of the party as a snapshot event."""
+        return format_event(
+            "snapshot",
+            {"generation": self.generation, "players": list(self.players.values())},
+        )
+
+    def publish(self, event):
+        """Send an encoded event to every viewer."""
+        for subscription in list(self.subscribers):
+            subscription.put(event)
+
+
+class Broker:
+    """The channels of every party with viewers on this worker."""
+
+    def __init__(self):
+        """Initialize a broker with no channels."""
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def has_subscribers(self, party_id):
+        """Check if a party has any viewers on this worker."""
+        return party_id in self.channels
+
+    def subscribe(self, party_id, load, subscription):
+        """Add a viewer to a party, loading the party if it has no channel yet.
+
+        Args:
+            party_id (int): The id of the party
+            load (Callable[[], Channel]): Read the party from the database
+            subscription (Subscription): Where the party's events are sent
+
+        Returns:
+            Tuple[Channel, Subscription]: The party's channel and the new viewer
+        """
+        with self.lock:
+            channel = self.channels.get(party_id)
+            if channel is None:
+                channel = self.channels[party_id] = load()
+            channel.subscribers.add(subscription)
+        return channel, subscription
+
+    def unsubscribe(self, channel, subscription):
+        """Remove a viewer, and drop the channel once it has none."""
+        with self.lock:
+            channel.subscribers.discard(subscription)
+            if (
+                not channel.subscribers
+                and self.channels.get(channel.party_id) is channel
+            ):
+                del self.channels[channel.party_id]
+
+
+def get_broker(app=None):
+    """Get the broker of an app, or of the current app if app is None."""
+    app = current_app if app is None else app
+    return app.extensions["nobles_and_peasants.live"]
+
+
+def _read_players(party_id, player_names=None, noble_names=None):
+    """Read players of a party, as dicts that can be sent as json.
+
+    Args:
+        party_id (int): The id of the party
+        player_names (Iterable[str]): Only read these players. None reads
+            every player.
+        noble_names (Iterable[str]): Also read every player allied to these nobles
+    """
+    query = f"""
+        select {", ".join(PLAYER_COLUMNS)}
+        from players
+        where party_id = ?
+    """
+    args = [party_id]
+    if player_names is not None:
+        player_names = list(player_names)
+        noble_names = list(noble_names or ())
+        query += f"""
+            and (
+                player_name in ({", ".join("?" * len(player_names))})
+                or noble_name in ({", ".join("?" * len(noble_names))})
+            )
+        """
+        args += player_names + noble_names
+    rows = fetch_all(query=query, args=args)
+    return [dict(zip(PLAYER_COLUMNS, row)) for row in rows]
+
+
+def _load_channel(party_id):
+    """Read every player of a party into a new channel."""
+    generation = get_party_generation(party_id=party_id)
+    return Channel(
+        party_id=party_id,
+        generation=generation,
+        players=_read_players(party_id=party_id),
+    )
+
+
+def record_change(party_id, generation, player_names=(), noble_names=()):
+    """Remember the players that a write changed, to publish once it commits.
+
+    Nothing is recorded for parties without viewers on this worker.
+
+    Args:
+        party_id (int): The id of the party
+        generation (int): The generation of the party after the write
+        player_names (Iterable[str]): The players that were changed
+        noble_names (Iterable[str]): The nobles whose whole army was changed
+    """
+    if not get_broker().has_subscribers(party_id):
+        return
+
+    changes = g.setdefault("live_changes", {})
+    if party_id not in changes:
+        changes[party_id] = {
+            "generation": 0,
+            "player_names": set(),
+            "noble_names": set(),
+        }
+        call_after_commit(lambda: _publish_changes(party_id=party_id))
+        call_after_rollback(lambda: changes.pop(party_id, None))
+    change = changes[party_id]
+    change["generation"] = max(change["generation"], generation)
+    change["player_names"].update(player_names)
+    change["noble_names"].update(noble_names)
+
+
+def _publish_changes(party_id):
+    """Read the players that changed in a party and send them to its viewers."""
+    change = g.get("live_changes", {}).pop(party_id, None)
+    channel = get_broker().channels.get(party_id)
+    if change is None or channel is None:
+        return
+
+    # reading and sending together keeps the events in the order of the reads
+    with channel.lock:
+        players = _read_players(
+            party_id=party_id,
+            player_names=change["player_names"],
+            noble_names=change["noble_names"],
+        )
+        for player in players:
+            channel.players[player["player_name"]] = player
+        channel.generation = max(channel.generation, change["generation"])
+        channel.publish(
+            format_event(
+                "players", {"generation": channel.generation, "players": players}
+            )
+        )
+
+
+def catch_up(channel):
+    """Send a new snapshot if another worker changed the party.
+
+    Only one viewer of the party checks, once every LIVE_HEARTBEAT_SECONDS.
+    """
+    interval = current_app.config["LIVE_HEARTBEAT_SECONDS"]
+    if not channel.lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() - channel.checked_at < interval:
+            return
+        channel.checked_at = time.monotonic()
+        # the asgi server checks outside of the viewer's request
+        with use_database(channel.party_id):
+            generation = get_party_generation(party_id=channel.party_id)
+            if generation == channel.generation:
+                return
+            players = _read_players(party_id=channel.party_id)
+        channel.players = {p["player_name"]: p for p in players}
+        channel.generation = generation
+        channel.publish(channel.snapshot())
+    finally:
+        channel.lock.release()
+
+
+def snapshot(channel):
+    """Encode every player of a party, without racing a publish."""
+    with channel.lock:
+        return channel.snapshot()
+
+
+def open_stream(subscription):
+    """Add a viewer to the current party.
+
+    Args:
+        subscription (Subscription): Where the party's events are sent
+
+    Returns:
+        Tuple[Channel, bytes]: The party's channel and the first event for the
+            viewer, a snapshot of every player
+    """
+    party_id = session.get("party_id")
+    channel, subscription = get_broker().subscribe(
+        party_id=party_id,
+        load=lambda: _load_channel(party_id=party_id),
+        subscription=subscription,
+    )
+    return channel, snapshot(channel)
+
+
+def stream_party():
+    """Stream the changes to the players of the current party.
+
+    Yields:
+        bytes: A snapshot of every player, and then each change
+    """
+    subscription = Subscription(maxsize=current_app.config["LIVE_QUEUE_SIZE"])
+    channel, event = open_stream(subscription)
+    heartbeat = current_app.config["LIVE_HEARTBEAT_SECONDS"]
+    try:
+        yield event
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if subscription.lagged:
+                subscription.clear()
+                event = snapshot(channel)
+            if event is None:
+                catch_up(channel)
+                event = HEARTBEAT
+            yield event
+    finally:
+        get_broker().unsubscribe(channel, subscription)
+
+
+def init_app(app):
+    """Give the app a broker for its live streams."""
+    app.extensions["nobles_and_peasants.live"] = Broker()
@@ -0,0 +1,265 @@
+"""Count the SQL statements and time of each request, and export them at /metrics.
+
+Every statement that query.py runs is timed and added to the current
+request's stats: the number of statements, their total time, and the
+slowest one. When the request ends, its stats and latency are added to
+histograms by route, and a line like this one is logged at INFO level by
+the app's logger:
+
+    POST /buy_drink 302 4.1ms queries=9 sql=1.8ms slowest=0.4ms "update players ..."
+
+GET /metrics serves the histograms, along with the password hashing stats
+from passwords.py, in the Prometheus text format. Routes are labelled by
+their url rule, like /api/v1/<action>, so the number of series stays small.
+Streaming responses, like /live, are timed until their headers are sent.
+
+Slow and repeated statements are logged too. See slow_queries.py.
+
+Set METRICS_ENABLED to False to turn all of this off.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, current_app, g, request
+
+from nobles_and_peasants import slow_queries
+from nobles_and_peasants.passwords import get_hash_stats
+
+# upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+PREFIX = "nobles_and_peasants"
+
+
+class Histogram:
+    """Count observations in cumulative buckets, the way Prometheus does."""
+
+    def __init__(self, buckets):
+        """Initialize an empty histogram with the upper bound of each bucket."""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add an observation."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Build the sample lines of the histogram."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """The request metrics of an app, shared by its worker threads."""
+
+    def __init__(self):
+        """Initialize empty metrics."""
+        self.lock = threading.Lock()
+        self.responses = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERIES_BUCKETS))
+        self.sql_seconds = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.slowest_query = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+
+    def record_request(self, route, method, status, seconds, stats):
+        """Add a finished request to the metrics."""
+        with self.lock:
+            self.responses[(route, method, status)] += 1
+            self.latency[(route, method)].observe(seconds)
+            self.queries[(route, method)].observe(stats.count)
+            self.sql_seconds[(route, method)].observe(stats.seconds)
+            self.slowest_query[(route, method)].observe(stats.slowest_seconds)
+
+    def render(self):
+        """Build the metrics in the Prometheus text format."""
+        with self.lock:
+            lines = [
+                f"# HELP {PREFIX}_responses_total Responses by route and status.",
+                f"# TYPE {PREFIX}_responses_total counter",
+            ]
+            for (route, method, status), count in sorted(self.responses.items()):
+                labels = f'route="{route}",method="{method}",status="{status}"'
+                lines.append(f"{PREFIX}_responses_total{{{labels}}} {count}")
+
+            histograms = [
+                ("request_duration_seconds", "Request latency.", self.latency),
+                ("request_queries", "SQL statements per request.", self.queries),
+                ("request_sql_seconds", "SQL time per request.", self.sql_seconds),
+                (
+                    "request_slowest_query_seconds",
+                    "The slowest SQL statement of each request.",
+                    self.slowest_query,
+                ),
+            ]
+            for name, help_text, by_route in histograms:
+                lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                for (route, method), histogram in sorted(by_route.items()):
+                    labels = f'route="{route}",method="{method}"'
+                    lines.extend(histogram.samples(f"{PREFIX}_{name}", labels))
+        return lines
+
+
+class QueryStats:
+    """The SQL statements of a single request."""
+
+    def __init__(self):
+        """Initialize stats with no statements."""
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_query = None
+        self.queries = defaultdict(int)
+
+    def record(self, query, seconds):
+        """Add a statement."""
+        self.count += 1
+        self.queries[query] += 1
+        self.seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_query = query
+
+
+def record_query(query, args, seconds):
+    """Add a statement to the stats of the current request, and log it if it was slow.
+
+    Args:
+        query (str): The SQL of the statement
+        args (list or dict): The parameters of the statement, or None if
+            they aren't known
+        seconds (float): How long the statement took, including fetching its rows
+    """
+    stats = g.get("query_stats")
+    if stats is not None:
+        stats.record(query, seconds)
+        slow_queries.check_query(query, args, seconds)
+
+
+def get_query_stats():
+    """Get the SQL stats of the current request, or None outside of a request."""
+    return g.get("query_stats")
+
+
+def _start_request():
+    """Start timing a request and counting its statements."""
+    g.request_start = time.perf_counter()
+    g.query_stats = QueryStats()
+
+
+def _finish_request(response):
+    """Add the request to the app's metrics, and log its stats."""
+    stats = g.pop("query_stats", None)
+    if stats is None:
+        return response
+    seconds = time.perf_counter() - g.pop("request_start")
+
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics = current_app.extensions["nobles_and_peasants.metrics"]
+    metrics.record_request(
+        route=route,
+        method=request.method,
+        status=response.status_code,
+        seconds=seconds,
+        stats=stats,
+    )
+    slow_queries.check_repeats(
+        method=request.method, route=route, queries=stats.queries
+    )
+
+    slowest = ""
+    if stats.slowest_query is not None:
+        slowest = " ".join(stats.slowest_query.split())[:80]
+    current_app.logger.info(
+        '%s %s %s %.1fms queries=%d sql=%.1fms slowest=%.1fms "%s"',
+        request.method,
+        request.path,
+        response.status_code,
+        seconds * 1000,
+        stats.count,
+        stats.seconds * 1000,
+        stats.slowest_seconds * 1000,
+        slowest,
+    )
+    return response
+
+
+def _render_hash_stats():
+    """Build the password hashing metrics in the Prometheus text format."""
+    stats = get_hash_stats()
+    if stats is None:
+        return []
+    metrics = [
+        ("password_hashes_total", "counter", "Passwords hashed.", stats.count),
+        (
+            "password_hashes_rejected_total",
+            "counter",
+            "Hashes turned away because the queue was full.",
+            stats.rejected,
+        ),
+        (
+            "password_hash_wait_seconds_total",
+            "counter",
+            "Time hashes waited for a worker process.",
+            stats.wait_seconds_total,
+        ),
+        (
+            "password_hash_wait_seconds_max",
+            "gauge",
+            "The longest that a hash waited for a worker process.",
+            stats.wait_seconds_max,
+        ),
+        (
+            "password_hash_seconds_total",
+            "counter",
+            "Time spent hashing in worker processes.",
+            stats.hash_seconds_total,
+        ),
+    ]
+    lines = []
+    for name, kind, help_text, value in metrics:
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        lines.append(f"{PREFIX}_{name} {value}")
+    return lines
+
+
+def show_metrics():
+    """Serve the metrics in the Prometheus text format."""
+    metrics = current_app.extensions["nobles_and_peasants.metrics"]
+    lines = (
+        metrics.render()
+        + current_app.extensions["nobles_and_peasants.slow_queries"].render()
+        + _render_hash_stats()
+    )
+    return Response(
+        "\n".join(lines) + "\n",
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def init_app(app):
+    """Time the app's requests and add the /metrics route."""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    app.extensions["nobles_and_peasants.metrics"] = Metrics()
+    slow_queries.init_app(app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/metrics", view_func=show_metrics)
@@ -0,0 +1,18 @@
+-- a player name identifies a player within a party
+create unique index if not exists players_party_id_player_name
+    on players (party_id, player_name);
+
+-- nobles look up their army when a new noble takes over
+create index if not exists players_party_id_noble_name
+    on players (party_id, noble_name);
+
+-- a noble can only ban a peasant once, so remove any duplicate bans first
+delete from outlaws
+where id not in (
+    select min(id)
+    from outlaws
+    group by party_id, noble_id, peasant_id
+);
+
+create unique index if not exists outlaws_party_id_noble_id_peasant_id
+    on outlaws (party_id, noble_id, peasant_id);
@@ -0,0 +1,14 @@
+create unique index if not exists drinks_party_id_drink_name
+    on drinks (party_id, drink_name);
+
+create unique index if not exists starting_coin_party_id_player_status
+    on starting_coin (party_id, player_status);
+
+create unique index if not exists quest_rewards_party_id_difficulty
+    on quest_rewards (party_id, difficulty);
+
+create index if not exists quests_party_id_difficulty
+    on quests (party_id, difficulty);
+
+create index if not exists challenges_party_id
+    on challenges (party_id);
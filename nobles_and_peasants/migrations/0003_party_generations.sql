@@ -0,0 +1,6 @@
+-- every write to a party's players bumps its generation, so workers that
+-- keep the party in memory can tell when another worker changed it
+create table if not exists party_generations (
+    party_id integer primary key,
+    generation integer not null
+);
@@ -0,0 +1,7 @@
+-- keep nobles in leaderboard order, so the leaderboard is read without sorting
+create index if not exists players_leaderboard
+    on players (party_id, player_status, soldiers desc, coin desc, drinks desc, player_name);
+
+-- the almighty ruler is the first player in the whole party
+create index if not exists players_ruler
+    on players (party_id, soldiers desc, coin desc, drinks desc);
@@ -0,0 +1,3 @@
+-- keep peasants in order of wealth, so the next noble is found with one seek
+create index if not exists players_succession
+    on players (party_id, player_status, coin desc, drinks desc, player_name);
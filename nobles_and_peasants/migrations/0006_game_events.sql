@@ -0,0 +1,40 @@
+-- every change to the players of a party, in order. players is a projection
+-- of these events and can be rebuilt from them. See events.py.
+create table if not exists game_events (
+    id integer primary key autoincrement,
+    party_id integer not null,
+    created timestamp not null default current_timestamp,
+    action text,
+    data text not null
+);
+
+create index if not exists game_events_party on game_events (party_id, id);
+
+-- the players of a party as of an event, so a replay can start from here
+create table if not exists party_snapshots (
+    id integer primary key autoincrement,
+    party_id integer not null,
+    event_id integer not null,
+    created timestamp not null default current_timestamp,
+    players text not null
+);
+
+create index if not exists party_snapshots_party on party_snapshots (party_id, event_id);
+
+-- the players that existed before the log, as the starting point of a replay
+insert into party_snapshots (party_id, event_id, players)
+select
+    party_id
+    , 0
+    , json_group_array(json_object(
+        'id', id
+        , 'player_name', player_name
+        , 'player_status', player_status
+        , 'coin', coin
+        , 'noble_name', noble_name
+        , 'drinks', drinks
+        , 'soldiers', soldiers
+    ))
+from players
+where party_id not in (select party_id from party_snapshots)
+group by party_id;
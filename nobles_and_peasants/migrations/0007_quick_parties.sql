@@ -0,0 +1,4 @@
+-- parties whose shard is kept in memory, and dropped once idle. See db.py.
+create table if not exists quick_parties (
+    party_id integer primary key
+);
@@ -0,0 +1,4 @@
+-- break ties between rulers by name, like the leaderboard, without sorting
+drop index if exists players_ruler;
+create index players_ruler
+    on players (party_id, soldiers desc, coin desc, drinks desc, player_name);
@@ -1,27 +1,28 @@
 """Functions related to the outlaws table."""
 from flask import session
 
-from nobles_and_peasants.query import execute, fetch_all
+from nobles_and_peasants.parties import mark_party_changed
+from nobles_and_peasants.query import execute, fetch_one
 
 
 def is_peasant_banned(noble_id, peasant_id):
     """Check if a peasant is banned from a noble's army."""
     party_id = session.get("party_id")
     query = """
-        select peasant_id
+        select 1
         from outlaws
         where party_id = ?
             and noble_id = ?
+            and peasant_id = ?
     """
-    outlaws = fetch_all(query=query, args=[party_id, noble_id])
-    banned_peasants = [x["peasant_id"] for x in outlaws]
-    return peasant_id in banned_peasants
+    return fetch_one(query=query, args=[party_id, noble_id, peasant_id]) is not None
 
 
 def insert_new_outlaw(noble_id, peasant_id, commit=True):
     """Add a new row to the database for a noble to ban a peasant."""
     party_id = session.get("party_id")
     query = """
-        insert into outlaws (party_id, noble_id, peasant_id) values (?, ?, ?)
+        insert or ignore into outlaws (party_id, noble_id, peasant_id) values (?, ?, ?)
     """
-    execute(query=query, args=[party_id, noble_id, peasant_id], commit=commit)
+    execute(query=query, args=[party_id, noble_id, peasant_id], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
@@ -1,38 +1,103 @@
 """Functions related to the parties table."""
-import re
-
-from flask import current_app
-from werkzeug.security import generate_password_hash
-
-from nobles_and_peasants.db import get_db
-from nobles_and_peasants.query import execute, fetch_one, fetch_all
-
-
-def init_party(party_id):
+from flask import current_app, g
+
+from nobles_and_peasants import default_values
+from nobles_and_peasants.db import (
+    call_after_rollback,
+    call_before_commit,
+    create_shard,
+    in_transaction,
+    transaction,
+    use_database,
+)
+from nobles_and_peasants.db import commit as commit_db
+from nobles_and_peasants.passwords import hash_password
+from nobles_and_peasants.query import (
+    execute,
+    execute_many,
+    execute_returning,
+    fetch_one,
+    fetch_all,
+)
+
+
+def init_party(party_id, commit=True):
     """Add rows to tables in the schema with default content for this party."""
-    db = get_db()
-    with current_app.open_resource("default_values.sql") as f:
-        default_values = f.read().decode("utf8")
-        default_values = re.sub("~PARTY_ID~", str(party_id), default_values)
-        db.executescript(default_values)
-    db.commit()
-
-
-def insert_new_party(party_name, password):
-    """Add a row to the database for a new party."""
-    hashed_password = generate_password_hash(password)
-
-    query = "insert into parties (party_name, password) values (?, ?)"
-    execute(query=query, args=[party_name, hashed_password], commit=True)
-
-    party_id = get_party_id(party_name=party_name)
-    init_party(party_id=party_id)
+    inserts = [
+        (
+            "insert into drinks (party_id, drink_name, drink_cost) values (?, ?, ?)",
+            default_values.DRINKS,
+        ),
+        (
+            "insert into starting_coin (party_id, player_status, coin) values (?, ?, ?)",
+            default_values.STARTING_COIN,
+        ),
+        (
+            "insert into quest_rewards (party_id, difficulty, reward) values (?, ?, ?)",
+            default_values.QUEST_REWARDS,
+        ),
+        (
+            "insert into quests (party_id, quest, difficulty) values (?, ?, ?)",
+            default_values.QUESTS,
+        ),
+    ]
+    for query, rows in inserts:
+        args_list = [(party_id, *row) for row in rows]
+        execute_many(query=query, args_list=args_list, commit=False)
+
+    query = "insert into challenges (party_id, challenge) values (?, ?)"
+    args_list = [(party_id, challenge) for challenge in default_values.CHALLENGES]
+    execute_many(query=query, args_list=args_list, commit=commit)
+
+
+def insert_new_party(party_name, password, in_memory=False):
+    """Add a row to the database for a new party, along with its default content.
+
+    The password is hashed before the transaction starts, so the write lock
+    isn't held while hashing. Checking that the name is free and inserting
+    the party are a single statement, so two signups can't both take a name.
+    When parties are sharded, the party's database file is created before the
+    party is committed to the directory.
+
+    Args:
+        party_name (str): The name of the party
+        password (str): The password of the party
+        in_memory (bool): Make a quick party, whose database file is kept in
+            memory. Only used when parties are sharded.
+
+    Returns:
+        int: The id of the new party, or None if the party name is already taken
+
+    Raises:
+        HashingBusy: If too many passwords are already waiting to be hashed
+    """
+    hashed_password = hash_password(password)
+    in_memory = in_memory and current_app.config["DB_SHARDS_FOLDER"] is not None
+
+    with use_database(), transaction():
+        query = """
+            insert into parties (party_name, password) values (?, ?)
+            on conflict (party_name) do nothing
+            returning id
+        """
+        party_id = execute_returning(
+            query=query, args=[party_name, hashed_password], commit=False
+        )
+        if party_id is not None and in_memory:
+            query = "insert into quick_parties (party_id) values (?)"
+            execute(query=query, args=[party_id], commit=False)
+        if party_id is not None:
+            create_shard(party_id=party_id, in_memory=in_memory)
+            with use_database(party_id), transaction():
+                init_party(party_id=party_id, commit=False)
+    return party_id
 
 
 def get_party(party_name):
     """Get info for a party."""
     query = "select id, party_name, password from parties where party_name = ?"
-    party = fetch_all(query=query, args=[party_name])
+    with use_database():
+        party = fetch_all(query=query, args=[party_name])
     if len(party) == 0:
         return None
     else:
@@ -42,7 +107,8 @@ def get_party(party_name):
 def get_party_id(party_name):
     """Get the id given the party name."""
     query = "select id from parties where party_name = ?"
-    return fetch_one(query=query, args=[party_name])
+    with use_database():
+        return fetch_one(query=query, args=[party_name])
 
 
 def get_party_name(db, party_id):
@@ -51,15 +117,67 @@ def get_party_name(db, party_id):
     return fetch_one(db, query, [party_id])
 
 
+def get_party_generation(party_id):
+    """Get the number of writes that have been made to a party.
+
+    Every commit that writes to a party's players, outlaws or settings bumps
+    the generation, so pages that show the party can be cached until it changes.
+    """
+    query = "select generation from party_generations where party_id = ?"
+    generation = fetch_one(query=query, args=[party_id])
+    return 0 if generation is None else generation
+
+
+def bump_party_generation(party_id, commit=True):
+    """Record that a party changed, and return the new generation."""
+    query = """
+        insert into party_generations (party_id, generation) values (?, 1)
+        on conflict (party_id) do update set generation = generation + 1
+        returning generation
+    """
+    return execute_returning(query=query, args=[party_id], commit=commit)
+
+
+def mark_party_changed(party_id, on_bump=None, commit=True):
+    """Bump the generation of a party once, when the current writes are committed.
+
+    However many writes a commit makes to a party, its generation is bumped
+    by a single statement just before the commit.
+
+    Args:
+        party_id (int): The id of the party
+        on_bump (Callable[[int], None]): Called with the new generation
+            once it is bumped
+        commit (bool): Whether to commit the writes now
+    """
+    changed = g.setdefault("changed_parties", {})
+    if party_id not in changed:
+        changed[party_id] = []
+        call_before_commit(lambda: _bump_changed_party(party_id=party_id))
+        call_after_rollback(lambda: g.pop("changed_parties", None))
+    if on_bump is not None:
+        changed[party_id].append(on_bump)
+    if commit and not in_transaction():
+        commit_db()
+
+
+def _bump_changed_party(party_id):
+    """Bump the generation of a party that the commit changed."""
+    callbacks = g.get("changed_parties", {}).pop(party_id, [])
+    generation = bump_party_generation(party_id=party_id, commit=False)
+    for callback in callbacks:
+        callback(generation)
+
+
 def does_party_id_exist(party_id):
     """Check if a party_id already exists in the database."""
-    query = "select id from parties"
-    parties = fetch_all(query=query, args=[])
-    return int(party_id) in [row["id"] for row in parties]
+    query = "select 1 from parties where id = ?"
+    with use_database():
+        return fetch_one(query=query, args=[int(party_id)]) is not None
 
 
 def does_party_name_exist(party_name):
     """Check if a party_name already exists in the database."""
-    query = "select party_name from parties"
-    parties = fetch_all(query=query, args=[])
-    return party_name in [row["party_name"] for row in parties]
+    query = "select 1 from parties where party_name = ?"
+    with use_database():
+        return fetch_one(query=query, args=[party_name]) is not None
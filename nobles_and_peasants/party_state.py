@@ -0,0 +1,440 @@
+"""Keep the players of active parties in memory.
+
+When PARTY_STATE_ENABLED is set, each worker keeps a PartyState for the
+parties it served recently. Reads of the players table are answered from
+memory, and every write in players.py is made to sqlite and then applied to
+the PartyState. Parties that sit idle for PARTY_STATE_IDLE_SECONDS, or that
+fall out of the PARTY_STATE_CACHE_SIZE most recently used, are dropped.
+
+Workers stay consistent through the party's generation. Every commit that
+writes to the party bumps the generation in the database, and a worker
+reloads a party when the generation in the database doesn't match the one
+it has in memory.
+
+The PartyState in the cache is shared by every thread of the worker, and
+is never changed in place. A request that writes makes a copy of it, sees
+its own writes in the copy, and swaps the copy into the cache once the
+writes are committed. Other requests only ever see committed players, and
+a rollback just throws the copy away. Copying costs a copy of the players
+dict and of each ranking's list, and each player is only copied once the
+request changes them.
+"""
+import bisect
+import threading
+
+from flask import current_app, g, session
+
+from nobles_and_peasants import events, live
+from nobles_and_peasants.cache import get_cache
+from nobles_and_peasants.constants import NOBLE, PEASANT
+from nobles_and_peasants.db import (
+    call_after_commit,
+    call_after_rollback,
+    in_transaction,
+)
+from nobles_and_peasants.db import commit as commit_db
+from nobles_and_peasants.parties import get_party_generation, mark_party_changed
+from nobles_and_peasants.query import fetch_all
+
+
+class Player:
+    """A single row of the players table.
+
+    Columns can be read as attributes or with square brackets, just like a
+    sqlite3.Row.
+    """
+
+    __slots__ = (
+        "id",
+        "player_name",
+        "player_status",
+        "coin",
+        "noble_name",
+        "drinks",
+        "soldiers",
+    )
+
+    def __init__(
+        self, id, player_name, player_status, coin, noble_name, drinks, soldiers
+    ):
+        """Initialize a player from the values of each column."""
+        self.id = id
+        self.player_name = player_name
+        self.player_status = player_status
+        self.coin = coin
+        self.noble_name = noble_name
+        self.drinks = drinks
+        self.soldiers = soldiers
+
+    def __getitem__(self, col):
+        """Get the value of a column."""
+        return getattr(self, col)
+
+    def copy(self):
+        """Get a copy of the player that can be changed on its own."""
+        return Player(*(getattr(self, col) for col in self.__slots__))
+
+    def keys(self):
+        """Get the names of the columns."""
+        return list(self.__slots__)
+
+
+def leaderboard_key(player):
+    """Order nobles by soldiers, then coin, then drinks, with ties broken by name."""
+    return (-player.soldiers, -player.coin, -player.drinks, player.player_name)
+
+
+def succession_key(player):
+    """Order peasants by coin, then drinks, with ties broken by name."""
+    return (-player.coin, -player.drinks, player.player_name)
+
+
+class Ranking:
+    """Players kept sorted as their counts change.
+
+    Finding a player's place is a binary search, so the ranking never has to
+    be sorted from scratch. Moving a player is still O(n), since the keys
+    after their place shift along the list, but the shift is a single
+    memmove of pointers: a move takes about 2 microseconds with 100 players,
+    4 with 1,000 and 7 with 10,000, far below the cost of the write that
+    causes it. A tree would only pay off for parties much larger than that.
+
+    Args:
+        players (Iterable[Player]): The players to rank
+        key (Callable[[Player], tuple]): Get the key that sorts a player into
+            place. The player's name must be the last item.
+    """
+
+    def __init__(self, players, key):
+        """Rank the given players."""
+        self.key = key
+        self._keys = sorted(key(p) for p in players)
+
+    def add(self, player):
+        """Add a player in their place in the ranking."""
+        bisect.insort(self._keys, self.key(player))
+
+    def remove(self, player):
+        """Remove a player from the ranking."""
+        key = self.key(player)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def top(self, limit=None):
+        """Get the names of the players at the top of the ranking."""
+        return [key[-1] for key in self._keys[:limit]]
+
+    def copy(self):
+        """Get a copy of the ranking that can be changed on its own."""
+        ranking = Ranking((), key=self.key)
+        ranking._keys = list(self._keys)
+        return ranking
+
+
+class PartyState:
+    """The players of a single party, keyed by player name."""
+
+    def __init__(self, party_id, generation, players):
+        """Initialize the state of a party.
+
+        Args:
+            party_id (int): The id of the party
+            generation (int): The generation of the party that the players reflect
+            players (List[Player]): Every player in the party
+        """
+        self.party_id = party_id
+        self.generation = generation
+        self.players = {p.player_name: p for p in players}
+        # the copy of a shared state only owns the players it copied
+        self.origin = None
+        self.owned = None
+        self.rankings = {
+            NOBLE: Ranking(
+                (p for p in players if p.player_status == NOBLE), key=leaderboard_key
+            ),
+            PEASANT: Ranking(
+                (p for p in players if p.player_status == PEASANT), key=succession_key
+            ),
+        }
+
+    @property
+    def nobles(self):
+        """Get the nobles in leaderboard order."""
+        return self.rankings[NOBLE]
+
+    @property
+    def peasants(self):
+        """Get the peasants in the order that they become nobles."""
+        return self.rankings[PEASANT]
+
+    def copy(self):
+        """Get a copy of the state to write to, while readers keep using this one."""
+        state = PartyState(
+            party_id=self.party_id, generation=self.generation, players=()
+        )
+        state.players = dict(self.players)
+        state.rankings = {status: r.copy() for status, r in self.rankings.items()}
+        state.origin = self
+        state.owned = set()
+        return state
+
+    def add(self, player):
+        """Add a new player to the party."""
+        # build a new dict so that readers iterating over players are unaffected
+        self.players = {**self.players, player.player_name: player}
+        if self.owned is not None:
+            self.owned.add(player.player_name)
+        if player.player_status in self.rankings:
+            self.rankings[player.player_status].add(player)
+
+    def update(self, player, **values):
+        """Set columns for a player and move them in the rankings."""
+        if self.owned is not None and player.player_name not in self.owned:
+            # the player is still shared with the state that was copied
+            player = player.copy()
+            self.players[player.player_name] = player
+            self.owned.add(player.player_name)
+        if player.player_status in self.rankings:
+            self.rankings[player.player_status].remove(player)
+        for col, value in values.items():
+            setattr(player, col, value)
+        if player.player_status in self.rankings:
+            self.rankings[player.player_status].add(player)
+
+
+# swaps a request's copy of a state into the cache
+_publish_lock = threading.Lock()
+
+
+def _get_cache():
+    """Get the cache of party states for this worker."""
+    return get_cache(
+        "party_state",
+        maxsize=current_app.config["PARTY_STATE_CACHE_SIZE"],
+        ttl=current_app.config["PARTY_STATE_IDLE_SECONDS"],
+        sliding=True,
+    )
+
+
+def _load_party_state(party_id):
+    """Read every player of a party from the database."""
+    generation = get_party_generation(party_id=party_id)
+    query = """
+        select id, player_name, player_status, coin, noble_name, drinks, soldiers
+        from players
+        where party_id = ?
+    """
+    rows = fetch_all(query=query, args=[party_id])
+    return PartyState(
+        party_id=party_id,
+        generation=generation,
+        players=[Player(*row) for row in rows],
+    )
+
+
+def get_party_state():
+    """Get the players of the current party from memory.
+
+    The party is checked against the database once per request, and loaded
+    again if another worker changed it.
+
+    Returns:
+        PartyState: The state of the party, or None if PARTY_STATE_ENABLED is off
+    """
+    if not current_app.config["PARTY_STATE_ENABLED"]:
+        return None
+    if "party_state" in g:
+        return g.party_state
+
+    party_id = session.get("party_id")
+    cache = _get_cache()
+    state = cache.get(party_id)
+    if state is None or state.generation != get_party_generation(party_id=party_id):
+        state = _load_party_state(party_id=party_id)
+        if party_id in g.get("party_state_writes", {}):
+            # read after this request's uncommitted writes, so it is only
+            # shared once they commit. See _finish_writes.
+            state.owned = set(state.players)
+            call_after_rollback(lambda: g.pop("party_state", None))
+        else:
+            cache.set(party_id, state)
+    g.party_state = state
+    return state
+
+
+def discard_party_state(party_id):
+    """Forget a party's state, so that it is loaded again on the next read."""
+    _get_cache().discard(party_id)
+    g.pop("party_state", None)
+
+
+def _publish(state):
+    """Share a state that has this request's committed writes with the other threads.
+
+    If another request swapped in a state since this one was copied, that
+    state has writes that this one doesn't, so both are dropped and the
+    party is loaded again on the next read.
+    """
+    cache = _get_cache()
+    with _publish_lock:
+        current = cache.get(state.party_id)
+        if state.origin is None or current is state.origin:
+            state.origin = None
+            state.owned = None
+            cache.set(state.party_id, state)
+        else:
+            cache.discard(state.party_id)
+
+
+def apply_change(state, change):
+    """Make a change to the players of a party in memory.
+
+    Args:
+        state (PartyState): The players of the party
+        change (dict): A change made by one of the write functions below
+    """
+    op = change["op"]
+    if op == "add":
+        state.add(Player(**change["player"]))
+        return
+    if op == "change_allegiances":
+        army = [
+            p
+            for p in state.players.values()
+            if p.noble_name == change["old_noble_name"]
+        ]
+        for player in army:
+            state.update(player, noble_name=change["new_noble_name"])
+        return
+
+    player = state.players.get(change["player_name"])
+    if player is None:
+        return
+    if op == "update":
+        state.update(player, **change["values"])
+    elif op == "increment":
+        values = {col: player[col] + delta for col, delta in change["deltas"].items()}
+        state.update(player, **values)
+    elif op == "promote":
+        army = [
+            p
+            for p in state.players.values()
+            if p.noble_name == player.player_name and p is not player
+        ]
+        state.update(
+            player,
+            player_status=NOBLE,
+            noble_name=player.player_name,
+            coin=max(change["starting_coin"], player.coin + change["starting_coin"]),
+            soldiers=1 + len(army),
+        )
+
+
+def _write_through(change, commit):
+    """Record a write that was made to the players table and apply it in memory.
+
+    The write is also recorded for the party's live viewers and in the game
+    event log. See live.py and events.py. The party's generation is bumped
+    once per commit, however many writes it makes, and the live viewers and
+    the state in memory get the new generation then.
+
+    Args:
+        change (dict): The write, in the form that apply_change takes
+        commit (bool): Whether the write was committed
+    """
+    party_id = session.get("party_id")
+    writes = g.setdefault("party_state_writes", {})
+    if party_id not in writes:
+        writes[party_id] = {"player_names": set(), "noble_names": set()}
+        mark_party_changed(
+            party_id=party_id,
+            on_bump=lambda generation: _finish_writes(party_id, generation),
+            commit=False,
+        )
+        call_after_rollback(lambda: g.pop("party_state_writes", None))
+    if change["op"] == "change_allegiances":
+        writes[party_id]["noble_names"].add(change["new_noble_name"])
+    elif change["op"] == "add":
+        writes[party_id]["player_names"].add(change["player"]["player_name"])
+    else:
+        writes[party_id]["player_names"].add(change["player_name"])
+
+    events.record_change(party_id=party_id, change=change)
+    if current_app.config["PARTY_STATE_ENABLED"]:
+        _apply_to_state(party_id=party_id, change=change)
+    if commit and not in_transaction():
+        commit_db()
+
+
+def _apply_to_state(party_id, change):
+    """Apply a write to this request's copy of the party's state.
+
+    The first write copies the state that this request checked against the
+    database. A state that it didn't check may have missed writes from
+    another worker, so it is dropped instead.
+    """
+    state = g.get("party_state")
+    if state is None or state.party_id != party_id:
+        _get_cache().discard(party_id)
+        return
+    if state.owned is None:
+        state = g.party_state = state.copy()
+        # the shared state never saw the write, so only the copy is dropped
+        call_after_rollback(lambda: g.pop("party_state", None))
+    apply_change(state, change)
+
+
+def _finish_writes(party_id, generation):
+    """Give the party's state and live viewers the generation of the commit."""
+    writes = g.get("party_state_writes", {}).pop(party_id)
+    live.record_change(party_id=party_id, generation=generation, **writes)
+    if not current_app.config["PARTY_STATE_ENABLED"]:
+        return
+    state = g.get("party_state")
+    if state is None or state.party_id != party_id:
+        return
+    if state.generation == generation - 1:
+        state.generation = generation
+        call_after_commit(lambda: _publish(state))
+    else:
+        # another worker committed a write after the state was checked
+        discard_party_state(party_id=party_id)
+
+
+def add_player(player, commit=True):
+    """Add a player that was inserted into the database."""
+    row = {col: player[col] for col in player.keys()}
+    _write_through({"op": "add", "player": row}, commit=commit)
+
+
+def update_player(player_name, commit=True, **values):
+    """Set columns for a player that were updated in the database."""
+    change = {"op": "update", "player_name": player_name, "values": values}
+    _write_through(change, commit=commit)
+
+
+def increment_player(player_name, commit=True, **deltas):
+    """Add to columns for a player that were incremented in the database."""
+    change = {"op": "increment", "player_name": player_name, "deltas": deltas}
+    _write_through(change, commit=commit)
+
+
+def change_allegiances(old_noble_name, new_noble_name, commit=True):
+    """Move every player allied to one noble to another noble."""
+    change = {
+        "op": "change_allegiances",
+        "old_noble_name": old_noble_name,
+        "new_noble_name": new_noble_name,
+    }
+    _write_through(change, commit=commit)
+
+
+def promote_to_noble(player_name, starting_coin, commit=True):
+    """Make a player a noble, in the same way as players.change_peasant_to_noble."""
+    change = {
+        "op": "promote",
+        "player_name": player_name,
+        "starting_coin": starting_coin,
+    }
+    _write_through(change, commit=commit)
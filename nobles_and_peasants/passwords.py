@@ -0,0 +1,138 @@
+"""Hash and check party passwords in a pool of worker processes.
+
+Password hashes are slow on purpose. When a whole venue logs in at once,
+hashing on the request thread would take over every worker and game actions
+would queue behind the logins. Instead, hashes run in a process pool with
+PASSWORD_HASH_WORKERS processes, so they use every core and don't hold the
+GIL. At most PASSWORD_HASH_QUEUE_SIZE hashes can be waiting for a process.
+Past that, new logins are turned away with HashingBusy instead of piling up.
+
+Setting PASSWORD_HASH_WORKERS to 0 hashes on the request thread instead.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when too many passwords are already waiting to be hashed."""
+
+
+class HashStats:
+    """Track how long hashes wait for a worker process, in seconds."""
+
+    def __init__(self):
+        """Initialize empty stats."""
+        self.count = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait_seconds, hash_seconds):
+        """Record a finished hash."""
+        with self._lock:
+            self.count += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self.hash_seconds_total += hash_seconds
+
+    def record_rejected(self):
+        """Record a hash that was turned away because the queue was full."""
+        with self._lock:
+            self.rejected += 1
+
+
+class _Hasher:
+    """The process pool and admission limit of an app."""
+
+    def __init__(self, num_workers, queue_size):
+        """Create the pool, with room for queue_size hashes beyond the workers."""
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.admission = threading.BoundedSemaphore(num_workers + queue_size)
+        self.stats = HashStats()
+
+
+def _timed(func, *args, **kwargs):
+    """Call a function in a worker process and return its result and duration."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+_hashers_lock = threading.Lock()
+
+
+def _get_hasher():
+    """Get the app's hasher, creating the process pool the first time."""
+    extensions = current_app.extensions
+    with _hashers_lock:
+        if "nobles_and_peasants.passwords" not in extensions:
+            num_workers = current_app.config["PASSWORD_HASH_WORKERS"]
+            if num_workers is None:
+                num_workers = os.cpu_count() or 1
+            extensions["nobles_and_peasants.passwords"] = _Hasher(
+                num_workers=num_workers,
+                queue_size=current_app.config["PASSWORD_HASH_QUEUE_SIZE"],
+            )
+    return extensions["nobles_and_peasants.passwords"]
+
+
+def _run(func, *args, **kwargs):
+    """Run a hashing function in the pool, or inline if the pool is turned off."""
+    if current_app.config["PASSWORD_HASH_WORKERS"] == 0:
+        return func(*args, **kwargs)
+
+    hasher = _get_hasher()
+    if not hasher.admission.acquire(blocking=False):
+        hasher.stats.record_rejected()
+        raise HashingBusy()
+    try:
+        start = time.perf_counter()
+        future = hasher.executor.submit(_timed, func, *args, **kwargs)
+        result, hash_seconds = future.result()
+        total_seconds = time.perf_counter() - start
+        hasher.stats.record(
+            wait_seconds=max(0.0, total_seconds - hash_seconds),
+            hash_seconds=hash_seconds,
+        )
+        return result
+    finally:
+        hasher.admission.release()
+
+
+def hash_password(password):
+    """Hash a password with the method and work factor in PASSWORD_HASH_METHOD."""
+    return _run(
+        generate_password_hash,
+        password,
+        method=current_app.config["PASSWORD_HASH_METHOD"],
+    )
+
+
+def check_password(pwhash, password):
+    """Check a password against its hash."""
+    return _run(check_password_hash, pwhash=pwhash, password=password)
+
+
+def get_hash_stats():
+    """Get the hash stats of the app, or None if no hash has used the pool."""
+    hasher = current_app.extensions.get("nobles_and_peasants.passwords")
+    return None if hasher is None else hasher.stats
+
+
+def shutdown_hasher():
+    """Stop the app's worker processes, if they were started."""
+    with _hashers_lock:
+        hasher = current_app.extensions.pop("nobles_and_peasants.passwords", None)
+    if hasher is not None:
+        hasher.executor.shutdown()
@@ -1,12 +1,27 @@
 """Functions related to the players table."""
 from random import uniform
 
-from flask import session
+from flask import g, session
 
+from nobles_and_peasants import party_state
 from nobles_and_peasants.constants import NOBLE, PEASANT
-from nobles_and_peasants.query import fetch_one, fetch_all, execute
+from nobles_and_peasants.party_state import Player, get_party_state, leaderboard_key
+from nobles_and_peasants.query import (
+    execute,
+    execute_returning,
+    fetch_all,
+    fetch_one,
+)
 from nobles_and_peasants.starting_coin import get_starting_coin_for_status
 
+# times a conditional coin update is tried before giving up, when other
+# requests keep changing the coin that it read
+COIN_UPDATE_ATTEMPTS = 3
+
+
+class CoinConflictError(Exception):
+    """Raised when a coin update kept losing to other requests."""
+
 
 def randomly_choose_player_status(players):
     """Randomly choose a player's status based on the status of other players.
@@ -32,6 +47,7 @@ def insert_new_player(player_name, player_status, commit=True):
     """Add a new row to the database for a new player."""
     party_id = session.get("party_id")
     starting_coin = get_starting_coin_for_status(player_status=player_status)
+    _remember_players([player_name])
 
     if player_status == PEASANT:
         noble_name = None
@@ -53,11 +69,85 @@ def insert_new_player(player_name, player_status, commit=True):
         0,
         soldiers,
     ]
-    execute(query=query, args=args, commit=commit)
+    player_id = execute(query=query, args=args, commit=False)
+    party_state.add_player(Player(player_id, *args[1:]), commit=commit)
+
+
+def track_player_changes():
+    """Start remembering each player as they were before the request first changes them.
+
+    The JSON API uses this to answer with the players that its actions
+    changed, by reading only those players. See get_player_changes.
+    """
+    g.players_before = {}
+
+
+def _read_players(player_names=(), noble_name=None):
+    """Read the players with the given names, and the players allied to a noble."""
+    state = get_party_state()
+    if state is not None:
+        return [
+            p
+            for p in state.players.values()
+            if p.player_name in player_names
+            or (noble_name is not None and p.noble_name == noble_name)
+        ]
+
+    party_id = session.get("party_id")
+    placeholders = ", ".join("?" * len(player_names))
+    query = f"""
+        select id, player_name, player_status, coin, noble_name, drinks, soldiers
+        from players
+        where party_id = ?
+            and (player_name in ({placeholders}) or noble_name = ?)
+    """
+    return fetch_all(query=query, args=[party_id, *player_names, noble_name])
+
+
+def _remember_players(player_names=(), noble_name=None):
+    """Remember players as they are before a write, if the request tracks changes.
+
+    Args:
+        player_names (Iterable[str]): The players that the write changes
+        noble_name (str): The noble whose whole army the write changes
+    """
+    before = g.get("players_before")
+    if before is None:
+        return
+    names = [name for name in player_names if name not in before]
+    if not names and noble_name is None:
+        return
+
+    # copies, since the players in memory change in place
+    rows = {
+        row["player_name"]: {col: row[col] for col in row.keys()}
+        for row in _read_players(names, noble_name)
+    }
+    for name in names:
+        # players that don't exist yet are remembered as None
+        before[name] = rows.pop(name, None)
+    for name, row in rows.items():
+        before.setdefault(name, row)
+
+
+def get_player_changes():
+    """Get the players that were changed since track_player_changes.
+
+    Returns:
+        Dict[str, tuple]: Each changed player as they were before the first
+            change and as they are now, by name. Either may be None.
+    """
+    before = g.get("players_before", {})
+    after = {row["player_name"]: row for row in _read_players(list(before))}
+    return {name: (row, after.get(name)) for name, row in before.items()}
 
 
 def get_all_players():
     """Get information for all players in a party."""
+    state = get_party_state()
+    if state is not None:
+        return sorted(state.players.values(), key=lambda p: p.player_name)
+
     party_id = session.get("party_id")
     query = """
         select
@@ -75,27 +165,49 @@ def get_all_players():
     return fetch_all(query=query, args=[party_id])
 
 
-def get_all_nobles():
-    """Get information for all nobles in a party."""
+def get_all_nobles(limit=None):
+    """Get information for all nobles in a party, in leaderboard order.
+
+    The order is kept up to date as players change, by the players_leaderboard
+    index or by the party's ranking in memory, so nothing is sorted here.
+
+    Args:
+        limit (int): Only get this many nobles from the top of the leaderboard
+    """
+    state = get_party_state()
+    if state is not None:
+        return [state.players[name] for name in state.nobles.top(limit=limit)]
+
     party_id = session.get("party_id")
     query = """
         select id, player_name, soldiers, coin, drinks
         from players
         where party_id = ?
             and player_status = 'noble'
-        order by soldiers desc, coin desc, drinks desc
+        order by soldiers desc, coin desc, drinks desc, player_name
+        limit ?
     """
-    return fetch_all(query=query, args=[party_id])
+    return fetch_all(query=query, args=[party_id, -1 if limit is None else limit])
 
 
 def get_almighty_ruler():
     """Find the noble with the most soldiers in their army."""
+    state = get_party_state()
+    if state is not None:
+        top_nobles = state.nobles.top(limit=1)
+        if top_nobles:
+            return top_nobles[0]
+        if not state.players:
+            return None
+        # without nobles, every player has zero soldiers
+        return min(state.players.values(), key=leaderboard_key).player_name
+
     party_id = session.get("party_id")
     query = """
         select player_name
         from players
         where party_id = ?
-        order by soldiers desc, coin desc, drinks desc
+        order by soldiers desc, coin desc, drinks desc, player_name
         limit 1
     """
     return fetch_one(query=query, args=[party_id])
@@ -103,6 +215,13 @@ def get_almighty_ruler():
 
 def get_single_player(player_name, col=None):
     """Get information for all players in a party."""
+    state = get_party_state()
+    if state is not None:
+        player = state.players.get(player_name)
+        if player is None or col is None:
+            return player
+        return player[col]
+
     party_id = session.get("party_id")
     if col is None:
         query = """
@@ -127,14 +246,28 @@ def get_single_player(player_name, col=None):
 
 
 def find_richest_peasant():
-    """Find the peasant name with the most coin."""
+    """Find the peasant that is next in line to become a noble.
+
+    The players_succession index, or the party's ranking in memory, keeps
+    peasants in order of wealth, so this is a single seek. It is looked up
+    again for every succession, since any write in between, like a drink
+    that breaks a tie, can change who is next.
+
+    Returns:
+        str: The name of the richest peasant, or None if there are none
+    """
+    state = get_party_state()
+    if state is not None:
+        peasant_names = state.peasants.top(limit=1)
+        return peasant_names[0] if peasant_names else None
+
     party_id = session.get("party_id")
     query = """
         select player_name
         from players
         where party_id = ?
             and player_status = 'peasant'
-        order by coin desc, drinks desc
+        order by coin desc, drinks desc, player_name
         limit 1
     """
     return fetch_one(query=query, args=[party_id])
@@ -142,6 +275,7 @@ def find_richest_peasant():
 
 def set_allegiance(player_name, noble_name, commit=True):
     """Update database with noble id for a given player."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     query = """
         update players
@@ -149,7 +283,8 @@ def set_allegiance(player_name, noble_name, commit=True):
         where party_id = ?
             and player_name = ?
     """
-    execute(query=query, args=[noble_name, party_id, player_name], commit=commit)
+    execute(query=query, args=[noble_name, party_id, player_name], commit=False)
+    party_state.update_player(player_name, noble_name=noble_name, commit=commit)
 
 
 def update_after_pledge_allegiance(player_name, noble_name):
@@ -166,6 +301,7 @@ def update_after_pledge_allegiance(player_name, noble_name):
 
 def increment_coin(player_name, coin, commit=True):
     """Increase the amount of coin for a player."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     query = """
         update players
@@ -173,19 +309,107 @@ def increment_coin(player_name, coin, commit=True):
         where party_id = ?
             and player_name = ?
     """
-    execute(query=query, args=[coin, party_id, player_name], commit=commit)
+    execute(query=query, args=[coin, party_id, player_name], commit=False)
+    party_state.increment_player(player_name, coin=coin, commit=commit)
+
+
+def spend_noble_coin(player_name, noble_name, coin, commit=True):
+    """Take coin from the noble that a player is allied to, in one statement.
+
+    The update only matches while noble_name is a noble and the player is
+    still allied to them, and it returns the coin that is left, so nothing
+    that was read before the write can be out of date. A noble may spend
+    more coin than they have; the caller decides what happens when they run
+    out.
+
+    Args:
+        player_name (str): The name of the player that the coin is spent for
+        noble_name (str): The name of the noble that was read for the player
+        coin (int): The amount of coin to take
+        commit (bool): Whether to commit the write
+
+    Returns:
+        int: The coin that the noble has left, or None if the player isn't
+            allied to noble_name or noble_name isn't a noble anymore
+    """
+    _remember_players([noble_name])
+    party_id = session.get("party_id")
+    query = """
+        update players
+        set coin = coin - ?
+        where party_id = ?
+            and player_name = ?
+            and player_status = 'noble'
+            and player_name = (
+                select noble_name
+                from players
+                where party_id = ?
+                    and player_name = ?
+            )
+        returning coin
+    """
+    args = [coin, party_id, noble_name, party_id, player_name]
+    coin_left = execute_returning(query=query, args=args, commit=False)
+    if coin_left is not None:
+        party_state.update_player(noble_name, coin=coin_left, commit=commit)
+    return coin_left
 
 
-def move_coin_between_players(from_name, to_name):
-    """Move coin from one player to another."""
-    from_coin = get_single_player(player_name=from_name, col="coin")
-    if from_coin > 0:
-        increment_coin(player_name=from_name, coin=-from_coin, commit=False)
-        increment_coin(player_name=to_name, coin=from_coin, commit=True)
+def take_coin(player_name, coin, commit=True):
+    """Take coin from a player, if they still have at least that much.
+
+    Returns:
+        int: The coin that the player has left, or None if they have less
+            than coin, or aren't in the party
+    """
+    _remember_players([player_name])
+    party_id = session.get("party_id")
+    query = """
+        update players
+        set coin = coin - ?
+        where party_id = ?
+            and player_name = ?
+            and coin >= ?
+        returning coin
+    """
+    args = [coin, party_id, player_name, coin]
+    coin_left = execute_returning(query=query, args=args, commit=False)
+    if coin_left is not None:
+        party_state.update_player(player_name, coin=coin_left, commit=commit)
+    return coin_left
+
+
+def move_coin_between_players(from_name, to_name, commit=True):
+    """Move all of the coin of one player to another.
+
+    The coin is read from the database and taken only if the player still
+    has it, which is tried again up to COIN_UPDATE_ATTEMPTS times if another
+    request changed their coin in between. Coin that the player gains in
+    between stays with them.
+
+    Returns:
+        int: The amount of coin that was moved
+    """
+    party_id = session.get("party_id")
+    query = """
+        select coin
+        from players
+        where party_id = ?
+            and player_name = ?
+    """
+    for _ in range(COIN_UPDATE_ATTEMPTS):
+        from_coin = fetch_one(query=query, args=[party_id, from_name])
+        if from_coin is None or from_coin <= 0:
+            return 0
+        if take_coin(player_name=from_name, coin=from_coin, commit=False) is not None:
+            increment_coin(player_name=to_name, coin=from_coin, commit=commit)
+            return from_coin
+    raise CoinConflictError(f"The coin of {from_name} kept changing.")
 
 
 def increment_soldiers(player_name, num, commit=True):
     """Increase the number of soliders for a single player."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     query = """
         update players
@@ -193,11 +417,13 @@ def increment_soldiers(player_name, num, commit=True):
         where party_id = ?
             and player_name = ?
     """
-    execute(query=query, args=[num, party_id, player_name], commit=commit)
+    execute(query=query, args=[num, party_id, player_name], commit=False)
+    party_state.increment_player(player_name, soldiers=num, commit=commit)
 
 
 def increment_drinks(player_name, num, commit=True):
     """Increase the number of drinks for a player."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     query = """
         update players
@@ -205,11 +431,13 @@ def increment_drinks(player_name, num, commit=True):
         where party_id = ?
             and player_name = ?
     """
-    execute(query=query, args=[num, party_id, player_name], commit=commit)
+    execute(query=query, args=[num, party_id, player_name], commit=False)
+    party_state.increment_player(player_name, drinks=num, commit=commit)
 
 
 def change_allegiances_between_nobles(old_noble_name, new_noble_name, commit=True):
     """For every player, if they are allied to old_noble_name, make them allied to new_noble_name."""
+    _remember_players(noble_name=old_noble_name)
     party_id = session.get("party_id")
     query = """
         update players
@@ -217,11 +445,13 @@ def change_allegiances_between_nobles(old_noble_name, new_noble_name, commit=Tru
         where party_id = ?
             and noble_name = ?
     """
-    execute(query=query, args=[new_noble_name, party_id, old_noble_name], commit=commit)
+    execute(query=query, args=[new_noble_name, party_id, old_noble_name], commit=False)
+    party_state.change_allegiances(old_noble_name, new_noble_name, commit=commit)
 
 
 def change_peasant_to_noble(player_name, commit=True):
     """Update info for a player to reflect their new status as a noble."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     starting_coin = get_starting_coin_for_status(player_status=NOBLE)
     query = """
@@ -249,11 +479,13 @@ def change_peasant_to_noble(player_name, commit=True):
         party_id,
         player_name,
     ]
-    execute(query=query, args=args, commit=commit)
+    execute(query=query, args=args, commit=False)
+    party_state.promote_to_noble(player_name, starting_coin, commit=commit)
 
 
 def change_noble_to_peasant(player_name, commit=True):
     """Update info for a player to reflect their new status as a peasant."""
+    _remember_players([player_name])
     party_id = session.get("party_id")
     query = """
         update players
@@ -262,7 +494,10 @@ def change_noble_to_peasant(player_name, commit=True):
         where party_id = ?
             and player_name = ?
     """
-    execute(query=query, args=[party_id, player_name], commit=commit)
+    execute(query=query, args=[party_id, player_name], commit=False)
+    party_state.update_player(
+        player_name, player_status=PEASANT, soldiers=0, commit=commit
+    )
 
 
 def upgrade_peasant_and_downgrade_noble(peasant_name, noble_name):
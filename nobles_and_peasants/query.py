@@ -1,13 +1,21 @@
-"""Helper functions for executing queries."""
+"""Helper functions for executing queries.
 
-from nobles_and_peasants.db import get_db
+Each statement is timed for the request's metrics. See metrics.py.
+"""
+from time import perf_counter
+
+from nobles_and_peasants.db import commit as commit_db
+from nobles_and_peasants.db import get_db, in_transaction
+from nobles_and_peasants.metrics import record_query
 
 
 def fetch_one(query, args):
     """Execute a query where we are intending to get a single value."""
+    start = perf_counter()
     cur = get_db().execute(query, args)
     result = cur.fetchone()
     cur.close()
+    record_query(query, args, perf_counter() - start)
     if result is None:
         return None
     else:
@@ -16,15 +24,85 @@ def fetch_one(query, args):
 
 def fetch_all(query, args):
     """Execute a query where we are intending to get multiple values."""
+    start = perf_counter()
     cur = get_db().execute(query, args)
     result = cur.fetchall()
     cur.close()
+    record_query(query, args, perf_counter() - start)
     return result
 
 
 def execute(query, args, commit):
-    """Execute a query where we are intending to write results to the database."""
+    """Execute a query where we are intending to write results to the database.
+
+    Inside transaction(), the commit is left to the end of the transaction.
+
+    Returns:
+        int: The rowid of the last row that was inserted
+    """
+    db = get_db()
+    start = perf_counter()
+    cur = db.execute(query, args)
+    cur.close()
+    record_query(query, args, perf_counter() - start)
+    if commit and not in_transaction():
+        commit_db()
+    return cur.lastrowid
+
+
+def execute_returning(query, args, commit):
+    """Execute a write with a returning clause and get the single value it returns.
+
+    Returns None if the write did not change any rows.
+    """
     db = get_db()
-    db.execute(query, args)
-    if commit:
-        db.commit()
+    start = perf_counter()
+    cur = db.execute(query, args)
+    result = cur.fetchone()
+    cur.close()
+    record_query(query, args, perf_counter() - start)
+    if commit and not in_transaction():
+        commit_db()
+    if result is None:
+        return None
+    else:
+        return result[0]
+
+
+def execute_many(query, args_list, commit):
+    """Execute a write once for each list of args, in a single statement.
+
+    Returns:
+        int: The number of rows that were changed
+    """
+    db = get_db()
+    start = perf_counter()
+    cur = db.executemany(query, args_list)
+    cur.close()
+    # the plan of a slow batch is explained with its first args
+    first_args = args_list[0] if isinstance(args_list, list) and args_list else None
+    record_query(query, first_args, perf_counter() - start)
+    if commit and not in_transaction():
+        commit_db()
+    return cur.rowcount
+
+
+def iterate(query, args, batch_size=500):
+    """Execute a query and yield its rows without loading all of them at once.
+
+    The time spent between batches, by the caller, isn't counted as SQL time.
+    """
+    start = perf_counter()
+    cur = get_db().execute(query, args)
+    seconds = perf_counter() - start
+    try:
+        while True:
+            start = perf_counter()
+            rows = cur.fetchmany(batch_size)
+            seconds += perf_counter() - start
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cur.close()
+        record_query(query, args, seconds)
@@ -1,36 +1,25 @@
 """Functions related to the quest_rewards table."""
 from flask import session
 
-from nobles_and_peasants.query import execute, fetch_one, fetch_all
+from nobles_and_peasants.parties import mark_party_changed
+from nobles_and_peasants.query import execute
+from nobles_and_peasants.settings import discard_party_settings, get_party_settings
 
 
 def get_quest_difficulty_and_reward():
     """Get the reward for each quest difficulty."""
-    party_id = session.get("party_id")
-    query = """
-        select difficulty, reward
-        from quest_rewards
-        where party_id = ?
-        order by reward
-    """
-    return fetch_all(query=query, args=[party_id])
+    return get_party_settings().quest_rewards
 
 
 def get_reward_for_difficulty(difficulty):
     """Get the quest reward for a given difficulty."""
-    party_id = session.get("party_id")
-    query = """
-        select reward
-        from quest_rewards
-        where party_id = ?
-            and difficulty = ?
-    """
-    return fetch_one(query=query, args=[party_id, difficulty])
+    return get_party_settings().reward_for_difficulty.get(difficulty)
 
 
 def set_quest_rewards(easy_reward, medium_reward, hard_reward, commit=True):
     """Set the quest rewards for each difficulty."""
     party_id = session.get("party_id")
+    discard_party_settings()
     query = """
         update quest_rewards
         set reward = (case when difficulty = 'easy' then ?
@@ -40,4 +29,5 @@ def set_quest_rewards(easy_reward, medium_reward, hard_reward, commit=True):
         where party_id = ?
     """
     args = [easy_reward, medium_reward, hard_reward, party_id]
-    execute(query=query, args=args, commit=commit)
+    execute(query=query, args=args, commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
@@ -1,25 +1,62 @@
 """Functions related to the quests table."""
 from flask import session
 
-from nobles_and_peasants.query import execute, fetch_all, fetch_one
+from nobles_and_peasants.decks import deal, discard_decks
+from nobles_and_peasants.parties import mark_party_changed
+from nobles_and_peasants.query import (
+    execute,
+    execute_many,
+    fetch_all,
+    fetch_one,
+    iterate,
+)
 
 
 def get_random_quest(difficulty):
-    """Get a random quest of a certain difficulty."""
+    """Get a random quest of a certain difficulty.
+
+    Quests are dealt from a shuffled deck, so every quest of a difficulty is
+    handed out once before any quest is repeated.
+    """
+    party_id = session.get("party_id")
+
+    def load_quest_ids():
+        query = """
+            select id
+            from quests
+            where party_id = ?
+                and difficulty = ?
+        """
+        quests = fetch_all(query=query, args=[party_id, difficulty])
+        return [row["id"] for row in quests]
+
+    def load_quest(quest_id):
+        query = "select quest from quests where id = ?"
+        return fetch_one(query=query, args=[quest_id])
+
+    return deal(
+        table="quests",
+        party_id=party_id,
+        deck_name=difficulty,
+        load_card_ids=load_quest_ids,
+        load_card=load_quest,
+    )
+
+
+def get_all_quests():
+    """Get all quests in a given party."""
     party_id = session.get("party_id")
     query = """
-        select quest
+        select id, quest, difficulty
         from quests
         where party_id = ?
-            and difficulty = ?
-        order by random()
-        limit 1
+        order by id
     """
-    return fetch_one(query=query, args=[party_id, difficulty])
+    return fetch_all(query=query, args=[party_id])
 
 
-def get_all_quests():
-    """Get all quests in a given party."""
+def iterate_quests():
+    """Get all quests in a given party, one at a time."""
     party_id = session.get("party_id")
     query = """
         select id, quest, difficulty
@@ -27,7 +64,7 @@ def get_all_quests():
         where party_id = ?
         order by id
     """
-    return fetch_all(query=query, args=[party_id])
+    return iterate(query=query, args=[party_id])
 
 
 def is_quest_in_party(quest_id):
@@ -42,7 +79,32 @@ def add_quest_to_party(quest, difficulty, commit=True):
     query = """
         insert into quests (party_id, quest, difficulty) values (?, ?, ?)
     """
-    execute(query=query, args=[party_id, quest, difficulty], commit=commit)
+    execute(query=query, args=[party_id, quest, difficulty], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="quests", party_id=party_id)
+
+
+def add_quests_to_party(quests, commit=True):
+    """Add many quests at once, skipping any that the party already has.
+
+    Args:
+        quests (List[Tuple[str, str]]): The quest and difficulty of each quest
+        commit (bool): Whether to commit the inserts
+
+    Returns:
+        int: The number of quests that were added
+    """
+    party_id = session.get("party_id")
+    existing = {(q["quest"], q["difficulty"]) for q in get_all_quests()}
+    new_quests = [q for q in dict.fromkeys(quests) if q not in existing]
+    query = """
+        insert into quests (party_id, quest, difficulty) values (?, ?, ?)
+    """
+    args_list = [(party_id, quest, difficulty) for quest, difficulty in new_quests]
+    execute_many(query=query, args_list=args_list, commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="quests", party_id=party_id)
+    return len(new_quests)
 
 
 def delete_quest_from_table(quest_id, commit=True):
@@ -50,4 +112,7 @@ def delete_quest_from_table(quest_id, commit=True):
     query = """
         delete from quests where id = ?
     """
-    execute(query=query, args=[quest_id], commit=commit)
+    party_id = session.get("party_id")
+    execute(query=query, args=[quest_id], commit=False)
+    mark_party_changed(party_id=party_id, commit=commit)
+    discard_decks(table="quests", party_id=party_id)
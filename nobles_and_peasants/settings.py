@@ -0,0 +1,100 @@
+"""Cache the settings that the host chooses for a party.
+
+Drink costs, starting coin and quest rewards are read on nearly every game
+request, but only change when the host uses the setup page. Each worker
+keeps them in memory for up to SETTINGS_CACHE_TTL seconds, for at most
+SETTINGS_CACHE_SIZE parties. The functions that change a setting discard
+the party's cached settings, so the change is seen on this worker right away
+and on other workers once their copy expires.
+"""
+from flask import current_app, session
+
+from nobles_and_peasants.cache import get_cache
+from nobles_and_peasants.db import call_after_commit, call_after_rollback
+from nobles_and_peasants.query import fetch_all
+
+
+class PartySettings:
+    """The drinks, starting coin and quest rewards of a party.
+
+    Each setting is a list of dicts with the same keys as the columns of its
+    table, ordered from the smallest value to the largest.
+    """
+
+    def __init__(self, drinks, starting_coin, quest_rewards):
+        """Initialize the settings of a party."""
+        self.drinks = drinks
+        self.starting_coin = starting_coin
+        self.quest_rewards = quest_rewards
+        self.drink_costs = {d["drink_name"]: d["drink_cost"] for d in drinks}
+        self.coin_for_status = {s["player_status"]: s["coin"] for s in starting_coin}
+        self.reward_for_difficulty = {
+            r["difficulty"]: r["reward"] for r in quest_rewards
+        }
+
+
+def _get_cache():
+    """Get the cache of party settings for this worker."""
+    return get_cache(
+        "settings",
+        maxsize=current_app.config["SETTINGS_CACHE_SIZE"],
+        ttl=current_app.config["SETTINGS_CACHE_TTL"],
+    )
+
+
+def _load_party_settings(party_id):
+    """Read every setting of a party from the database in one query."""
+    query = """
+        select 'drinks' as setting, drink_name as name, drink_cost as value
+        from drinks
+        where party_id = ?
+        union all
+        select 'starting_coin', player_status, coin
+        from starting_coin
+        where party_id = ?
+        union all
+        select 'quest_rewards', difficulty, reward
+        from quest_rewards
+        where party_id = ?
+        order by value, name
+    """
+    rows = fetch_all(query=query, args=[party_id, party_id, party_id])
+    return PartySettings(
+        drinks=[
+            {"drink_name": row["name"], "drink_cost": row["value"]}
+            for row in rows
+            if row["setting"] == "drinks"
+        ],
+        starting_coin=[
+            {"player_status": row["name"], "coin": row["value"]}
+            for row in rows
+            if row["setting"] == "starting_coin"
+        ],
+        quest_rewards=[
+            {"difficulty": row["name"], "reward": row["value"]}
+            for row in rows
+            if row["setting"] == "quest_rewards"
+        ],
+    )
+
+
+def get_party_settings():
+    """Get the settings of the current party, reading them from the database on a miss."""
+    party_id = session.get("party_id")
+    cache = _get_cache()
+    settings = cache.get(party_id)
+    if settings is None:
+        settings = _load_party_settings(party_id=party_id)
+        cache.set(party_id, settings)
+        # the settings may include writes of this request that are rolled back
+        call_after_rollback(lambda: cache.discard(party_id))
+    return settings
+
+
+def discard_party_settings():
+    """Forget the cached settings of the current party after one of them changes."""
+    party_id = session.get("party_id")
+    cache = _get_cache()
+    cache.discard(party_id)
+    # another request may cache the old settings before this write commits
+    call_after_commit(lambda: cache.discard(party_id))
@@ -0,0 +1,164 @@
+"""Log slow SQL statements with their query plan, and find repeated statements.
+
+Statements are grouped by fingerprint: a short hash of the SQL with its
+whitespace collapsed and its literals replaced by ?, so the same query
+from the same line of code always has the same fingerprint.
+
+A statement that takes longer than SLOW_QUERY_SECONDS is logged as a
+warning with its normalized SQL, its parameters and the output of
+EXPLAIN QUERY PLAN, so a missing index shows up as a SCAN:
+
+    slow query 3f2a9c01b7de 12.3ms: select ... where party_id = ? and player_name = ?
+        params: [1, 'bob']
+        plan: SCAN players
+
+A fingerprint that runs SLOW_QUERY_REPEATS times or more in one request is
+logged as a repeated query, since the request could probably have read the
+rows once. Both are counted by fingerprint at /metrics. Slow queries are
+only looked for when METRICS_ENABLED is set. See metrics.py.
+"""
+import functools
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+from flask import current_app
+
+from nobles_and_peasants.db import get_db
+
+PREFIX = "nobles_and_peasants"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    """Normalize a statement and get its fingerprint.
+
+    Args:
+        query (str): The SQL of the statement
+
+    Returns:
+        Tuple[str, str]: The normalized SQL and its fingerprint
+    """
+    normalized = " ".join(query.split())
+    normalized = _STRING.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    # a list of any length is the same query
+    normalized = _PLACEHOLDERS.sub("(...)", normalized)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    return normalized, digest
+
+
+class SlowQueries:
+    """Counts of the slow and repeated statements of an app, by fingerprint."""
+
+    def __init__(self):
+        """Initialize empty counts."""
+        self.lock = threading.Lock()
+        self.slow = defaultdict(int)
+        self.repeated = defaultdict(int)
+
+    def render(self):
+        """Build the counts in the Prometheus text format."""
+        with self.lock:
+            lines = [
+                f"# HELP {PREFIX}_slow_queries_total Statements slower than SLOW_QUERY_SECONDS.",
+                f"# TYPE {PREFIX}_slow_queries_total counter",
+            ]
+            for digest, count in sorted(self.slow.items()):
+                lines.append(
+                    f'{PREFIX}_slow_queries_total{{fingerprint="{digest}"}} {count}'
+                )
+            lines.extend(
+                [
+                    f"# HELP {PREFIX}_repeated_queries_total Requests that ran a statement SLOW_QUERY_REPEATS times or more.",
+                    f"# TYPE {PREFIX}_repeated_queries_total counter",
+                ]
+            )
+            for (route, digest), count in sorted(self.repeated.items()):
+                labels = f'route="{route}",fingerprint="{digest}"'
+                lines.append(f"{PREFIX}_repeated_queries_total{{{labels}}} {count}")
+        return lines
+
+
+def _explain(query, args):
+    """Get the query plan of a statement, one step per line."""
+    if args is None:
+        return "not available"
+    try:
+        rows = get_db().execute(f"explain query plan {query}", args).fetchall()
+    except sqlite3.Error as e:
+        return f"not available: {e}"
+    return "; ".join(row["detail"] for row in rows)
+
+
+def check_query(query, args, seconds):
+    """Log a statement if it was slow.
+
+    Args:
+        query (str): The SQL of the statement
+        args (list or dict): The parameters of the statement, or None if
+            they aren't known
+        seconds (float): How long the statement took
+    """
+    threshold = current_app.config["SLOW_QUERY_SECONDS"]
+    if threshold is None or seconds < threshold:
+        return
+
+    normalized, digest = fingerprint(query)
+    slow_queries = current_app.extensions["nobles_and_peasants.slow_queries"]
+    with slow_queries.lock:
+        slow_queries.slow[digest] += 1
+    current_app.logger.warning(
+        "slow query %s %.1fms: %s\n    params: %.200r\n    plan: %s",
+        digest,
+        seconds * 1000,
+        normalized,
+        args,
+        _explain(query, args),
+    )
+
+
+def check_repeats(method, route, queries):
+    """Log the statements that a request ran too many times.
+
+    Args:
+        method (str): The method of the request
+        route (str): The url rule of the request
+        queries (Dict[str, int]): The number of times that the request ran
+            each statement, by SQL
+    """
+    threshold = current_app.config["SLOW_QUERY_REPEATS"]
+    if threshold is None:
+        return
+
+    counts = defaultdict(int)
+    for query, count in queries.items():
+        counts[fingerprint(query)] += count
+    repeats = [(key, count) for key, count in counts.items() if count >= threshold]
+    if not repeats:
+        return
+
+    slow_queries = current_app.extensions["nobles_and_peasants.slow_queries"]
+    with slow_queries.lock:
+        for (_, digest), _ in repeats:
+            slow_queries.repeated[(route, digest)] += 1
+    for (normalized, digest), count in repeats:
+        current_app.logger.warning(
+            "repeated query %s ran %d times in %s %s: %s",
+            digest,
+            count,
+            method,
+            route,
+            normalized,
+        )
+
+
+def init_app(app):
+    """Give the app its slow query counts."""
+    app.extensions["nobles_and_peasants.slow_queries"] = SlowQueries()
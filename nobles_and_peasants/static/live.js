@@ -0,0 +1,57 @@
+// Keep the kingdom and leaderboard pages up to date with the party's
+// stream of server-sent events. See live.py.
+
+function subscribe(url, draw) {
+    var players = {};
+    var source = new EventSource(url);
+    source.addEventListener("snapshot", function (e) {
+        players = {};
+        JSON.parse(e.data).players.forEach(function (p) { players[p.player_name] = p; });
+        draw(Object.values(players));
+    });
+    source.addEventListener("players", function (e) {
+        JSON.parse(e.data).players.forEach(function (p) { players[p.player_name] = p; });
+        draw(Object.values(players));
+    });
+}
+
+function compareLeaderboard(a, b) {
+    return (b.soldiers - a.soldiers) || (b.coin - a.coin) || (b.drinks - a.drinks)
+        || (a.player_name < b.player_name ? -1 : a.player_name > b.player_name ? 1 : 0);
+}
+
+function fillTable(tbody, rows, columns) {
+    var fragment = document.createDocumentFragment();
+    rows.forEach(function (row) {
+        var tr = document.createElement("tr");
+        columns.forEach(function (col) {
+            var td = document.createElement("td");
+            td.textContent = row[col] === null ? "None" : row[col];
+            tr.appendChild(td);
+        });
+        fragment.appendChild(tr);
+    });
+    tbody.replaceChildren(fragment);
+}
+
+function liveKingdom(url) {
+    var tbody = document.querySelector("#kingdom_table tbody");
+    subscribe(url, function (players) {
+        players.sort(function (a, b) {
+            return a.player_name < b.player_name ? -1 : a.player_name > b.player_name ? 1 : 0;
+        });
+        fillTable(tbody, players, ["player_name", "player_status", "noble_name", "coin", "drinks", "soldiers"]);
+    });
+}
+
+function liveLeaderboard(url, size) {
+    var tbody = document.querySelector("#leaderboard_table tbody");
+    var ruler = document.getElementById("almighty_ruler");
+    subscribe(url, function (players) {
+        var nobles = players.filter(function (p) { return p.player_status === "noble"; });
+        nobles.sort(compareLeaderboard);
+        fillTable(tbody, size === null ? nobles : nobles.slice(0, size), ["player_name", "soldiers", "coin", "drinks"]);
+        var top = players.slice().sort(compareLeaderboard)[0];
+        ruler.textContent = top === undefined ? "None" : top.player_name;
+    });
+}
@@ -4,7 +4,8 @@ import tempfile
 
 import pytest
 from nobles_and_peasants import create_app
-from nobles_and_peasants.db import get_db, init_db
+from nobles_and_peasants.db import close_pooled_connections, get_db, init_db
+from nobles_and_peasants.parties import init_party
 
 with open(os.path.join(os.path.dirname(__file__), "test_data.sql"), "rb") as f:
     _data_sql = f.read().decode("utf8")
@@ -19,6 +20,7 @@ def app():
         {
             "TESTING": True,
             "DATABASE": db_path,
+            "PASSWORD_HASH_WORKERS": 0,
         }
     )
 
@@ -28,6 +30,8 @@ def app():
 
     yield app
 
+    with app.app_context():
+        close_pooled_connections()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -68,3 +72,12 @@ class AuthActions:
 def auth(client):
     """A fixture for logging in and logging out."""
     return AuthActions(client)
+
+
+@pytest.fixture
+def party(app, auth):
+    """Log in to party_name_1 after giving it the default settings."""
+    with app.app_context():
+        init_party(party_id=1)
+    auth.login(party_name="party_name_1", password="maya")
+    return auth
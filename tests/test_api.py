@@ -0,0 +1,184 @@
+"""Tests for the JSON API."""
+import pytest
+from nobles_and_peasants import query as query_module
+from nobles_and_peasants.db import get_db
+
+
+@pytest.fixture
+def api(party):
+    """Log in and sign in a noble and a peasant that is allied to them."""
+    client = party._client
+    client.post(
+        "/api/v1/sign_in", json={"player_name": "Alice", "player_status": "noble"}
+    )
+    client.post(
+        "/api/v1/sign_in", json={"player_name": "bob", "player_status": "peasant"}
+    )
+    client.post("/api/v1/pledge", json={"player_name": "bob", "noble_name": "alice"})
+    return client
+
+
+def test_requires_login(client):
+    """Test that the API answers with an error instead of a redirect."""
+    response = client.post("/api/v1/sign_in", json={})
+    assert response.status_code == 401
+
+
+def test_action_returns_player_deltas(api):
+    """Test that an action returns the players that it changed."""
+    response = api.post(
+        "/api/v1/buy_drink",
+        json={"player_name": "bob", "drink_name": "beer", "quantity": 2},
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "result": None,
+        "players": [
+            {"player_name": "alice", "changes": {"coin": [50, 44]}},
+            {"player_name": "bob", "changes": {"drinks": [0, 2]}},
+        ],
+    }
+
+
+def test_sign_in_returns_new_player(api):
+    """Test that a new player is listed with every column."""
+    response = api.post(
+        "/api/v1/sign_in", json={"player_name": "carol", "player_status": "peasant"}
+    )
+    [delta] = response.get_json()["players"]
+    assert delta["player_name"] == "carol"
+    assert delta["changes"]["player_status"] == [None, "peasant"]
+
+
+def test_action_not_allowed(api):
+    """Test that an action that isn't allowed answers with its message."""
+    response = api.post(
+        "/api/v1/pledge", json={"player_name": "alice", "noble_name": "bob"}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Unsuccessful! bob is not a noble."
+
+
+def test_unknown_action_and_bad_arguments(api):
+    """Test that unknown actions and missing arguments are rejected."""
+    assert api.post("/api/v1/fly", json={}).status_code == 404
+
+    response = api.post("/api/v1/ban", json={"noble_name": "alice"})
+    assert response.status_code == 400
+    assert "peasant_name" in response.get_json()["error"]
+
+
+def test_batch_applies_every_action(api):
+    """Test that a batch takes each action and returns the combined deltas."""
+    response = api.post(
+        "/api/v1/batch",
+        json={
+            "actions": [
+                {"action": "get_quest", "player_name": "bob", "difficulty": "easy"},
+                {
+                    "action": "complete_quest",
+                    "player_name": "bob",
+                    "difficulty": "easy",
+                    "result": "Yes",
+                },
+                {
+                    "action": "buy_drink",
+                    "player_name": "bob",
+                    "drink_name": "water",
+                    "quantity": 1,
+                },
+            ]
+        },
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert isinstance(body["results"][0], str)
+    assert body["players"] == [
+        {"player_name": "alice", "changes": {"coin": [50, 51]}},
+        {"player_name": "bob", "changes": {"coin": [0, 10], "drinks": [0, 1]}},
+    ]
+
+
+def test_batch_is_all_or_nothing(app, api):
+    """Test that no action of a batch is applied if one isn't allowed."""
+    response = api.post(
+        "/api/v1/batch",
+        json={
+            "actions": [
+                {
+                    "action": "sign_in",
+                    "player_name": "carol",
+                    "player_status": "peasant",
+                },
+                {"action": "pledge", "player_name": "carol", "noble_name": "dave"},
+            ]
+        },
+    )
+    assert response.status_code == 400
+    assert response.get_json()["index"] == 1
+
+    with app.app_context():
+        query = "select count(*) from players where player_name = 'carol'"
+        assert get_db().execute(query).fetchone()[0] == 0
+
+
+@pytest.mark.parametrize(
+    "action, params, field",
+    [
+        ("sign_in", {"player_name": 5, "player_status": "noble"}, "player name"),
+        (
+            "buy_drink",
+            {"player_name": None, "drink_name": "beer", "quantity": 1},
+            "player name",
+        ),
+        ("pledge", {"player_name": "bob", "noble_name": ["alice"]}, "noble name"),
+        ("get_quest", {"player_name": "bob", "difficulty": 1}, "difficulty"),
+    ],
+)
+def test_arguments_must_be_text(api, action, params, field):
+    """Test that a name that isn't a string answers with a JSON error."""
+    response = api.post(f"/api/v1/{action}", json=params)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == f"Unsuccessful! The {field} must be text."
+
+
+@pytest.mark.parametrize("party_state", [False, True])
+def test_deltas_read_only_changed_players(app, api, monkeypatch, party_state):
+    """Test that the deltas of a succession match the whole party, read before and after."""
+    app.config["PARTY_STATE_ENABLED"] = party_state
+    api.post("/api/v1/sign_in", json={"player_name": "carol", "player_status": "noble"})
+    query = """
+        select player_name, player_status, coin, noble_name, drinks, soldiers
+        from players
+        where party_id = 1
+    """
+
+    def read_party():
+        with app.app_context():
+            return {row[0]: tuple(row)[1:] for row in get_db().execute(query)}
+
+    before = read_party()
+    statements = []
+    record_query = query_module.record_query
+    monkeypatch.setattr(
+        query_module,
+        "record_query",
+        lambda query, *args: statements.append(query) or record_query(query, *args),
+    )
+    response = api.post(
+        "/api/v1/buy_drink",
+        json={"player_name": "bob", "drink_name": "beer", "quantity": 20},
+    )
+    after = read_party()
+
+    assert "is now a noble" in response.get_json()["result"]
+    expected = [name for name in sorted(after) if before.get(name) != after[name]]
+    assert [d["player_name"] for d in response.get_json()["players"]] == expected
+    for delta in response.get_json()["players"]:
+        for col, (old, new) in delta["changes"].items():
+            i = ("player_status", "coin", "noble_name", "drinks", "soldiers").index(col)
+            assert before[delta["player_name"]][i] == old
+            assert after[delta["player_name"]][i] == new
+    assert statements
+    # the whole party was never read
+    assert not [s for s in statements if "order by player_name" in s]
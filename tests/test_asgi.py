@@ -0,0 +1,167 @@
+"""Tests for serving the app with an ASGI server."""
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+from flask import session
+from nobles_and_peasants.asgi import AsgiApp
+from nobles_and_peasants.constants import NOBLE
+from nobles_and_peasants.live import get_broker
+from nobles_and_peasants.parties import init_party
+from nobles_and_peasants.players import increment_coin, insert_new_player
+from nobles_and_peasants.quests import get_all_quests
+
+
+def make_scope(path, method="GET", headers=()):
+    """Build the scope of an http request."""
+    return {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": list(headers),
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 12345),
+    }
+
+
+async def call(asgi_app, scope, send, disconnect=None, body=b""):
+    """Send a request to the app, and disconnect once disconnect is set."""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect is not None:
+            await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    await asgi_app(scope, receive, send)
+
+
+async def request(asgi_app, path, method="GET", body=b"", headers=()):
+    """Send a request to the app and collect the whole response."""
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await call(asgi_app, make_scope(path, method, headers), send, body=body)
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return sent[0]["status"], dict(sent[0]["headers"]), body
+
+
+async def log_in(asgi_app):
+    """Log in to party_name_1 and get the session cookie."""
+    body = urlencode({"party_name": "party_name_1", "password": "maya"}).encode()
+    headers = [
+        (b"content-type", b"application/x-www-form-urlencoded"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    status, headers, _ = await request(
+        asgi_app, "/auth/login", method="POST", body=body, headers=headers
+    )
+    assert status == 302
+    return headers[b"set-cookie"].split(b";")[0]
+
+
+def parse_event(chunk):
+    """Get the data of an event from the stream."""
+    return json.loads(chunk.split(b"data: ")[1])
+
+
+@pytest.fixture
+def asgi_app(app):
+    """Wrap the app for an ASGI server, with a player in party 1."""
+    app.config["LIVE_HEARTBEAT_SECONDS"] = 0.05
+    with app.test_request_context():
+        session["party_id"] = 1
+        init_party(party_id=1)
+        insert_new_player(player_name="alice", player_status=NOBLE)
+    return AsgiApp(app)
+
+
+def test_sync_views_are_served(asgi_app):
+    """Test that the sync views answer through the pool."""
+
+    async def run():
+        cookie = await log_in(asgi_app)
+        return await request(asgi_app, "/kingdom", headers=[(b"cookie", cookie)])
+
+    status, _, body = asyncio.run(run())
+    assert status == 200
+    assert b"alice" in body
+
+
+def test_streamed_views_are_sent_in_chunks(app, asgi_app):
+    """Test that a streamed download is sent a chunk at a time, in full."""
+    app.config["ASGI_QUEUED_CHUNKS"] = 1
+    sent = []
+
+    async def run():
+        cookie = await log_in(asgi_app)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = make_scope("/export_quests", headers=[(b"cookie", cookie)])
+        await call(asgi_app, scope, send)
+
+    asyncio.run(run())
+    assert sent[0]["status"] == 200
+    bodies = [message for message in sent[1:] if message["body"]]
+    assert len(bodies) > 2
+    assert all(message["more_body"] for message in bodies)
+    assert not sent[-1].get("more_body")
+
+    with app.test_request_context():
+        session["party_id"] = 1
+        num_quests = len(get_all_quests())
+    lines = b"".join(message["body"] for message in bodies).splitlines()
+    assert len(lines) == num_quests + 1
+
+
+def test_live_requires_login(asgi_app):
+    """Test that the live stream redirects viewers that aren't logged in."""
+    status, headers, _ = asyncio.run(request(asgi_app, "/live"))
+    assert status == 302
+    assert headers[b"location"].endswith(b"/auth/login")
+
+
+def test_live_stream_on_event_loop(app, asgi_app):
+    """Test that the live stream sends a snapshot and then each change."""
+
+    def write():
+        with app.test_request_context():
+            session["party_id"] = 1
+            increment_coin(player_name="alice", coin=3)
+
+    async def run():
+        cookie = await log_in(asgi_app)
+        events = asyncio.Queue()
+        disconnect = asyncio.Event()
+
+        async def send(message):
+            body = message.get("body", b"")
+            if body and not body.startswith(b":"):
+                await events.put(body)
+
+        scope = make_scope("/live", headers=[(b"cookie", cookie)])
+        stream = asyncio.ensure_future(call(asgi_app, scope, send, disconnect))
+        snapshot = parse_event(await asyncio.wait_for(events.get(), 5))
+
+        await asgi_app.offload(write)
+        change = parse_event(await asyncio.wait_for(events.get(), 5))
+
+        disconnect.set()
+        await asyncio.wait_for(stream, 5)
+        return snapshot, change
+
+    snapshot, change = asyncio.run(run())
+    assert [p["player_name"] for p in snapshot["players"]] == ["alice"]
+    assert change["players"][0]["coin"] == snapshot["players"][0]["coin"] + 3
+    with app.app_context():
+        assert not get_broker().has_subscribers(1)
@@ -0,0 +1,109 @@
+"""Tests for building and serving fingerprinted static files."""
+import gzip
+import json
+import os
+
+import pytest
+
+from nobles_and_peasants.assets import asset_url, build_assets, load_assets
+
+
+@pytest.fixture
+def built_app(app, runner, tmp_path):
+    """Build the static files of the app into a temporary folder."""
+    app.config["ASSETS_FOLDER"] = str(tmp_path / "dist")
+    result = runner.invoke(args=["build-assets"])
+    assert "Built 4 static files" in result.output
+    return app
+
+
+def test_pages_link_to_fingerprinted_files(built_app, client):
+    """Test that a page links to the fingerprinted stylesheet, served for a year."""
+    page = client.get("/").get_data(as_text=True)
+    manifest = built_app.extensions["nobles_and_peasants.assets"].manifest
+    url = f"/assets/{manifest['style.css']['file']}"
+    assert url in page
+
+    with open(os.path.join(built_app.static_folder, "style.css"), "rb") as f:
+        original = f.read()
+    response = client.get(url)
+    assert response.data == original
+    assert response.mimetype == "text/css"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "max-age=31536000" in response.headers["Cache-Control"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == original
+
+
+def test_unbuilt_files_use_the_static_url(app, tmp_path):
+    """Test that the app links to plain static files until they are built."""
+    app.config["ASSETS_FOLDER"] = str(tmp_path / "dist")
+    load_assets(app)
+    with app.test_request_context():
+        assert asset_url("style.css") == "/static/style.css"
+
+
+def test_css_urls_are_rewritten(tmp_path):
+    """Test that stylesheets link to the fingerprinted copies of other files."""
+    static = tmp_path / "static"
+    (static / "img").mkdir(parents=True)
+    (static / "img" / "logo.svg").write_text("<svg></svg>")
+    (static / "css").mkdir()
+    (static / "css" / "style.css").write_text(
+        "a { background: url('../img/logo.svg'); }\n"
+        "b { background: url(https://example.com/x.svg); }\n"
+        "c { background: url(missing.svg); }\n"
+    )
+
+    manifest = build_assets(str(static), str(tmp_path / "dist"))
+    logo = manifest["img/logo.svg"]["file"]
+    assert logo.startswith("img/logo.") and logo.endswith(".svg")
+
+    with open(tmp_path / "dist" / manifest["css/style.css"]["file"]) as f:
+        css = f.read()
+    assert f"url('../{logo}')" in css
+    assert "url(https://example.com/x.svg)" in css
+    assert "url(missing.svg)" in css
+    with open(tmp_path / "dist" / "manifest.json") as f:
+        assert json.load(f) == manifest
+
+
+def test_images_get_webp_and_smaller_copies(tmp_path):
+    """Test that images are copied to WebP and to each width smaller than them."""
+    pil = pytest.importorskip("PIL.Image")
+    static = tmp_path / "static"
+    static.mkdir()
+    pil.new("RGB", (1000, 500), "red").save(static / "banner.png")
+
+    manifest = build_assets(str(static), str(tmp_path / "dist"), [480, 2000])
+    entry = manifest["banner.png"]
+    assert entry["webp"].endswith(".webp")
+    assert list(entry["widths"]) == ["480"]
+    with pil.open(tmp_path / "dist" / entry["widths"]["480"]["webp"]) as image:
+        assert image.size == (480, 240)
+
+
+def test_rebuild_keeps_earlier_files(built_app, runner, party, tmp_path):
+    """Test that a new build adds files, and makes cached pages stale."""
+    client = party._client
+    etag = client.get("/kingdom").headers["ETag"]
+    old = built_app.extensions["nobles_and_peasants.assets"].manifest["style.css"]
+
+    static = tmp_path / "static"
+    static.mkdir()
+    (static / "style.css").write_text("body { color: red; }\n")
+    built_app.static_folder = str(static)
+    runner.invoke(args=["build-assets"])
+
+    new = built_app.extensions["nobles_and_peasants.assets"].manifest["style.css"]
+    assert new["file"] != old["file"]
+    dist = tmp_path / "dist"
+    assert (dist / old["file"]).exists()
+    assert (dist / new["file"]).exists()
+    assert not [name for name in os.listdir(dist) if name.endswith(".tmp")]
+
+    response = client.get("/kingdom", headers={"If-None-Match": etag})
+    assert response.status_code == 200
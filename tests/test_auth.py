@@ -1,7 +1,14 @@
 """Tests for authentication ability."""
 import pytest
 from flask import g, session
+from nobles_and_peasants.auth import signup
 from nobles_and_peasants.db import get_db
+from nobles_and_peasants.default_values import QUESTS
+from nobles_and_peasants.parties import (
+    does_party_id_exist,
+    does_party_name_exist,
+    insert_new_party,
+)
 
 
 def test_signup(client, app):
@@ -17,6 +24,41 @@ def test_signup(client, app):
         assert db.execute(query).fetchone() is not None
 
 
+def test_signup_adds_default_content(client, app):
+    """Test that a new party gets the default content in the same transaction."""
+    data = {"party_name": "test_signup_name", "password": "test_signup_pw"}
+
+    statements = []
+    with app.app_context():
+        get_db().set_trace_callback(statements.append)
+        with app.test_request_context(method="POST", data=data):
+            signup()
+        get_db().set_trace_callback(None)
+
+        query = """
+            select count(*)
+            from quests
+            join parties on parties.id = quests.party_id
+            where party_name = 'test_signup_name'
+        """
+        assert get_db().execute(query).fetchone()[0] == len(QUESTS)
+
+    assert statements.count("COMMIT") == 1
+
+
+def test_insert_new_party_does_not_take_a_used_name(app):
+    """Test that inserting a party name that is already used changes nothing."""
+    with app.app_context():
+        assert does_party_name_exist(party_name="party_name_1")
+        assert not does_party_name_exist(party_name="party_name_3")
+        assert does_party_id_exist(party_id=2)
+        assert not does_party_id_exist(party_id=3)
+
+        assert insert_new_party(party_name="party_name_1", password="pw") is None
+        query = "select count(*) from drinks"
+        assert get_db().execute(query).fetchone()[0] == 0
+
+
 @pytest.mark.parametrize(
     ("party_name", "password", "message"),
     (
@@ -1,12 +1,38 @@
 """Tests for database connection."""
+import os
 import sqlite3
+import threading
 
 import pytest
-from nobles_and_peasants.db import get_db
+from flask import session
+from nobles_and_peasants import create_app
+from nobles_and_peasants import query as query_module
+from nobles_and_peasants.challenges import get_random_challenge
+from nobles_and_peasants.db import (
+    close_pooled_connections,
+    get_db,
+    get_migrations,
+    get_schema_version,
+    init_db,
+    migrate_db,
+    transaction,
+)
+from nobles_and_peasants.drinks import get_cost_for_a_drink
+from nobles_and_peasants.outlaws import is_peasant_banned
+from nobles_and_peasants.players import (
+    change_allegiances_between_nobles,
+    find_richest_peasant,
+    get_all_nobles,
+    get_almighty_ruler,
+    get_single_player,
+)
+from nobles_and_peasants.query import execute
+from nobles_and_peasants.quests import get_random_quest
 
 
 def test_get_close_db(app):
     """Test that database connection closes outside of app context."""
+    app.config["DB_REUSE_CONNECTIONS"] = False
     with app.app_context():
         db = get_db()
         assert db is get_db()
@@ -21,6 +47,75 @@ def test_get_close_db(app):
     assert "Cannot operate on a closed database" in str(e.value)
 
 
+def test_reuse_db_connection(app):
+    """Test that a worker thread keeps its connection between app contexts."""
+    with app.app_context():
+        db = get_db()
+        assert db.execute("pragma journal_mode").fetchone()[0] == "wal"
+        assert db.execute("pragma synchronous").fetchone()[0] == 1
+        assert db.execute("pragma busy_timeout").fetchone()[0] == 5000
+
+    with app.app_context():
+        assert get_db() is db
+        db.execute("SELECT 1")
+
+    with app.app_context():
+        close_pooled_connections()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+
+
+def test_db_connection_per_thread(app):
+    """Test that worker threads do not share a connection."""
+    connections = []
+
+    def open_db():
+        with app.app_context():
+            connections.append(get_db())
+            close_pooled_connections()
+
+    thread = threading.Thread(target=open_db)
+    thread.start()
+    thread.join()
+
+    with app.app_context():
+        assert get_db() is not connections[0]
+
+
+def test_transaction_commits_once(app):
+    """Test that the writes of a unit of work share a single commit."""
+    statements = []
+    query = "insert into parties (party_name, password) values (?, 'pw')"
+    with app.app_context():
+        db = get_db()
+        db.set_trace_callback(statements.append)
+        with transaction():
+            execute(query=query, args=["party_name_3"], commit=True)
+            with transaction():
+                execute(query=query, args=["party_name_4"], commit=True)
+        db.set_trace_callback(None)
+
+        num_parties = db.execute("select count(*) from parties").fetchone()[0]
+        assert num_parties == 4
+
+    assert statements.count("begin immediate") == 1
+    assert statements.count("COMMIT") == 1
+
+
+def test_transaction_rolls_back(app):
+    """Test that no write of a failed unit of work is saved."""
+    query = "insert into parties (party_name, password) values (?, 'pw')"
+    with app.app_context():
+        with pytest.raises(sqlite3.IntegrityError):
+            with transaction():
+                execute(query=query, args=["party_name_3"], commit=True)
+                execute(query=query, args=["party_name_1"], commit=True)
+
+        num_parties = get_db().execute("select count(*) from parties").fetchone()[0]
+        assert num_parties == 2
+
+
 def test_init_db_command(runner, monkeypatch):
     """Test that initialize database command works."""
 
@@ -34,3 +129,140 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_init_db_applies_migrations(app):
+    """Test that a fresh database is at the latest schema version."""
+    with app.app_context():
+        latest_version = get_migrations()[-1][0]
+        assert get_schema_version() == latest_version
+        assert migrate_db() == []
+
+
+def test_migrate_command(runner, app):
+    """Test that the migrate command upgrades a database in place."""
+    with app.app_context():
+        db = get_db()
+        db.execute("drop index players_party_id_player_name")
+        db.execute("pragma user_version = 0")
+        db.commit()
+
+    result = runner.invoke(args=["migrate"])
+    assert "Applied 0001_player_indexes.sql." in result.output
+
+    with app.app_context():
+        assert get_schema_version() == get_migrations()[-1][0]
+        query = "select count(*) as num from parties"
+        assert get_db().execute(query).fetchone()["num"] == 2
+
+
+# indexes that keep players in ranking order, so rankings are read unsorted
+RANKING_INDEXES = {"players_leaderboard", "players_ruler", "players_succession"}
+
+
+@pytest.mark.parametrize(
+    ("call", "indexes"),
+    (
+        (
+            lambda: get_single_player(player_name="bob"),
+            ["players_party_id_player_name"],
+        ),
+        (
+            lambda: change_allegiances_between_nobles(
+                old_noble_name="alice", new_noble_name="bob"
+            ),
+            ["players_party_id_noble_name"],
+        ),
+        (
+            lambda: is_peasant_banned(noble_id=1, peasant_id=2),
+            ["outlaws_party_id_noble_id_peasant_id"],
+        ),
+        (
+            lambda: get_cost_for_a_drink(drink_name="beer"),
+            [
+                "drinks_party_id_drink_name",
+                "starting_coin_party_id_player_status",
+                "quest_rewards_party_id_difficulty",
+            ],
+        ),
+        (
+            lambda: get_random_quest(difficulty="easy"),
+            ["quests_party_id_difficulty"],
+        ),
+        (get_random_challenge, ["challenges_party_id"]),
+        (get_all_nobles, ["players_leaderboard"]),
+        (get_almighty_ruler, ["players_ruler"]),
+        (find_richest_peasant, ["players_succession"]),
+    ),
+)
+def test_hot_queries_use_indexes(app, monkeypatch, call, indexes):
+    """Test that the queries run on every request do not scan whole tables.
+
+    The statements are captured from the functions that run them, so the
+    test explains the SQL that the app really sends. Rankings are read in
+    index order, so their queries don't sort with a temporary B-tree.
+    """
+    statements = []
+    monkeypatch.setattr(
+        query_module,
+        "record_query",
+        lambda query, args, seconds: statements.append((query, args)),
+    )
+    with app.test_request_context():
+        session["party_id"] = 1
+        call()
+
+        details = []
+        for query, args in statements:
+            if query.lstrip().lower().startswith(("select", "update", "delete")):
+                plan = get_db().execute(f"explain query plan {query}", args)
+                details += [row["detail"] for row in plan.fetchall()]
+    assert details
+    assert not [detail for detail in details if detail.startswith("SCAN ")]
+    if RANKING_INDEXES.intersection(indexes):
+        assert not [detail for detail in details if "TEMP B-TREE" in detail]
+    for index in indexes:
+        assert any(
+            f"USING INDEX {index}" in detail
+            or f"USING COVERING INDEX {index}" in detail
+            for detail in details
+        )
+
+
+def test_memory_backend(tmp_path):
+    """Test that a memory backend app plays a party without writing any file."""
+    database = str(tmp_path / "quick.sqlite")
+    config = {
+        "TESTING": True,
+        "DATABASE": database,
+        "DB_BACKEND": "memory",
+        "PASSWORD_HASH_WORKERS": 0,
+    }
+    quick = create_app(config)
+    other = create_app(config)
+    with quick.app_context():
+        init_db()
+    with other.app_context():
+        init_db()
+
+    quick_client = quick.test_client()
+    data = {"party_name": "quick", "password": "pw"}
+    quick_client.post("/auth/signup", data=data)
+    quick_client.post("/auth/login", data=data)
+    quick_client.post("/sign_in", data={"player_name": "zed", "player_status": "noble"})
+    assert b"zed" in quick_client.get("/kingdom").data
+
+    def count_rows(app):
+        with app.app_context():
+            return get_db().execute("select count(*) from players").fetchone()[0]
+
+    assert count_rows(quick) == 1
+    # each app has databases of its own, even with the same DATABASE name
+    assert count_rows(other) == 0
+    assert os.listdir(tmp_path) == []
+
+    quick.extensions["nobles_and_peasants.memory"].close()
+    with quick.app_context():
+        close_pooled_connections()
+        init_db()
+    assert count_rows(quick) == 0
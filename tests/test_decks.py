@@ -0,0 +1,64 @@
+"""Tests for dealing quests and challenges from a deck."""
+from flask import session
+from nobles_and_peasants.cache import LRUCache
+from nobles_and_peasants.challenges import get_all_challenges, get_random_challenge
+from nobles_and_peasants.parties import init_party
+from nobles_and_peasants.quests import (
+    add_quest_to_party,
+    delete_quest_from_table,
+    get_all_quests,
+    get_random_quest,
+)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that a full cache drops the key that was used longest ago."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_keys():
+    """Test that keys are missing once their time to live has passed."""
+    cache = LRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+    assert cache.get("a", "expired") == "expired"
+
+
+def test_deal_every_quest_before_repeating(app):
+    """Test that a deck hands out each quest once per shuffle."""
+    with app.test_request_context():
+        session["party_id"] = 1
+        init_party(party_id=1)
+        easy_quests = [
+            q["quest"] for q in get_all_quests() if q["difficulty"] == "easy"
+        ]
+
+        dealt = [get_random_quest(difficulty="easy") for _ in easy_quests]
+        assert sorted(dealt) == sorted(easy_quests)
+
+        # the next shuffle never starts with the quest that was dealt last
+        assert get_random_quest(difficulty="easy") != dealt[-1]
+
+        challenges = [c["challenge"] for c in get_all_challenges()]
+        dealt = [get_random_challenge() for _ in challenges]
+        assert sorted(dealt) == sorted(challenges)
+
+
+def test_deck_follows_quest_changes(app):
+    """Test that adding and deleting quests rebuilds the deck."""
+    with app.test_request_context():
+        session["party_id"] = 1
+        assert get_random_quest(difficulty="impossible") is None
+
+        add_quest_to_party(quest="Juggle three drinks.", difficulty="impossible")
+        assert get_random_quest(difficulty="impossible") == "Juggle three drinks."
+
+        quest_id = get_all_quests()[-1]["id"]
+        delete_quest_from_table(quest_id=quest_id)
+        assert get_random_quest(difficulty="impossible") is None
@@ -0,0 +1,217 @@
+"""Tests for the game event log."""
+import json
+
+import pytest
+from flask import session
+from nobles_and_peasants import actions
+from nobles_and_peasants import query as query_module
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.events import replay_party
+from nobles_and_peasants.parties import init_party
+
+PLAYERS_QUERY = """
+    select id, player_name, player_status, coin, noble_name, drinks, soldiers
+    from players
+    where party_id = 1
+    order by player_name
+"""
+
+
+def take(client, *actions):
+    """Take a batch of actions through the JSON API."""
+    return client.post("/api/v1/batch", json={"actions": list(actions)})
+
+
+@pytest.fixture
+def game(party):
+    """Play a few rounds, including a noble running out of money."""
+    client = party._client
+    response = take(
+        client,
+        {"action": "sign_in", "player_name": "alice", "player_status": "noble"},
+        {"action": "sign_in", "player_name": "bob", "player_status": "peasant"},
+        {"action": "sign_in", "player_name": "carol", "player_status": "peasant"},
+        {"action": "pledge", "player_name": "bob", "noble_name": "alice"},
+        {"action": "pledge", "player_name": "carol", "noble_name": "alice"},
+        {
+            "action": "complete_quest",
+            "player_name": "carol",
+            "difficulty": "hard",
+            "result": "Yes",
+        },
+    )
+    assert response.status_code == 200
+    response = take(
+        client,
+        {
+            "action": "buy_drink",
+            "player_name": "bob",
+            "drink_name": "beer",
+            "quantity": 17,
+        },
+        {
+            "action": "assassinate",
+            "player_name": "bob",
+            "target_name": "carol",
+            "winner_name": "bob",
+        },
+    )
+    assert response.status_code == 200
+    return client
+
+
+def replayed_players(state):
+    """List the players of a replay in the same form as the players table."""
+    return [
+        tuple(p[col] for col in p.keys())
+        for p in sorted(state.players.values(), key=lambda p: p.player_name)
+    ]
+
+
+def test_actions_are_logged(app, game):
+    """Test that each action is logged with its arguments and changes."""
+    with app.app_context():
+        rows = get_db().execute("select action, data from game_events").fetchall()
+
+    assert [row["action"] for row in rows] == [
+        "sign_in",
+        "sign_in",
+        "sign_in",
+        "pledge",
+        "pledge",
+        "complete_quest",
+        "buy_drink",
+        "assassinate",
+    ]
+    data = json.loads(rows[3]["data"])
+    assert data["args"] == {"player_name": "bob", "noble_name": "alice"}
+    assert [c["op"] for c in data["changes"]] == ["update", "increment"]
+
+
+def test_events_are_inserted_in_one_statement(app, game):
+    """Test that the events of a request are inserted together."""
+    statements = []
+    with app.app_context():
+        get_db().set_trace_callback(statements.append)
+        take(
+            game,
+            {
+                "action": "buy_drink",
+                "player_name": "bob",
+                "drink_name": "water",
+                "quantity": 1,
+            },
+            {
+                "action": "buy_drink",
+                "player_name": "carol",
+                "drink_name": "water",
+                "quantity": 1,
+            },
+        )
+        get_db().set_trace_callback(None)
+    inserts = [s for s in statements if "insert into game_events" in s]
+    # sqlite traces each row of an executemany
+    assert len(inserts) == 2
+    assert statements.index(inserts[-1]) < statements.index("COMMIT")
+
+
+def test_replay_matches_players(app, game):
+    """Test that replaying the log rebuilds the players table."""
+    with app.app_context():
+        state, _ = replay_party(party_id=1)
+        players = [tuple(row) for row in get_db().execute(PLAYERS_QUERY)]
+    assert replayed_players(state) == players
+    # bob took carol's coin, and alice went broke and lost her army to carol
+    assert state.players["alice"].player_status == "peasant"
+
+
+def test_action_outside_transaction_is_logged_with_its_writes(app):
+    """Test that an action taken outside transaction() logs every change it makes."""
+    with app.test_request_context():
+        session["party_id"] = 1
+        init_party(party_id=1)
+        actions.sign_in(player_name="alice", player_status="noble")
+        actions.sign_in(player_name="bob", player_status="peasant")
+        # a pledge makes two writes, which must be logged in one event
+        actions.pledge(player_name="bob", noble_name="alice")
+        actions.complete_quest(player_name="bob", difficulty="hard", result="Yes")
+
+        state, _ = replay_party(party_id=1)
+        players = [tuple(row) for row in get_db().execute(PLAYERS_QUERY)]
+        query = "select data from game_events where action = 'pledge'"
+        [data] = get_db().execute(query).fetchone()
+    assert len(json.loads(data)["changes"]) == 2
+    assert replayed_players(state) == players
+    assert state.players["bob"].coin > 0
+
+
+def test_failed_batch_is_not_logged(app, game):
+    """Test that rolled back actions never reach the log."""
+    take(
+        game,
+        {"action": "sign_in", "player_name": "dave", "player_status": "peasant"},
+        {"action": "pledge", "player_name": "dave", "noble_name": "nobody"},
+    )
+    with app.app_context():
+        query = "select count(*) from game_events where data like '%dave%'"
+        assert get_db().execute(query).fetchone()[0] == 0
+
+
+def test_snapshots_bound_the_replay(app, party, monkeypatch):
+    """Test that snapshots are saved, and a replay to any event starts from one."""
+    app.config["EVENT_SNAPSHOT_INTERVAL"] = 2
+    client = party._client
+    take(
+        client, {"action": "sign_in", "player_name": "alice", "player_status": "noble"}
+    )
+    take(
+        client, {"action": "sign_in", "player_name": "bob", "player_status": "peasant"}
+    )
+
+    statements = []
+    record_query = query_module.record_query
+    monkeypatch.setattr(
+        query_module,
+        "record_query",
+        lambda query, *args: statements.append(query) or record_query(query, *args),
+    )
+    take(client, {"action": "pledge", "player_name": "bob", "noble_name": "alice"})
+    # the worker counts the events it logs, so commits between snapshots
+    # don't read the log
+    assert not any("party_snapshots" in s for s in statements)
+
+    with app.app_context():
+        db = get_db()
+        snapshots = db.execute("select event_id from party_snapshots").fetchall()
+        assert [row["event_id"] for row in snapshots] == [2]
+
+        statements = []
+        db.set_trace_callback(statements.append)
+        state, until = replay_party(party_id=1, until=3)
+        db.set_trace_callback(None)
+        assert until == 3
+        assert state.players["alice"].soldiers == 2
+        assert any("id > 2" in s for s in statements)
+
+        state, _ = replay_party(party_id=1, until=1)
+        assert list(state.players) == ["alice"]
+
+
+def test_restore_after_bad_write(app, game, runner):
+    """Test that the replay command can undo a write made outside the game."""
+    with app.app_context():
+        db = get_db()
+        players = db.execute(PLAYERS_QUERY).fetchall()
+        db.execute("update players set coin = 1000000")
+        db.commit()
+
+    result = runner.invoke(args=["replay-party", "1"])
+    assert "coin=1000000" not in result.output
+
+    result = runner.invoke(args=["replay-party", "1", "--write"])
+    assert "Restored 3 players" in result.output
+    with app.app_context():
+        db = get_db()
+        assert db.execute(PLAYERS_QUERY).fetchall() == players
+        last = db.execute("select action from game_events order by id desc").fetchone()
+        assert last["action"] == "restore"
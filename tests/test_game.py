@@ -0,0 +1,53 @@
+"""Tests for the pages of the game."""
+import pytest
+
+from nobles_and_peasants import game
+
+
+@pytest.mark.parametrize("path", ["/kingdom", "/leaderboard"])
+def test_unchanged_page_is_not_modified(party, monkeypatch, path):
+    """Test that a page the viewer already has is answered without reading players."""
+    client = party._client
+    client.post("/sign_in", data={"player_name": "a", "player_status": "noble"})
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] in (
+        "private, no-cache",
+        "no-cache, private",
+    )
+    etag = response.headers["ETag"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("players were read")
+
+    for func in ("get_all_players", "get_all_nobles", "render_template"):
+        monkeypatch.setattr(game, func, fail)
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+
+@pytest.mark.parametrize(
+    "path, data",
+    [
+        ("/sign_in", {"player_name": "c", "player_status": "peasant"}),
+        ("/ban", {"noble_name": "a", "peasant_name": "b"}),
+        ("/add_drink", {"drink_name": "wine", "price": 3}),
+        ("/set_coin", {"noble_coin": 40}),
+        ("/set_wages", {"easy": 1, "medium": 2, "hard": 3}),
+        ("/add_quest", {"quest": "Sing a song", "difficulty": "easy"}),
+        ("/add_challenge", {"challenge": "Arm wrestle"}),
+    ],
+)
+def test_write_changes_the_etag(party, path, data):
+    """Test that writes to players, outlaws and settings make pages stale."""
+    client = party._client
+    client.post("/sign_in", data={"player_name": "a", "player_status": "noble"})
+    client.post("/sign_in", data={"player_name": "b", "player_status": "peasant"})
+    etag = client.get("/kingdom").headers["ETag"]
+
+    client.post(path, data=data)
+    response = client.get("/kingdom", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,100 @@
+"""Tests for importing and exporting quests and challenges."""
+import io
+import json
+
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.library import content_disposition
+
+
+def upload(client, url, filename, text):
+    """Upload a file to the import route."""
+    data = {"library": (io.BytesIO(text.encode("utf8")), filename)}
+    return client.post(
+        url, data=data, content_type="multipart/form-data", follow_redirects=True
+    )
+
+
+def count_rows(app, table):
+    """Count the rows in a table for party 1."""
+    with app.app_context():
+        query = f"select count(*) from {table} where party_id = 1"
+        return get_db().execute(query).fetchone()[0]
+
+
+def test_import_quests_csv(client, app, party):
+    """Test that a CSV of quests is added in one commit, skipping duplicates."""
+    num_quests = count_rows(app, "quests")
+    text = (
+        "quest,difficulty\n"
+        "Juggle three drinks.,Hard\n"
+        "Juggle three drinks.,hard\n"
+        "Be a monkey for five minutes.,medium\n"
+    )
+    response = upload(client, "/import_quests", "pack.csv", text)
+    assert b"Success! Added 1 new quests from pack.csv." in response.data
+    assert count_rows(app, "quests") == num_quests + 1
+
+
+def test_import_quests_rejects_unknown_difficulty(client, app, party):
+    """Test that nothing is added when a quest has an unknown difficulty."""
+    num_quests = count_rows(app, "quests")
+    text = json.dumps(
+        [
+            {"quest": "Juggle three drinks.", "difficulty": "easy"},
+            {"quest": "Juggle three knives.", "difficulty": "deadly"},
+        ]
+    )
+    response = upload(client, "/import_quests", "pack.json", text)
+    assert b"You used: deadly." in response.data
+    assert count_rows(app, "quests") == num_quests
+
+
+def test_import_challenges_json(client, app, party):
+    """Test that a JSON list of challenges is added to the party."""
+    num_challenges = count_rows(app, "challenges")
+    text = json.dumps([{"challenge": "DUEL: Thumb war."}, {"challenge": ""}])
+    response = upload(client, "/import_challenges", "pack.json", text)
+    assert b"Row 2 of pack.json is missing a challenge." in response.data
+
+    text = json.dumps([{"challenge": "DUEL: Thumb war."}])
+    upload(client, "/import_challenges", "pack.json", text)
+    assert count_rows(app, "challenges") == num_challenges + 1
+
+
+def test_export_round_trip(client, app, party):
+    """Test that an exported library can be imported into a new party."""
+    response = client.get("/export_quests?format=json")
+    assert response.mimetype == "application/json"
+    assert (
+        response.headers["Content-Disposition"]
+        == 'attachment; filename="party_name_1_quests.json"'
+    )
+    quests = json.loads(response.data)
+    assert len(quests) == count_rows(app, "quests")
+
+    response = client.get("/export_challenges?format=csv")
+    assert response.data.decode("utf8").splitlines()[0] == "challenge"
+
+    response = upload(client, "/import_quests", "quests.json", json.dumps(quests))
+    assert b"Success! Added 0 new quests" in response.data
+
+
+def test_import_keeps_falsy_values(client, app, party):
+    """Test that JSON values like 0 and false are imported, and only null is missing."""
+    num_challenges = count_rows(app, "challenges")
+    text = json.dumps([{"challenge": 0}, {"challenge": False}])
+    response = upload(client, "/import_challenges", "pack.json", text)
+    assert b"Success! Added 2 new challenges" in response.data
+    assert count_rows(app, "challenges") == num_challenges + 2
+
+    text = json.dumps([{"challenge": None}])
+    response = upload(client, "/import_challenges", "pack.json", text)
+    assert b"Row 1 of pack.json is missing a challenge." in response.data
+
+
+def test_content_disposition_quotes_the_name():
+    """Test that download names are quoted, with an encoded copy when not ASCII."""
+    assert content_disposition('a "b".csv') == 'attachment; filename="a \\"b\\".csv"'
+    assert content_disposition("fête.csv") == (
+        "attachment; filename=\"f?te.csv\"; filename*=UTF-8''f%C3%AAte.csv"
+    )
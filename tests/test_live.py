@@ -0,0 +1,127 @@
+"""Tests for streaming changes to the players of a party."""
+import json
+import queue
+import threading
+
+import pytest
+from flask import session
+from nobles_and_peasants.constants import NOBLE, PEASANT
+from nobles_and_peasants import live
+from nobles_and_peasants.db import transaction
+from nobles_and_peasants.live import Subscription, get_broker
+from nobles_and_peasants.players import insert_new_player, increment_coin
+
+
+class Viewer:
+    """Read a party's stream on another thread, like a browser would.
+
+    A stream keeps its request context pushed between events, so it has to
+    be opened and read on a thread of its own.
+    """
+
+    def __init__(self, client):
+        """Open the stream and start reading it."""
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read, args=[client])
+        self.thread.start()
+
+    def _read(self, client):
+        """Queue every event until the viewer is stopped."""
+        response = client.get("/live", buffered=False)
+        for chunk in response.response:
+            if self.stopped.is_set():
+                break
+            if not chunk.startswith(b":"):
+                self.events.put(chunk)
+        response.close()
+
+    def next_event(self):
+        """Get the name and data of the next event."""
+        lines = self.events.get(timeout=5).decode().strip().split("\n")
+        event = lines[0].removeprefix("event: ")
+        return event, json.loads(lines[1].removeprefix("data: "))
+
+    def stop(self):
+        """Close the stream, within one heartbeat."""
+        self.stopped.set()
+        self.thread.join(timeout=5)
+
+
+@pytest.fixture
+def viewer(app, party):
+    """Open the party's stream, after adding two players."""
+    app.config["LIVE_HEARTBEAT_SECONDS"] = 0.05
+    with app.test_request_context():
+        session["party_id"] = 1
+        insert_new_player(player_name="alice", player_status=NOBLE)
+        insert_new_player(player_name="bob", player_status=PEASANT)
+
+    viewer = Viewer(party._client)
+    yield viewer
+    viewer.stop()
+
+
+def test_snapshot_then_changes(app, viewer):
+    """Test that viewers get every player, and then only the players that change."""
+    event, data = viewer.next_event()
+    assert event == "snapshot"
+    coin = {p["player_name"]: p["coin"] for p in data["players"]}
+    assert sorted(coin) == ["alice", "bob"]
+
+    with app.test_request_context():
+        session["party_id"] = 1
+        increment_coin(player_name="bob", coin=5)
+
+    event, data = viewer.next_event()
+    assert event == "players"
+    assert [(p["player_name"], p["coin"]) for p in data["players"]] == [
+        ("bob", coin["bob"] + 5)
+    ]
+
+
+def test_viewers_share_one_snapshot(app, viewer, party, monkeypatch):
+    """Test that a second viewer is sent the snapshot from memory."""
+    viewer.next_event()
+
+    def load_channel(party_id):
+        raise AssertionError("the party was read again")
+
+    monkeypatch.setattr(live, "_load_channel", load_channel)
+    second = Viewer(party._client)
+    event, data = second.next_event()
+    assert event == "snapshot"
+    assert len(data["players"]) == 2
+
+    second.stop()
+    viewer.stop()
+    with app.app_context():
+        assert not get_broker().has_subscribers(1)
+
+
+def test_rolled_back_changes_are_not_sent(app, viewer):
+    """Test that nothing is sent for writes that are rolled back."""
+    viewer.next_event()
+
+    with app.test_request_context():
+        session["party_id"] = 1
+        with pytest.raises(RuntimeError):
+            with transaction():
+                increment_coin(player_name="bob", coin=5)
+                raise RuntimeError()
+        increment_coin(player_name="alice", coin=1)
+
+    _, data = viewer.next_event()
+    assert [p["player_name"] for p in data["players"]] == ["alice"]
+
+
+def test_lagging_viewer_skips_events():
+    """Test that a viewer that falls behind is marked to get a new snapshot."""
+    subscription = Subscription(maxsize=1)
+    subscription.put(b"one")
+    subscription.put(b"two")
+    assert subscription.lagged
+
+    subscription.clear()
+    assert not subscription.lagged
+    assert subscription.get(timeout=0) is None
@@ -0,0 +1,88 @@
+"""Tests for the request and SQL metrics."""
+import logging
+
+from nobles_and_peasants import create_app
+from nobles_and_peasants.metrics import Histogram
+from nobles_and_peasants.passwords import shutdown_hasher
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test that each bucket counts the observations at or below its bound."""
+    histogram = Histogram(buckets=(1, 5))
+    for value in (0.5, 3, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.samples("h", 'route="/"') == [
+        'h_bucket{route="/",le="1"} 1',
+        'h_bucket{route="/",le="5"} 3',
+        'h_bucket{route="/",le="+Inf"} 4',
+        'h_sum{route="/"} 16.5',
+        'h_count{route="/"} 4',
+    ]
+
+
+def test_queries_are_counted_by_route(party):
+    """Test that the statements of each request are counted under its url rule."""
+    client = party._client
+    client.post("/sign_in", data={"player_name": "a", "player_status": "noble"})
+    client.post(
+        "/buy_drink", data={"player_name": "a", "drink_name": "beer", "quantity": 1}
+    )
+
+    metrics = client.get("/metrics")
+    assert metrics.mimetype == "text/plain"
+    text = metrics.get_data(as_text=True)
+    assert (
+        'nobles_and_peasants_responses_total{route="/buy_drink",method="POST",status="302"} 1'
+        in text
+    )
+    assert (
+        'nobles_and_peasants_request_duration_seconds_count{route="/buy_drink",method="POST"} 1'
+        in text
+    )
+    count_line = next(
+        line
+        for line in text.splitlines()
+        if line.startswith(
+            'nobles_and_peasants_request_queries_sum{route="/buy_drink",method="POST"}'
+        )
+    )
+    assert float(count_line.split()[-1]) > 0
+
+
+def test_request_is_logged_with_its_statements(party, caplog):
+    """Test that each request logs its statement count and slowest statement."""
+    with caplog.at_level(logging.INFO):
+        party._client.get("/main")
+
+    [record] = [r for r in caplog.records if r.getMessage().startswith("GET /main")]
+    message = record.getMessage()
+    assert " 200 " in message
+    assert "queries=" in message
+    assert "queries=0" not in message
+    assert '"select' in message
+
+
+def test_hash_stats_are_exported(app, client):
+    """Test that the password hashing stats are exported once the pool is used."""
+    assert "password_hashes_total" not in client.get("/metrics").get_data(as_text=True)
+
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    try:
+        client.post(
+            "/auth/login", data={"party_name": "party_name_1", "password": "maya"}
+        )
+        text = client.get("/metrics").get_data(as_text=True)
+    finally:
+        with app.app_context():
+            shutdown_hasher()
+    assert "nobles_and_peasants_password_hashes_total 1" in text
+
+
+def test_metrics_can_be_turned_off(app):
+    """Test that the metrics route is only added when metrics are enabled."""
+    app = create_app(
+        {"TESTING": True, "DATABASE": app.config["DATABASE"], "METRICS_ENABLED": False}
+    )
+    assert app.test_client().get("/metrics").status_code == 404
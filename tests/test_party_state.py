@@ -0,0 +1,176 @@
+"""Tests for keeping the players of a party in memory."""
+import pytest
+from flask import session
+from nobles_and_peasants.constants import NOBLE, PEASANT
+from nobles_and_peasants.db import get_db, transaction
+from nobles_and_peasants.parties import (
+    bump_party_generation,
+    get_party_generation,
+    init_party,
+)
+from nobles_and_peasants.players import (
+    find_richest_peasant,
+    get_all_nobles,
+    get_almighty_ruler,
+    get_all_players,
+    get_single_player,
+    increment_coin,
+    insert_new_player,
+    update_after_pledge_allegiance,
+)
+
+
+@pytest.fixture
+def party_app(app):
+    """Create an app that keeps party state in memory, with a few players."""
+    app.config["PARTY_STATE_ENABLED"] = True
+    with app.test_request_context():
+        session["party_id"] = 1
+        init_party(party_id=1)
+        insert_new_player(player_name="alice", player_status=NOBLE)
+        insert_new_player(player_name="bob", player_status=PEASANT)
+    return app
+
+
+def test_reads_come_from_memory(party_app):
+    """Test that reading players doesn't query the players table."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        get_all_players()
+
+    statements = []
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        get_db().set_trace_callback(statements.append)
+        assert get_single_player(player_name="alice", col="coin") == 50
+        assert get_single_player(player_name="bob")["player_status"] == PEASANT
+        assert [p.player_name for p in get_all_players()] == ["alice", "bob"]
+        get_db().set_trace_callback(None)
+
+    assert len(statements) == 1
+    assert "party_generations" in statements[0]
+
+
+def test_writes_go_through_to_database(party_app):
+    """Test that a write changes both the memory and the database."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        update_after_pledge_allegiance(player_name="bob", noble_name="alice")
+        assert get_single_player(player_name="alice", col="soldiers") == 2
+
+        row = (
+            get_db()
+            .execute("select soldiers from players where player_name = 'alice'")
+            .fetchone()
+        )
+        assert row["soldiers"] == 2
+
+
+def test_leaderboard_follows_writes(party_app):
+    """Test that nobles move on the leaderboard as their counts change."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        insert_new_player(player_name="carol", player_status=NOBLE)
+        assert get_almighty_ruler() == "alice"
+
+        increment_coin(player_name="carol", coin=1)
+        assert [n.player_name for n in get_all_nobles()] == ["carol", "alice"]
+
+        update_after_pledge_allegiance(player_name="bob", noble_name="alice")
+        assert [n.player_name for n in get_all_nobles(limit=1)] == ["alice"]
+        assert get_almighty_ruler() == "alice"
+
+
+def test_succession_follows_coin(party_app):
+    """Test that the richest peasant is found after every change in wealth."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        insert_new_player(player_name="carol", player_status=PEASANT)
+        insert_new_player(player_name="dave", player_status=PEASANT)
+        increment_coin(player_name="dave", coin=5)
+        increment_coin(player_name="carol", coin=3)
+        assert find_richest_peasant() == "dave"
+
+        increment_coin(player_name="carol", coin=3)
+        assert find_richest_peasant() == "carol"
+
+
+def test_reload_after_write_from_another_worker(party_app):
+    """Test that a party is loaded again when its generation changes."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        assert get_single_player(player_name="bob", col="coin") == 0
+
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        db = get_db()
+        db.execute("update players set coin = 7 where player_name = 'bob'")
+        bump_party_generation(party_id=1)
+
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        assert get_single_player(player_name="bob", col="coin") == 7
+
+
+def test_rollback_discards_memory(party_app):
+    """Test that memory doesn't keep a write that was rolled back."""
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        with pytest.raises(ZeroDivisionError):
+            with transaction():
+                increment_coin(player_name="alice", coin=10)
+                assert get_single_player(player_name="alice", col="coin") == 60
+                1 / 0
+
+        assert get_single_player(player_name="alice", col="coin") == 50
+
+
+def test_other_requests_only_see_committed_writes(party_app):
+    """Test that a write isn't shared with other requests until it commits."""
+
+    def read_coin():
+        # a new app context, so that the request doesn't share this one's g
+        with party_app.app_context(), party_app.test_request_context():
+            session["party_id"] = 1
+            return get_single_player(player_name="alice", col="coin")
+
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        get_all_nobles()
+        with transaction():
+            increment_coin(player_name="alice", coin=10)
+            assert get_single_player(player_name="alice", col="coin") == 60
+            assert read_coin() == 50
+        assert read_coin() == 60
+
+        with pytest.raises(ZeroDivisionError):
+            with transaction():
+                increment_coin(player_name="alice", coin=10)
+                1 / 0
+        assert read_coin() == 60
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_generation_is_bumped_once_per_commit(party_app, enabled):
+    """Test that a commit with several writes bumps the generation once."""
+    party_app.config["PARTY_STATE_ENABLED"] = enabled
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        get_single_player(player_name="alice")
+        before = get_party_generation(party_id=1)
+        with transaction():
+            increment_coin(player_name="alice", coin=1)
+            increment_coin(player_name="bob", coin=1)
+            update_after_pledge_allegiance(player_name="bob", noble_name="alice")
+        assert get_party_generation(party_id=1) == before + 1
+
+    statements = []
+    with party_app.test_request_context():
+        session["party_id"] = 1
+        get_db().set_trace_callback(statements.append)
+        assert get_single_player(player_name="alice", col="coin") == 51
+        assert get_single_player(player_name="bob", col="noble_name") == "alice"
+        get_db().set_trace_callback(None)
+    if enabled:
+        # the state in memory took the commit's generation, so it wasn't reloaded
+        assert len(statements) == 1
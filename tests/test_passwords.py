@@ -0,0 +1,52 @@
+"""Tests for hashing passwords in a process pool."""
+import pytest
+from nobles_and_peasants.passwords import (
+    HashingBusy,
+    check_password,
+    get_hash_stats,
+    hash_password,
+    shutdown_hasher,
+)
+
+
+@pytest.fixture
+def pool_app(app):
+    """Create an app that hashes passwords in a single worker process."""
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    yield app
+    with app.app_context():
+        shutdown_hasher()
+
+
+def test_hash_in_worker_process(pool_app):
+    """Test that hashes made in the pool can be checked, and are timed."""
+    with pool_app.app_context():
+        pwhash = hash_password("maya")
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert check_password(pwhash=pwhash, password="maya")
+        assert not check_password(pwhash=pwhash, password="a")
+
+        stats = get_hash_stats()
+        assert stats.count == 3
+        assert stats.wait_seconds_total >= 0
+
+
+def test_full_queue_turns_hashes_away(pool_app, client):
+    """Test that a login is turned away when the hashing queue is full."""
+    with pool_app.app_context():
+        hash_password("warm up")
+        hasher = pool_app.extensions["nobles_and_peasants.passwords"]
+        while hasher.admission.acquire(blocking=False):
+            pass
+
+        with pytest.raises(HashingBusy):
+            hash_password("maya")
+        assert get_hash_stats().rejected == 1
+
+    response = client.post(
+        "/auth/login",
+        data={"party_name": "party_name_1", "password": "maya"},
+        follow_redirects=True,
+    )
+    assert b"Too many people are logging in at once." in response.data
@@ -0,0 +1,101 @@
+"""Tests for updating the coin of players."""
+import threading
+
+from flask import session
+from nobles_and_peasants import players
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.players import spend_noble_coin, take_coin
+
+
+def sign_in_army(client, drinkers):
+    """Sign in a noble with 40 coin and peasants pledged to them, who drink mead."""
+    client.post("/set_coin", data={"noble_coin": 40})
+    client.post("/add_drink", data={"drink_name": "mead", "price": 2})
+    client.post("/sign_in", data={"player_name": "alice", "player_status": "noble"})
+    for name in drinkers:
+        client.post("/sign_in", data={"player_name": name, "player_status": "peasant"})
+        client.post("/pledge", data={"player_name": name, "noble_name": "alice"})
+
+
+def read_player(player_name):
+    """Read the coin and drinks of a player."""
+    query = "select coin, drinks from players where party_id = 1 and player_name = ?"
+    return tuple(get_db().execute(query, [player_name]).fetchone())
+
+
+def test_concurrent_drinks_are_all_paid_for(app, party):
+    """Test that drinks bought at once each take their coin from the noble."""
+    drinkers = [f"peasant_{i}" for i in range(6)]
+    sign_in_army(party._client, drinkers)
+    cookie = party._client.get_cookie("session")
+
+    def drink(name):
+        client = app.test_client()
+        client.set_cookie("session", cookie.value)
+        for _ in range(3):
+            data = {"player_name": name, "drink_name": "mead", "quantity": 1}
+            assert client.post("/buy_drink", data=data).status_code == 302
+
+    threads = [threading.Thread(target=drink, args=(name,)) for name in drinkers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        assert read_player("alice")[0] == 40 - 18 * 2
+        assert sum(read_player(name)[1] for name in drinkers) == 18
+        query = "select count(*) from game_events where action = 'buy_drink'"
+        assert get_db().execute(query).fetchone()[0] == 18
+
+
+def test_failed_drink_is_not_logged(app, party):
+    """Test that a drink that isn't allowed changes nothing and isn't logged."""
+    client = party._client
+    client.post("/sign_in", data={"player_name": "bob", "player_status": "peasant"})
+    data = {"player_name": "bob", "drink_name": "beer", "quantity": 1}
+    client.post("/buy_drink", data=data)
+    with app.app_context():
+        query = "select count(*) from game_events where action = 'buy_drink'"
+        assert get_db().execute(query).fetchone()[0] == 0
+
+
+def test_coin_updates_check_what_they_read(app, party):
+    """Test that coin isn't taken once what was read about the player is stale."""
+    sign_in_army(party._client, ["bob"])
+    party._client.post(
+        "/sign_in", data={"player_name": "dave", "player_status": "noble"}
+    )
+    with app.test_request_context():
+        session["party_id"] = 1
+        # bob is allied to alice, not dave
+        assert spend_noble_coin(player_name="bob", noble_name="dave", coin=5) is None
+        assert spend_noble_coin(player_name="bob", noble_name="alice", coin=5) == 35
+        assert take_coin(player_name="alice", coin=36) is None
+        assert take_coin(player_name="alice", coin=35) == 0
+        assert read_player("alice")[0] == 0
+        assert read_player("dave")[0] == 40
+
+
+def test_coin_conflict_fails_the_action(app, party, monkeypatch):
+    """Test that a coin update that keeps losing fails the action and changes nothing."""
+    sign_in_army(party._client, ["bob"])
+
+    def conflict(from_name, to_name, commit=True):
+        raise players.CoinConflictError(f"The coin of {from_name} kept changing.")
+
+    monkeypatch.setattr(players, "move_coin_between_players", conflict)
+
+    data = {"player_name": "bob", "target_name": "alice", "winner_name": "bob"}
+    response = party._client.post("/assassinate", data=data, follow_redirects=True)
+    assert b"Please try again." in response.data
+
+    data = {"player_name": "bob", "drink_name": "mead", "quantity": 20}
+    response = party._client.post("/buy_drink", data=data, follow_redirects=True)
+    assert b"Please try again." in response.data
+
+    with app.app_context():
+        assert read_player("alice") == (40, 0)
+        assert read_player("bob")[1] == 0
+        query = "select count(*) from game_events where action != 'sign_in'"
+        assert get_db().execute(query).fetchone()[0] == 1
@@ -0,0 +1,47 @@
+"""Tests for caching the settings of a party."""
+from flask import session
+from nobles_and_peasants.db import get_db
+from nobles_and_peasants.drinks import (
+    add_or_update_drink_name_and_cost,
+    get_cost_for_a_drink,
+    get_drink_name_and_cost,
+)
+from nobles_and_peasants.parties import init_party
+from nobles_and_peasants.quest_rewards import get_reward_for_difficulty
+from nobles_and_peasants.starting_coin import (
+    get_starting_coin_for_status,
+    update_noble_starting_coin,
+)
+
+
+def test_settings_load_in_one_query(app):
+    """Test that every setting comes from a single query, then from memory."""
+    with app.app_context():
+        init_party(party_id=1)
+
+    statements = []
+    with app.test_request_context():
+        session["party_id"] = 1
+        get_db().set_trace_callback(statements.append)
+        assert get_cost_for_a_drink(drink_name="beer") == 3
+        assert get_starting_coin_for_status(player_status="noble") == 50
+        assert get_reward_for_difficulty(difficulty="hard") == 25
+        assert get_cost_for_a_drink(drink_name="wine") is None
+        get_db().set_trace_callback(None)
+
+    assert len(statements) == 1
+
+
+def test_changing_a_setting_discards_the_cache(app):
+    """Test that a new setting is seen right after it is saved."""
+    with app.test_request_context():
+        session["party_id"] = 1
+        init_party(party_id=1)
+        assert get_starting_coin_for_status(player_status="noble") == 50
+
+        update_noble_starting_coin(noble_coin=70)
+        assert get_starting_coin_for_status(player_status="noble") == 70
+
+        add_or_update_drink_name_and_cost(drink_name="wine", drink_cost=1)
+        drinks = [d["drink_name"] for d in get_drink_name_and_cost()]
+        assert drinks == ["water", "wine", "beer"]
@@ -0,0 +1,179 @@
+"""Tests for giving each party a database file of its own."""
+import os
+
+import pytest
+from nobles_and_peasants import create_app
+from nobles_and_peasants.db import (
+    expire_idle_parties,
+    get_db,
+    get_schema_version,
+    get_shard_party_ids,
+    use_database,
+)
+from nobles_and_peasants.parties import init_party
+
+
+@pytest.fixture
+def sharded_app(app, tmp_path):
+    """Turn on sharding for the test app."""
+    app.config["DB_SHARDS_FOLDER"] = str(tmp_path / "shards")
+    return app
+
+
+def count_players(party_id=None):
+    """Count the players in the directory, or in the shard of a party."""
+    with use_database(party_id):
+        return get_db().execute("select count(*) from players").fetchone()[0]
+
+
+def test_split_db_moves_parties_into_shards(sharded_app, runner, auth, client):
+    """Test that split-db copies every party into its own file, and prunes them."""
+    with sharded_app.app_context():
+        init_party(party_id=1)
+        players_before = count_players()
+
+    result = runner.invoke(args=["split-db", "--prune"])
+    assert "Split 2 parties." in result.output
+
+    with sharded_app.app_context():
+        assert get_shard_party_ids() == [1, 2]
+        assert count_players() == 0
+        assert count_players(1) + count_players(2) == players_before
+        with use_database():
+            assert get_db().execute("select count(*) from parties").fetchone()[0] == 2
+
+    auth.login(party_name="party_name_1", password="maya")
+    client.post("/sign_in", data={"player_name": "zed", "player_status": "noble"})
+    assert b"zed" in client.get("/kingdom").data
+    with sharded_app.app_context():
+        assert count_players() == 0
+
+    result = runner.invoke(args=["split-db"])
+    assert "Skipped party 1" in result.output
+    assert "Split 0 parties." in result.output
+
+
+def test_signup_creates_a_shard(sharded_app, client):
+    """Test that a new party gets a database file with its default content."""
+    data = {"party_name": "sharded", "password": "pw"}
+    client.post("/auth/signup", data=data, follow_redirects=True)
+    client.post("/auth/login", data=data)
+
+    with sharded_app.app_context():
+        [party_id] = get_shard_party_ids()
+        with use_database(party_id):
+            assert get_db().execute("select count(*) from quests").fetchone()[0] > 0
+
+    client.post("/sign_in", data={"player_name": "zed", "player_status": "noble"})
+    with sharded_app.app_context():
+        assert count_players(party_id) == 1
+        with use_database():
+            query = "select count(*) from players where player_name = 'zed'"
+            assert get_db().execute(query).fetchone()[0] == 0
+
+
+def test_migrate_updates_every_shard(sharded_app, runner):
+    """Test that migrate brings the shards to the schema version of the directory."""
+    runner.invoke(args=["split-db"])
+    with sharded_app.app_context():
+        with use_database(1):
+            get_db().execute("pragma user_version = 1")
+    result = runner.invoke(args=["migrate"])
+    assert "to party 1." in result.output
+
+    with sharded_app.app_context():
+        with use_database():
+            version = get_schema_version()
+        for party_id in get_shard_party_ids():
+            with use_database(party_id):
+                assert get_schema_version() == version
+
+
+def test_party_without_shard_fails(sharded_app, client):
+    """Test that a party that wasn't split is an error instead of an empty party."""
+    client.post("/auth/login", data={"party_name": "party_name_1", "password": "maya"})
+    with pytest.raises(RuntimeError, match="split-db"):
+        client.get("/kingdom")
+
+
+def test_split_db_needs_a_folder(runner):
+    """Test that split-db refuses to run without a shards folder."""
+    result = runner.invoke(args=["split-db"])
+    assert result.exit_code != 0
+    assert "DB_SHARDS_FOLDER" in result.output
+
+
+def test_init_db_removes_shards(sharded_app, runner):
+    """Test that init-db starts over without any party files."""
+    runner.invoke(args=["split-db"])
+    runner.invoke(args=["init-db"])
+    assert os.listdir(sharded_app.config["DB_SHARDS_FOLDER"]) == []
+
+
+def test_shards_in_memory(tmp_path):
+    """Test that the party files of a memory backend app are kept in memory."""
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": str(tmp_path / "directory.sqlite"),
+            "DB_BACKEND": "memory",
+            "DB_SHARDS_FOLDER": str(tmp_path / "shards"),
+            "PASSWORD_HASH_WORKERS": 0,
+        }
+    )
+    runner = app.test_cli_runner()
+    runner.invoke(args=["init-db"])
+    client = app.test_client()
+    data = {"party_name": "quick", "password": "pw"}
+    client.post("/auth/signup", data=data)
+    client.post("/auth/login", data=data)
+    client.post("/sign_in", data={"player_name": "zed", "player_status": "noble"})
+
+    with app.app_context():
+        [party_id] = get_shard_party_ids()
+        assert count_players(party_id) == 1
+    assert os.listdir(tmp_path) == []
+
+    runner.invoke(args=["init-db"])
+    with app.app_context():
+        assert get_shard_party_ids() == []
+
+
+def test_quick_party_in_memory(sharded_app, client):
+    """Test that a quick party is kept in memory next to parties on disk, until idle."""
+    data = {"party_name": "quick", "password": "pw", "quick": "on"}
+    client.post("/auth/signup", data=data)
+    client.post("/auth/signup", data={"party_name": "slow", "password": "pw"})
+    client.post("/auth/login", data=data)
+    client.post("/sign_in", data={"player_name": "zed", "player_status": "noble"})
+    assert b"zed" in client.get("/kingdom").data
+
+    with sharded_app.app_context():
+        quick_id, slow_id = get_shard_party_ids()
+        assert count_players(quick_id) == 1
+        files = os.listdir(sharded_app.config["DB_SHARDS_FOLDER"])
+        assert f"party_{slow_id}.sqlite" in files
+        assert not any(name.startswith(f"party_{quick_id}.") for name in files)
+        assert expire_idle_parties() == []
+        sharded_app.config["DB_MEMORY_IDLE_SECONDS"] = 0
+        assert expire_idle_parties() == [quick_id]
+        assert get_shard_party_ids() == [slow_id]
+        with use_database():
+            query = "select count(*) from parties where party_name = 'quick'"
+            assert get_db().execute(query).fetchone()[0] == 0
+
+    # the viewer is logged out instead of playing a party that is gone
+    response = client.get("/kingdom")
+    assert response.headers["Location"].endswith("/auth/login")
+
+
+def test_quick_party_lost_on_restart(sharded_app, client):
+    """Test that a quick party whose shard is gone is dropped from the directory."""
+    data = {"party_name": "quick", "password": "pw", "quick": "on"}
+    client.post("/auth/signup", data=data)
+    sharded_app.extensions["nobles_and_peasants.memory"].close()
+
+    with sharded_app.app_context():
+        assert len(expire_idle_parties()) == 1
+    response = client.post("/auth/login", data=data, follow_redirects=True)
+    assert b"has not been registered yet" in response.data
@@ -0,0 +1,70 @@
+"""Tests for logging slow and repeated SQL statements."""
+import logging
+
+from nobles_and_peasants.slow_queries import fingerprint
+
+
+def test_fingerprint_ignores_whitespace_and_literals():
+    """Test that the same query with other literals has the same fingerprint."""
+    normalized, digest = fingerprint(
+        """
+        select coin
+        from players
+        where party_id = 1
+            and player_name = 'bob'
+            and id in (?, ?, ?)
+        """
+    )
+    assert normalized == (
+        "select coin from players where party_id = ? and player_name = ? and id in (...)"
+    )
+    other = fingerprint(
+        "select coin from players where party_id = 22 and player_name = 'it''s' and id in (?)"
+    )
+    assert other[1] == digest
+
+
+def test_slow_query_is_logged_with_its_plan(app, party, caplog):
+    """Test that a slow statement is logged with its params and query plan."""
+    app.config["SLOW_QUERY_SECONDS"] = 0
+    with caplog.at_level(logging.WARNING):
+        party._client.get("/main")
+
+    messages = [
+        r.getMessage() for r in caplog.records if r.getMessage().startswith("slow")
+    ]
+    [message] = [m for m in messages if "from players" in m and "order by" in m]
+    assert "params: [1]" in message
+    assert "plan: SEARCH players USING INDEX" in message
+
+    text = party._client.get("/metrics").get_data(as_text=True)
+    assert "nobles_and_peasants_slow_queries_total{fingerprint=" in text
+
+
+def test_repeated_query_is_logged(app, party, caplog):
+    """Test that a pledge is flagged for reading players one at a time."""
+    client = party._client
+    client.post("/sign_in", data={"player_name": "a", "player_status": "noble"})
+    client.post("/sign_in", data={"player_name": "b", "player_status": "peasant"})
+    with caplog.at_level(logging.WARNING):
+        client.post("/pledge", data={"player_name": "b", "noble_name": "a"})
+
+    [message] = [
+        r.getMessage()
+        for r in caplog.records
+        if r.getMessage().startswith("repeated")
+        and "select id, player_status" in r.getMessage()
+    ]
+    assert "ran 3 times in POST /pledge" in message
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert (
+        'nobles_and_peasants_repeated_queries_total{route="/pledge",fingerprint='
+        in text
+    )
+
+    app.config["SLOW_QUERY_REPEATS"] = None
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        client.post("/pledge", data={"player_name": "b", "noble_name": "a"})
+    assert not [r for r in caplog.records if r.getMessage().startswith("repeated")]